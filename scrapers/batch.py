@@ -0,0 +1,194 @@
+import asyncio
+import time
+from contextlib import aclosing
+from functools import partial
+from urllib.parse import urlsplit
+
+import metrics
+from macmillian import MacMillianDictScraper
+from singleflight import canonical_url, AsyncSingleFlight
+from transport import default_transport
+
+
+class RateLimiter():
+    """Spaces the start of requests so that at most `rate`
+    requests per second are made.
+    """
+    def __init__(self, rate: float):
+        self.interval  = 0 if not rate else 1 / rate
+        self._next     = 0.0
+        self._lock     = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class HostLimits():
+    """Per-host concurrency limit and rate limiter.
+
+    Attributes:
+        per_host    maximum number of requests in flight per host
+        rate        maximum number of requests per second per host
+    """
+    def __init__(self, per_host=4, rate=2.0):
+        self.per_host = per_host
+        self.rate     = rate
+        self._hosts   = {}
+
+    def get(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = (asyncio.Semaphore(self.per_host), RateLimiter(self.rate))
+        return self._hosts[host]
+
+
+class BatchLookup():
+    """Looks up many words concurrently with MacMillianDictScraper.
+
+    Pages are fetched in worker threads through the scraper transport,
+    the parsing is left to the scraper itself.
+
+    Related entries are fetched and parsed through `memo`, keyed by
+    their canonical url: by default an AsyncSingleFlight, so lookups
+    running at the same time share the fetch of a common related entry;
+    pass an AsyncBatchMemo to also parse each of them once per batch.
+    """
+    scraper_class = MacMillianDictScraper
+
+    def __init__(self, dial=None, concurrency=8, per_host=4, rate=2.0,
+            transport=None, cache=None, entry_cache=None, recursive=True, memo=None,
+            speller=None):
+        self.dial        = dial
+        self.concurrency = concurrency
+        self.recursive   = recursive
+        self.transport   = default_transport() if transport is None else transport
+        self.cache       = cache
+        self.entry_cache = entry_cache
+        self.limits      = HostLimits(per_host=per_host, rate=rate)
+        self.memo        = AsyncSingleFlight() if memo is None else memo
+        self.speller     = speller
+
+    async def fetch(self, scraper):
+        # fresh cached pages do not count against the host limits
+        if self.cache is not None and self.cache.is_fresh(scraper.cache_key()):
+            await asyncio.to_thread(scraper.load)
+            return scraper
+
+        semaphore, rate_limiter = self.limits.get(scraper.full_url())
+        async with semaphore:
+            await rate_limiter.acquire()
+            await asyncio.to_thread(scraper.load)
+        return scraper
+
+    async def lookup(self, word):
+        with metrics.lookup():
+            scraper = self.scraper_class(
+                word, dial=self.dial, recursive=self.recursive,
+                transport=self.transport, cache=self.cache,
+                entry_cache=self.entry_cache, speller=self.speller
+            )
+            offline_error = scraper.resolve_spelling()
+            if offline_error is not None:
+                return offline_error
+
+            if self.entry_cache is not None:
+                sanitized_data = self.entry_cache.get(scraper.entry_key())
+                if sanitized_data is not None:
+                    return sanitized_data
+
+            sanitized_data = await self._lookup(scraper)
+            # entries missing related pages or senses are not stored
+            if self.entry_cache is not None and not scraper.related_missing and not scraper.salvage_errors:
+                self.entry_cache.put(scraper.entry_key(), sanitized_data)
+            return sanitized_data
+
+    async def _lookup(self, scraper):
+        await self.fetch(scraper)
+        if await asyncio.to_thread(scraper.is_error_page):
+            return await asyncio.to_thread(scraper.parse_error_page)
+
+        sanitized_main_entry = await asyncio.to_thread(scraper.scrape_word_page)
+        sanitized_entries = [sanitized_main_entry]
+        if not self.recursive:
+            return sanitized_entries
+
+        # fetch the related pages concurrently, keeping their order
+        list_slugs = await asyncio.to_thread(
+            scraper.related_slugs, sanitized_main_entry.word
+        )
+        list_related = [scraper.related_scraper(slug) for slug in list_slugs]
+        metrics.increment('related', len(list_related))
+        list_results = await asyncio.gather(*(
+            self.memo.do(
+                canonical_url(related.full_url()), partial(self._lookup_related, related)
+            )
+            for related in list_related
+        ))
+        for sanitized_data in list_results:
+            sanitized_entries.extend(sanitized_data)
+        return sanitized_entries
+
+    async def _lookup_related(self, scraper):
+        if scraper.entry_cache is None or scraper.entry_key() not in scraper.entry_cache:
+            await self.fetch(scraper)
+        return await asyncio.to_thread(scraper.extract)
+
+    async def lookup_indexed(self, words, return_exceptions=False):
+        """
+        Yields (index, word, result) tuples as the lookups complete,
+        where index is the position of word in the words iterable and
+        result is a list of DictEntry objects or an ErrorList.
+
+        At most `concurrency` words are in flight at a time and the
+        words iterable is consumed lazily. The lookups in flight are
+        cancelled when the generator is closed: consumers that may stop
+        early should iterate it in contextlib.aclosing.
+        """
+        iter_words = enumerate(words)
+        pending = {}
+
+        def schedule():
+            for index, word in iter_words:
+                pending[asyncio.ensure_future(self.lookup(word))] = (index, word)
+                if len(pending) >= self.concurrency:
+                    break
+
+        schedule()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, word = pending.pop(task)
+                    if task.exception() is not None and not return_exceptions:
+                        raise task.exception()
+                    yield index, word, task.exception() or task.result()
+                schedule()
+        finally:
+            # the consumer stopped early (break, error) or a lookup
+            # failed: the lookups still scheduled must not keep running
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def lookup_many(self, words, return_exceptions=False):
+        """Yields (word, result) tuples as the lookups complete"""
+        async with aclosing(self.lookup_indexed(words, return_exceptions)) as results:
+            async for _, word, result in results:
+                yield word, result
+
+def lookup_many(words, dial=None, concurrency=8, per_host=4, rate=2.0,
+        transport=None, cache=None, entry_cache=None, recursive=True,
+        memo=None, speller=None, return_exceptions=False):
+    """Async generator of (word, result) tuples. See BatchLookup."""
+    batch = BatchLookup(
+        dial=dial, concurrency=concurrency, per_host=per_host, rate=rate,
+        transport=transport, cache=cache, entry_cache=entry_cache,
+        recursive=recursive, memo=memo, speller=speller
+    )
+    return batch.lookup_many(words, return_exceptions=return_exceptions)
@@ -0,0 +1,790 @@
+"""Benchmarks for the scrapers, run on a corpus of saved MacMillan pages.
+
+The corpus is a directory with one sub-directory per page category,
+e.g. small/, huge/ (polysemous entries such as set or run) and error/:
+
+    python benchmark.py record corpus/ run set walk runx
+    python benchmark.py suite corpus/ --save baseline.json
+    python benchmark.py suite corpus/ --compare baseline.json
+    python benchmark.py engines corpus/huge/*.html
+    python benchmark.py pipeline corpus/ --workers 1 2 4 8
+    python benchmark.py memory corpus/ --copies 2000
+    python benchmark.py throttle --capacity 20 --requests 300
+    python benchmark.py decode corpus/huge/*.html
+    python benchmark.py serve corpus/ --clients 8 --requests 2000
+    python benchmark.py importtime models cache viewhtml macmillian
+    python benchmark.py snapshot corpus/ --copies 1000 --changed 20
+    python benchmark.py faults corpus/ --words 400 --failure-rate 0.2
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from urllib.parse import urlsplit
+
+import lxml.html
+from bs4 import BeautifulSoup as Soup
+
+import serialize
+from compact import EntryStore
+from macmillian import MacMillianDictScraper
+from pipeline import ParsePipeline
+from runner import BatchRunner, BreakerTransport, DeadLetters, read_dead_letters
+from scheduler import Scheduler, INTERACTIVE, BULK
+from server import LookupService, LookupServer
+from snapshot import SnapshotStore
+from stubs import page_scraper, load_corpus, corpus_words, corrupt_pages, ReplayServer, ThrottlingServer
+from transport import Transport, make_response, default_transport
+from viewhtml import DictEntryToHTML
+
+
+# pages with more sense bodies than this are recorded as huge
+HUGE_PAGE_SENSES = 40
+
+
+class RecordingTransport():
+    """Wraps a transport and keeps every response it returns"""
+    def __init__(self, transport):
+        self.transport = transport
+        self.responses = []
+
+    def get(self, url, timeout=None, headers=None):
+        response = self.transport.get(url, timeout=timeout, headers=headers)
+        self.responses.append(response)
+        return response
+
+
+def record(directory, words, dial=None):
+    """
+    Looks up words on the live site and saves every page fetched
+    (search results and related entries) in the corpus directory
+    """
+    for word in words:
+        transport = RecordingTransport(default_transport())
+        MacMillianDictScraper(word, dial=dial, transport=transport).extract()
+        for response in transport.responses:
+            scraper = page_scraper('', content=response.content)
+            if scraper.is_error_page():
+                category, name = 'error', f'search-{word}'
+            else:
+                num_senses = len(scraper.html().select('.SENSE-BODY, .SUB-SENSE-BODY'))
+                category = 'huge' if num_senses > HUGE_PAGE_SENSES else 'small'
+                name = urlsplit(response.url).path.rstrip('/').split('/')[-1]
+            os.makedirs(os.path.join(directory, category), exist_ok=True)
+            with open(os.path.join(directory, category, name + '.html'), 'wb') as file:
+                file.write(response.content)
+            print(f'{category}/{name}.html', file=sys.stderr)
+
+
+def bench_throttle(capacity=20.0, num_requests=300, threads=16, interactive_every=0.25):
+    """
+    Sends num_requests bulk requests from `threads` threads to a
+    ThrottlingServer, plus an interactive request every
+    `interactive_every` seconds, once with a plain Transport and once
+    through a Scheduler. Returns one row per mode.
+    """
+    list_rows = []
+    for mode in ('plain', 'scheduled'):
+        with ThrottlingServer(capacity=capacity) as server:
+            if mode == 'plain':
+                plain = Transport(pool_maxsize=threads, retries=3, backoff_factor=0.1)
+                bulk_transport = interactive_transport = plain
+            else:
+                scheduler = Scheduler(rate=capacity, burst=4, max_concurrency=threads)
+                bulk_transport = scheduler.transport(BULK)
+                interactive_transport = scheduler.transport(INTERACTIVE)
+
+            list_latencies = []
+            done = threading.Event()
+
+            def interactive():
+                while not done.wait(interactive_every):
+                    start = time.perf_counter()
+                    interactive_transport.get(server.base_url + '/interactive', timeout=30)
+                    list_latencies.append(time.perf_counter() - start)
+
+            interactive_thread = threading.Thread(target=interactive)
+            interactive_thread.start()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                list_statuses = list(pool.map(
+                    lambda index: bulk_transport.get(f'{server.base_url}/bulk/{index}', timeout=30).status_code,
+                    range(num_requests)
+                ))
+            elapsed = time.perf_counter() - start
+            done.set()
+            interactive_thread.join()
+
+            list_latencies.sort()
+            list_rows.append({
+                'mode': mode,
+                'ok': list_statuses.count(200),
+                'failed': len(list_statuses) - list_statuses.count(200),
+                'requests_per_sec': list_statuses.count(200) / elapsed,
+                'served_429': server.throttled,
+                'interactive_p50_ms': _percentile(list_latencies, 50) * 1000 if list_latencies else 0.0,
+                'interactive_p99_ms': _percentile(list_latencies, 99) * 1000 if list_latencies else 0.0,
+            })
+    return list_rows
+
+
+def bench_serve(directory, clients=8, num_requests=2000, delay=0.05):
+    """
+    Load test of the lookup server on a ReplayServer answering in
+    `delay` seconds: `clients` threads send num_requests /lookup
+    requests for the corpus words over keep-alive connections, first
+    all for the same word on a cold server (coalesced), then spread
+    over all the words. As a baseline, the same lookups are made with
+    a new MacMillianDictScraper each, the way a script importing the
+    scrapers does. Returns one row per phase.
+    """
+    list_words = corpus_words(directory)
+    list_rows = []
+    with ReplayServer(directory, delay=delay) as replay:
+        scraper_class = replay.scraper_class()
+        transport = Transport(pool_maxsize=clients)
+
+        def run_phase(phase, request, list_phase_words):
+            list_latencies = []
+            requests_before = replay.requests
+
+            def client(offset):
+                send = request()
+                for index in range(offset, len(list_phase_words), clients):
+                    start = time.perf_counter()
+                    send(list_phase_words[index])
+                    list_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(clients) as pool:
+                list(pool.map(client, range(clients)))
+            elapsed = time.perf_counter() - start
+            list_latencies.sort()
+            list_rows.append({
+                'phase': phase,
+                'requests': len(list_latencies),
+                'requests_per_sec': len(list_latencies) / elapsed,
+                'p50_ms': _percentile(list_latencies, 50) * 1000,
+                'p99_ms': _percentile(list_latencies, 99) * 1000,
+                'upstream': replay.requests - requests_before,
+            })
+
+        def direct():
+            return lambda word: scraper_class(word, transport=transport, engine='lxml').extract()
+
+        baseline_words = [list_words[index % len(list_words)] for index in range(min(num_requests, 20 * clients))]
+        run_phase('scraper per lookup', direct, baseline_words)
+
+        service = LookupService(transport=transport, workers=clients)
+        service.scraper_class = scraper_class
+        server = LookupServer(service, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        host, port = server.server_address
+
+        def over_http():
+            connection = http.client.HTTPConnection(host, port)
+
+            def send(word):
+                connection.request('GET', f'/lookup?word={word}')
+                response = connection.getresponse()
+                response.read()
+                if response.status not in (200, 404):
+                    raise RuntimeError(f'{word}: HTTP {response.status}')
+            return send
+
+        try:
+            run_phase('server, same word', over_http, [list_words[0]] * (4 * clients))
+            run_phase('server, warm', over_http, [
+                list_words[index % len(list_words)] for index in range(num_requests)
+            ])
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.close()
+    return list_rows
+
+
+# the HTTP and HTML-parsing stack, which should load on first fetch or parse
+HEAVY_MODULES = ('requests', 'urllib3', 'bs4', 'lxml', 'cchardet', 'asyncio')
+
+
+def bench_importtime(list_modules, repeat=5):
+    """
+    Imports each module in a fresh interpreter with -X importtime,
+    `repeat` times. Returns one row per module with the best cumulative
+    import time and the heavy modules it loaded.
+    """
+    list_rows = []
+    for module in list_modules:
+        list_times = []
+        list_heavy = []
+        for _ in range(repeat):
+            completed = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True, check=True
+            )
+            for line in completed.stderr.splitlines():
+                if not line.startswith('import time:') or '|' not in line:
+                    continue
+                _, cumulative, name = line.split('|')
+                name = name.strip()
+                if name == module:
+                    list_times.append(int(cumulative) / 1000)
+                if name in HEAVY_MODULES and name not in list_heavy:
+                    list_heavy.append(name)
+        list_rows.append({
+            'module': module,
+            'import_ms': min(list_times),
+            'heavy': list_heavy,
+        })
+    return list_rows
+
+
+def _percentile(list_sorted, percent):
+    index = min(len(list_sorted) - 1, round(percent / 100 * (len(list_sorted) - 1)))
+    return list_sorted[index]
+
+
+def measure(name, func, items, repeat=3):
+    """
+    Calls func on every item, `repeat` times, and returns the
+    throughput (calls per second), the p50/p99 latency (ms) and the
+    peak memory (KiB) allocated by one extra, traced pass
+    """
+    items = list(items)
+    list_times = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            func(item)
+            list_times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    for item in items:
+        func(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    list_times.sort()
+    return {
+        'name': name,
+        'calls': len(list_times),
+        'ops_per_sec': len(list_times) / sum(list_times) if sum(list_times) else 0.0,
+        'p50_ms': _percentile(list_times, 50) * 1000,
+        'p99_ms': _percentile(list_times, 99) * 1000,
+        'peak_kib': peak / 1024,
+    }
+
+
+def _read_pages(list_pages):
+    list_contents = []
+    for category, path in list_pages:
+        with open(path, 'rb') as file:
+            list_contents.append((category, path, file.read()))
+    return list_contents
+
+
+def bench_parsing(list_contents, repeat=3, engine='bs4'):
+    """Benchmarks each scrape_* stage on already downloaded pages"""
+    list_results = []
+    list_categories = sorted({category for category, _, _ in list_contents})
+    for category in list_categories:
+        list_pages = [
+            (path, content) for page_category, path, content in list_contents
+            if page_category == category
+        ]
+        list_word_pages = [
+            page for page in list_pages if not page_scraper(page[0], content=page[1]).is_error_page()
+        ]
+        list_error_pages = [page for page in list_pages if page not in list_word_pages]
+
+        def html(page):
+            page_scraper(page[0], engine=engine, content=page[1]).html()
+
+        def scrape_word_page(page):
+            page_scraper(page[0], engine=engine, content=page[1]).scrape_word_page()
+
+        def scrape_error_page(page):
+            page_scraper(page[0], engine=engine, content=page[1]).scrape_error_page()
+
+        # sense and example elements are selected outside of the timed call
+        list_senses = []
+        list_examples = []
+        for page in list_word_pages:
+            scraper = page_scraper(page[0], content=page[1])
+            senses = scraper.html().select('.SENSE-BODY, .SUB-SENSE-BODY')
+            list_senses.append((scraper, senses))
+            for sense in senses:
+                examples = sense.find_all('div', class_='EXAMPLES')
+                if examples:
+                    list_examples.append((scraper, examples))
+
+        if list_word_pages:
+            list_results.append(measure(f'{category}/html', html, list_word_pages, repeat))
+            list_results.append(measure(f'{category}/scrape_word_page', scrape_word_page, list_word_pages, repeat))
+            list_results.append(measure(
+                f'{category}/scrape_defns',
+                lambda item: item[0].scrape_defns(item[1]), list_senses, repeat
+            ))
+        if list_examples:
+            list_results.append(measure(
+                f'{category}/scrape_defn_examples',
+                lambda item: item[0].scrape_defn_examples(item[1]), list_examples, repeat
+            ))
+        if list_error_pages:
+            list_results.append(measure(f'{category}/scrape_error_page', scrape_error_page, list_error_pages, repeat))
+    return list_results
+
+
+def bench_rendering(list_contents, repeat=3):
+    """Benchmarks DictEntryToHTML (tree and streamed) on the entries of the corpus"""
+    list_entries = []
+    for _, path, content in list_contents:
+        scraper = page_scraper(path, content=content)
+        if not scraper.is_error_page():
+            list_entries.append(scraper.scrape_word_page())
+    if not list_entries:
+        return []
+    return [
+        measure('render/DictEntryToHTML.convert', lambda entry: DictEntryToHTML(entry).convert(), list_entries, repeat),
+        measure('render/DictEntryToHTML.stream', lambda entry: ''.join(DictEntryToHTML(entry).stream()), list_entries, repeat),
+    ]
+
+
+def bench_lookups(directory, repeat=3, engine='bs4'):
+    """Benchmarks full lookups (fetch, parse, related entries)
+    against a local replay server"""
+    with ReplayServer(directory) as server:
+        scraper_class = server.scraper_class()
+        list_words = [
+            name[len('search-'):] if name.startswith('search-') else name.rsplit('_', 1)[0]
+            for name in server.pages
+        ]
+        list_words = list(dict.fromkeys(list_words))
+
+        def lookup(word):
+            scraper_class(word, engine=engine).extract()
+
+        return [measure('end-to-end/lookup', lookup, list_words, repeat)]
+
+
+def run_suite(directory, repeat=3, engine='bs4'):
+    list_contents = _read_pages(load_corpus(directory))
+    list_results = []
+    list_results.extend(bench_parsing(list_contents, repeat=repeat, engine=engine))
+    list_results.extend(bench_rendering(list_contents, repeat=repeat))
+    list_results.extend(bench_lookups(directory, repeat=repeat, engine=engine))
+    return list_results
+
+
+def bench_pipeline(directory, list_workers, rounds=20, engine='bs4'):
+    """
+    Looks up every word of the corpus `rounds` times through a
+    ParsePipeline with each number of parser processes, and returns
+    (workers, words per second) tuples
+    """
+    list_rows = []
+    with ReplayServer(directory) as server:
+        scraper_class = server.scraper_class()
+        list_words = list(dict.fromkeys(
+            name[len('search-'):] if name.startswith('search-') else name.rsplit('_', 1)[0]
+            for name in server.pages
+        ))
+        for workers in list_workers:
+            pipeline = ParsePipeline(parse_workers=workers, engine=engine)
+            pipeline.scraper_class = scraper_class
+            start = time.perf_counter()
+            num_words = sum(1 for _ in pipeline.run(list_words * rounds))
+            list_rows.append((workers, num_words / (time.perf_counter() - start)))
+    return list_rows
+
+
+def bench_memory(directory, copies=1000, engine='bs4'):
+    """
+    Keeps `copies` copies of the entries of the corpus in memory, as
+    dataclass trees and in an EntryStore, and returns the memory (KiB)
+    each one takes, the time (ms) to build the entries back from the
+    store and whether they are equal to the originals
+    """
+    list_entries = []
+    for category, path in load_corpus(directory):
+        if category != 'error':
+            list_entries.extend(page_scraper(path, engine=engine).extract())
+    # each copy has its own objects, like entries scraped one by one
+    list_encoded = [serialize.encode(dict_entry) for dict_entry in list_entries] * copies
+
+    tracemalloc.start()
+    list_trees = [serialize.decode(encoded) for encoded in list_encoded]
+    trees_kib = tracemalloc.get_traced_memory()[0] / 1024
+    tracemalloc.stop()
+    del list_trees
+
+    tracemalloc.start()
+    store = EntryStore()
+    for encoded in list_encoded:
+        store.add(serialize.decode(encoded))
+    store_kib = tracemalloc.get_traced_memory()[0] / 1024
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    identical = all(dict_entry == list_entries[entry_id % len(list_entries)] for entry_id, dict_entry in enumerate(store))
+    return {
+        'entries': len(store),
+        'trees_kib': trees_kib,
+        'store_kib': store_kib,
+        'materialize_ms': (time.perf_counter() - start) * 1000,
+        'identical': identical,
+    }
+
+
+def bench_snapshot(directory, copies=1000, changed=20, engine='lxml'):
+    """
+    Publishes `copies` copies of the entries of the corpus (each under
+    its own headword) as a snapshot, then publishes the same dictionary
+    with `changed` entries changed, and then with none. Returns one row
+    per publication with its time and the bytes written.
+    """
+    list_entries = []
+    for category, path in load_corpus(directory):
+        if category != 'error':
+            list_entries.extend(page_scraper(path, engine=engine).extract())
+    dict_entries = {}
+    for copy in range(copies):
+        for position, dict_entry in enumerate(list_entries):
+            word = f'{dict_entry.word}{copy}'
+            dict_entries[f'{word}#{position}'] = replace(dict_entry, word=word)
+
+    list_rows = []
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        store = SnapshotStore(snapshot_dir, background=False)
+        for name in ('full', 'delta', 'unchanged'):
+            if name == 'delta':
+                for key in list(dict_entries)[::max(1, len(dict_entries) // changed)][:changed]:
+                    dict_entries[key] = replace(dict_entries[key], freq=dict_entries[key].freq + '*')
+            start = time.perf_counter()
+            dict_stats = store.publish(dict_entries)
+            list_rows.append(dict(dict_stats, publication=name, seconds=time.perf_counter() - start))
+        list_rows.append(dict(publication='snapshot size', **store.stats()))
+    return list_rows
+
+
+def bench_faults(directory, num_words=400, failure_rate=0.2, outage=2.0, workers=4, delay=0.01):
+    """
+    Runs a BatchRunner on the corpus words, its damaged pages and a
+    missing word, served by a ReplayServer failing `failure_rate` of
+    the requests and going down for `outage` seconds halfway through
+    the run. The dead letters of that run are then run again on the
+    healed server. Returns one row per run.
+    """
+    list_rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = os.path.join(temp_dir, 'corpus')
+        corrupt_pages(directory, corpus_dir)
+        list_kinds = corpus_words(corpus_dir) + ['nosuchword']
+        list_words = [list_kinds[index % len(list_kinds)] for index in range(num_words)]
+
+        with ReplayServer(corpus_dir, delay=delay, failure_rate=failure_rate) as replay:
+            scraper_class = replay.scraper_class()
+
+            def run(name, words):
+                dead_path = os.path.join(temp_dir, f'{name}.jsonl')
+                dead_letters = DeadLetters(dead_path)
+                transport = BreakerTransport(
+                    Transport(pool_maxsize=workers, retries=0),
+                    min_requests=10, cooldown=0.25, max_cooldown=2.0
+                )
+                runner = BatchRunner(transport, dead_letters, workers=workers, retries=3, backoff=0.05)
+                runner.scraper_class = scraper_class
+                requests_before = replay.requests
+                start = time.perf_counter()
+                list_records = list(runner.run(words))
+                elapsed = time.perf_counter() - start
+                dead_letters.close()
+                list_breakers = list(transport.stats().values())
+                list_rows.append(dict(
+                    runner.counts,
+                    run=name,
+                    words=len(list_records),
+                    words_per_sec=len(list_records) / elapsed,
+                    upstream=replay.requests - requests_before,
+                    trips=sum(breaker['trips'] for breaker in list_breakers),
+                    paused_seconds=sum(breaker['paused_seconds'] for breaker in list_breakers),
+                ))
+                return dead_path
+
+            def go_down():
+                time.sleep(outage)
+                replay.down = True
+                time.sleep(outage)
+                replay.down = False
+
+            outage_thread = threading.Thread(target=go_down, daemon=True)
+            outage_thread.start()
+            dead_path = run('flaky', list_words)
+            outage_thread.join()
+
+            replay.failure_rate = 0.0
+            run('dead letters', list(read_dead_letters(dead_path)))
+    return list_rows
+
+
+def bench_decode(paths, repeat=5):
+    """
+    Parses every page from the decoded text of the response (the former
+    path) and from its bytes (Scraper.html/tree), with each engine, and
+    returns the measure() rows of each way
+    """
+    list_results = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            content = file.read()
+        name = os.path.basename(path)
+
+        def new_response():
+            return make_response('file://' + path, content)
+
+        def bytes_scraper():
+            scraper = MacMillianDictScraper(slug='_')
+            scraper.feed(new_response())
+            return scraper
+
+        list_results.extend([
+            measure(f'{name} bs4 from text', lambda _: Soup(new_response().text, 'lxml'), [None], repeat),
+            measure(f'{name} bs4 from bytes', lambda _: bytes_scraper().html(), [None], repeat),
+            measure(f'{name} lxml from text', lambda _: lxml.html.document_fromstring(new_response().text), [None], repeat),
+            measure(f'{name} lxml from bytes', lambda _: bytes_scraper().tree(), [None], repeat),
+        ])
+    return list_results
+
+
+def compare(list_results, baseline, threshold=0.10):
+    """
+    Returns the names of the benchmarks whose p50 latency is more
+    than `threshold` slower than in the baseline
+    """
+    dict_baseline = {result['name']: result for result in baseline['results']}
+    list_regressions = []
+    for result in list_results:
+        base = dict_baseline.get(result['name'])
+        if base and result['p50_ms'] > base['p50_ms'] * (1 + threshold):
+            list_regressions.append(result['name'])
+    return list_regressions
+
+
+def print_results(list_results, list_regressions=()):
+    print(f"{'benchmark':<40}{'calls':>8}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>12}")
+    for result in list_results:
+        mark = '  REGRESSION' if result['name'] in list_regressions else ''
+        print(f"{result['name']:<40}{result['calls']:>8}{result['ops_per_sec']:>12.1f}"
+            f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['peak_kib']:>12.1f}{mark}")
+
+
+def bench_engines(paths, repeat=5):
+    """
+    Parses every page with each engine, `repeat` times, and returns
+    one row per page with the median parse time (in ms) per engine
+    """
+    list_rows = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            content = file.read()
+
+        row = {'page': os.path.basename(path), 'size': len(content)}
+        list_results = []
+        for engine in MacMillianDictScraper.engines:
+            list_times = []
+            for _ in range(repeat):
+                scraper = page_scraper(path, engine=engine, content=content)
+                start = time.perf_counter()
+                result = scraper.extract()
+                list_times.append((time.perf_counter() - start) * 1000)
+            row[engine] = statistics.median(list_times)
+            list_results.append(result)
+        row['identical'] = all(result == list_results[0] for result in list_results)
+        list_rows.append(row)
+    return list_rows
+
+
+def print_engines(list_rows):
+    engines = MacMillianDictScraper.engines
+    print(f"{'page':<30}{'bytes':>10}" + ''.join(f'{engine + " ms":>12}' for engine in engines) + '  identical')
+    for row in list_rows:
+        print(f"{row['page']:<30}{row['size']:>10}"
+            + ''.join(f'{row[engine]:>12.2f}' for engine in engines)
+            + f"  {row['identical']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_record = subparsers.add_parser('record', help='save live pages into a corpus')
+    parser_record.add_argument('corpus')
+    parser_record.add_argument('words', nargs='+')
+    parser_record.add_argument('--dial', default=None)
+
+    parser_suite = subparsers.add_parser('suite', help='parsing, rendering and end-to-end benchmarks')
+    parser_suite.add_argument('corpus')
+    parser_suite.add_argument('--repeat', type=int, default=3)
+    parser_suite.add_argument('--engine', default='bs4', choices=MacMillianDictScraper.engines)
+    parser_suite.add_argument('--save', metavar='JSON', help='save the results as a baseline')
+    parser_suite.add_argument('--compare', metavar='JSON', help='compare with a saved baseline')
+    parser_suite.add_argument('--threshold', type=float, default=0.10,
+        help='allowed p50 slowdown before reporting a regression (default: 0.10)')
+
+    parser_engines = subparsers.add_parser('engines', help='per-page parse time of each engine')
+    parser_engines.add_argument('pages', nargs='+')
+    parser_engines.add_argument('--repeat', type=int, default=5)
+
+    parser_pipeline = subparsers.add_parser('pipeline', help='throughput of ParsePipeline per number of parser processes')
+    parser_pipeline.add_argument('corpus')
+    parser_pipeline.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser_pipeline.add_argument('--rounds', type=int, default=20)
+    parser_pipeline.add_argument('--engine', default='bs4', choices=MacMillianDictScraper.engines)
+
+    parser_memory = subparsers.add_parser('memory', help='memory of dataclass trees against an EntryStore')
+    parser_memory.add_argument('corpus')
+    parser_memory.add_argument('--copies', type=int, default=1000)
+    parser_memory.add_argument('--engine', default='bs4', choices=MacMillianDictScraper.engines)
+
+    parser_throttle = subparsers.add_parser('throttle', help='plain transport against the Scheduler on a throttling server')
+    parser_throttle.add_argument('--capacity', type=float, default=20.0, help='requests per second the server accepts')
+    parser_throttle.add_argument('--requests', type=int, default=300)
+    parser_throttle.add_argument('--threads', type=int, default=16)
+
+    parser_decode = subparsers.add_parser('decode', help='parsing from decoded text against parsing from bytes')
+    parser_decode.add_argument('pages', nargs='+')
+    parser_decode.add_argument('--repeat', type=int, default=5)
+
+    parser_serve = subparsers.add_parser('serve', help='load test of the lookup server')
+    parser_serve.add_argument('corpus')
+    parser_serve.add_argument('--clients', type=int, default=8)
+    parser_serve.add_argument('--requests', type=int, default=2000)
+    parser_serve.add_argument('--delay', type=float, default=0.05, help='seconds the stub site takes to answer')
+
+    parser_importtime = subparsers.add_parser('importtime', help='import time of modules in a fresh interpreter')
+    parser_importtime.add_argument('modules', nargs='*',
+        default=['models', 'serialize', 'cache', 'index', 'viewhtml', 'macmillian', 'server'])
+    parser_importtime.add_argument('--repeat', type=int, default=5)
+
+    parser_snapshot = subparsers.add_parser('snapshot', help='full and delta snapshot publications')
+    parser_snapshot.add_argument('corpus')
+    parser_snapshot.add_argument('--copies', type=int, default=1000)
+    parser_snapshot.add_argument('--changed', type=int, default=20)
+
+    parser_faults = subparsers.add_parser('faults', help='batch runner on a flaky site with damaged pages')
+    parser_faults.add_argument('corpus')
+    parser_faults.add_argument('--words', type=int, default=400)
+    parser_faults.add_argument('--failure-rate', type=float, default=0.2, help='share of the requests answered with a 503')
+    parser_faults.add_argument('--outage', type=float, default=2.0, help='seconds into the run the site goes down, and for how long')
+    parser_faults.add_argument('--workers', type=int, default=4)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.corpus, args.words, dial=args.dial)
+
+    elif args.command == 'suite':
+        list_results = run_suite(args.corpus, repeat=args.repeat, engine=args.engine)
+        list_regressions = []
+        if args.compare:
+            with open(args.compare) as file:
+                list_regressions = compare(list_results, json.load(file), threshold=args.threshold)
+        print_results(list_results, list_regressions)
+        if args.save:
+            with open(args.save, 'w') as file:
+                json.dump({
+                    'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': sys.version.split()[0],
+                    'engine': args.engine,
+                    'results': list_results,
+                }, file, indent=2)
+        if list_regressions:
+            sys.exit(1)
+
+    elif args.command == 'engines':
+        print_engines(bench_engines(args.pages, repeat=args.repeat))
+
+    elif args.command == 'pipeline':
+        list_rows = bench_pipeline(args.corpus, args.workers, rounds=args.rounds, engine=args.engine)
+        base = list_rows[0][1] / list_rows[0][0]
+        print(f"{'workers':>8}{'words/s':>12}{'efficiency':>12}")
+        for workers, words_per_sec in list_rows:
+            print(f'{workers:>8}{words_per_sec:>12.1f}{words_per_sec / (base * workers):>12.0%}')
+
+    elif args.command == 'memory':
+        row = bench_memory(args.corpus, copies=args.copies, engine=args.engine)
+        print(f"{row['entries']} entries")
+        print(f"dataclass trees {row['trees_kib']:>12.0f} KiB")
+        print(f"EntryStore      {row['store_kib']:>12.0f} KiB ({row['store_kib'] / row['trees_kib']:.0%})")
+        print(f"materialize all {row['materialize_ms']:>12.0f} ms, identical: {row['identical']}")
+
+    elif args.command == 'decode':
+        print_results(bench_decode(args.pages, repeat=args.repeat))
+
+    elif args.command == 'throttle':
+        list_rows = bench_throttle(args.capacity, num_requests=args.requests, threads=args.threads)
+        print(f"{'mode':<12}{'ok':>6}{'failed':>8}{'req/s':>8}{'429s':>8}{'inter. p50 ms':>15}{'inter. p99 ms':>15}")
+        for row in list_rows:
+            print(
+                f"{row['mode']:<12}{row['ok']:>6}{row['failed']:>8}{row['requests_per_sec']:>8.1f}"
+                f"{row['served_429']:>8}{row['interactive_p50_ms']:>15.1f}{row['interactive_p99_ms']:>15.1f}"
+            )
+
+
+    elif args.command == 'serve':
+        list_rows = bench_serve(args.corpus, clients=args.clients, num_requests=args.requests, delay=args.delay)
+        print(f"{'phase':<22}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'upstream':>10}")
+        for row in list_rows:
+            print(
+                f"{row['phase']:<22}{row['requests']:>10}{row['requests_per_sec']:>10.1f}"
+                f"{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['upstream']:>10}"
+            )
+
+
+    elif args.command == 'importtime':
+        print(f"{'module':<14}{'import ms':>10}  heavy modules loaded")
+        for row in bench_importtime(args.modules, repeat=args.repeat):
+            print(f"{row['module']:<14}{row['import_ms']:>10.1f}  {' '.join(row['heavy']) or '-'}")
+
+
+    elif args.command == 'snapshot':
+        list_rows = bench_snapshot(args.corpus, copies=args.copies, changed=args.changed)
+        print(f"{'publication':<12}{'added':>8}{'changed':>9}{'removed':>9}{'seconds':>9}{'bytes written':>16}")
+        for row in list_rows[:-1]:
+            print(
+                f"{row['publication']:<12}{row['added']:>8}{row['changed']:>9}{row['removed']:>9}"
+                f"{row['seconds']:>9.2f}{row['bytes']:>16}"
+            )
+        print(f"snapshot: {list_rows[-1]['segments']} segments, {list_rows[-1]['bytes']} bytes")
+
+
+    elif args.command == 'faults':
+        list_rows = bench_faults(
+            args.corpus, num_words=args.words, failure_rate=args.failure_rate,
+            outage=args.outage, workers=args.workers
+        )
+        print(
+            f"{'run':<14}{'words':>7}{'found':>7}{'partial':>9}{'not found':>11}{'failed':>8}"
+            f"{'retries':>9}{'trips':>7}{'paused s':>10}{'words/s':>9}{'upstream':>10}"
+        )
+        for row in list_rows:
+            print(
+                f"{row['run']:<14}{row['words']:>7}{row['found']:>7}{row['partial']:>9}{row['not_found']:>11}"
+                f"{row['failed']:>8}{row['retries']:>9}{row['trips']:>7}{row['paused_seconds']:>10.1f}"
+                f"{row['words_per_sec']:>9.1f}{row['upstream']:>10}"
+            )
+
+
+if __name__ == '__main__':
+    main()
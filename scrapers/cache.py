@@ -0,0 +1,279 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+import serialize
+from transport import make_response
+
+
+class ResponseCache():
+    """An on-disk cache of fetched pages, kept in a SQLite database.
+
+    Pages are stored compressed and addressed by the hash of their
+    cache key (e.g. the page url plus the dialect). Stale pages are
+    revalidated with If-None-Match/If-Modified-Since before being
+    downloaded again, and the least recently used pages are evicted
+    once the cache grows past max_size bytes.
+
+    Attributes:
+        path        the SQLite database file
+        ttl         seconds a page is served without revalidation
+        max_size    maximum size (in compressed bytes) of the cache
+        hits        pages served from the cache
+        misses      pages that had to be downloaded
+        revalidated stale pages confirmed unchanged by the server
+        evictions   pages removed to keep the cache under max_size
+    """
+    def __init__(self, path, ttl=7 * 24 * 3600, max_size=512 * 1024 * 1024):
+        self.path        = path
+        self.ttl         = ttl
+        self.max_size    = max_size
+        self.hits        = 0
+        self.misses      = 0
+        self.revalidated = 0
+        self.evictions   = 0
+        self._lock       = threading.Lock()
+        self._db         = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key           TEXT PRIMARY KEY,
+                url           TEXT NOT NULL,
+                status        INTEGER NOT NULL,
+                headers       TEXT NOT NULL,
+                body          BLOB NOT NULL,
+                size          INTEGER NOT NULL,
+                etag          TEXT,
+                last_modified TEXT,
+                fetched_at    REAL NOT NULL,
+                accessed_at   REAL NOT NULL
+            )
+        ''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._db.commit()
+
+    @staticmethod
+    def hash_key(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def fetch(self, key, url, transport, timeout=None):
+        """
+        Returns the response for url, from the cache when possible,
+        otherwise downloaded with transport (and then cached)
+        """
+        hashed_key = self.hash_key(key)
+        row = self._select(hashed_key)
+        now = time.time()
+
+        if row and now - row['fetched_at'] < self.ttl:
+            self.hits += 1
+            self._touch(hashed_key, now)
+            return self._to_response(row)
+
+        # revalidate stale pages
+        headers = {}
+        if row:
+            if row['etag']:
+                headers['If-None-Match'] = row['etag']
+            if row['last_modified']:
+                headers['If-Modified-Since'] = row['last_modified']
+
+        response = transport.get(url, timeout=timeout, headers=headers or None)
+        if row and response.status_code == 304:
+            self.revalidated += 1
+            self._touch(hashed_key, now, fetched=True)
+            return self._to_response(row)
+
+        self.misses += 1
+        if response.status_code == 200:
+            self.put(key, response)
+        return response
+
+    def is_fresh(self, key) -> bool:
+        row = self._select(self.hash_key(key))
+        return bool(row) and time.time() - row['fetched_at'] < self.ttl
+
+    def put(self, key, response):
+        body = zlib.compress(response.content)
+        now  = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                self.hash_key(key),
+                response.url,
+                response.status_code,
+                json.dumps(dict(response.headers)),
+                body,
+                len(body),
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                now,
+                now,
+            ))
+            self._evict()
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidated': self.revalidated,
+            'evictions': self.evictions,
+            'entries': count,
+            'size': size,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _select(self, hashed_key):
+        with self._lock:
+            cursor = self._db.execute(
+                'SELECT * FROM responses WHERE key = ?', (hashed_key,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def _touch(self, hashed_key, now, fetched=False):
+        with self._lock:
+            if fetched:
+                self._db.execute(
+                    'UPDATE responses SET accessed_at = ?, fetched_at = ? WHERE key = ?',
+                    (now, now, hashed_key)
+                )
+            else:
+                self._db.execute(
+                    'UPDATE responses SET accessed_at = ? WHERE key = ?',
+                    (now, hashed_key)
+                )
+            self._db.commit()
+
+    def _evict(self):
+        # called with the lock held
+        total_size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        cursor = self._db.execute('SELECT key, size FROM responses ORDER BY accessed_at')
+        list_evicted = []
+        for key, size in cursor:
+            if total_size <= self.max_size:
+                break
+            list_evicted.append((key,))
+            total_size -= size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', list_evicted)
+        self.evictions += len(list_evicted)
+
+    def _to_response(self, row):
+        return make_response(
+            row['url'],
+            zlib.decompress(row['body']),
+            status_code=row['status'],
+            headers=json.loads(row['headers']),
+        )
+
+
+class EntryCache():
+    """An on-disk cache of parsed DictEntry/ErrorList results.
+
+    Results are stored with serialize.encode (compressed JSON, which
+    any interpreter reads back), so a warm lookup skips both the
+    download and the parse. Keys should include a parser
+    version stamp (see MacMillianDictScraper.entry_key) so that stale
+    results are not served after the parser changes.
+
+    Attributes:
+        path    the SQLite database file
+        ttl     seconds a result is served (None: forever)
+        hits    results served from the cache
+        misses  results that were not in the cache
+    """
+    def __init__(self, path, ttl=None):
+        self.path   = path
+        self.ttl    = ttl
+        self.hits   = 0
+        self.misses = 0
+        self._lock  = threading.Lock()
+        self._db    = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key       TEXT PRIMARY KEY,
+                data      BLOB NOT NULL,
+                stored_at REAL NOT NULL
+            )
+        ''')
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT data, stored_at FROM entries WHERE key = ?',
+                (self._full_key(key),)
+            ).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] >= self.ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return serialize.decode(row[0])
+
+    def __contains__(self, key):
+        """Whether a fresh result is stored under key, without decoding
+        it or counting a hit"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT stored_at FROM entries WHERE key = ?',
+                (self._full_key(key),)
+            ).fetchone()
+        return row is not None and (self.ttl is None or time.time() - row[0] < self.ttl)
+
+    def put(self, key, result):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                (self._full_key(key), serialize.encode(result), time.time())
+            )
+            self._db.commit()
+
+    def touch(self, key) -> bool:
+        """
+        Marks a stored result as fresh again (its page did not change),
+        returns whether there was a result to mark
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                'UPDATE entries SET stored_at = ? WHERE key = ?',
+                (time.time(), self._full_key(key))
+            )
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': count}
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM entries')
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _full_key(self, key):
+        # results stored in another format are never read back
+        return f'{key} v{serialize.FORMAT_VERSION}'
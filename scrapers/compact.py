@@ -0,0 +1,272 @@
+from array import array
+
+from models import DictEntry, WordDefinition, Keywords, Phonetics, ExampleGroup
+
+
+KEYWORD_KINDS = ('grammar', 'style', 'dialect', 'warnings')
+
+# id 0 of every table is the empty value, shared by all the entries
+EMPTY = 0
+
+# vocabulary codes are stored in 'H' arrays
+MAX_CODE = 0xFFFF
+
+# how the keywords of a definition are given: one Keywords, or a list
+# of them (WordDefinition.keywords defaults to an empty list)
+KEYWORDS_OBJECT = 0
+KEYWORDS_LIST   = 1
+
+
+class Vocabulary():
+    """Interns the strings of a small vocabulary (labels, parts of
+    speech, definition numbers...) as integer codes"""
+    def __init__(self):
+        self.strings = ['']
+        self.codes   = {'': EMPTY}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def code(self, string: str) -> int:
+        code = self.codes.get(string)
+        if code is None:
+            code = len(self.strings)
+            if code > MAX_CODE:
+                raise OverflowError(f'vocabulary is full ({MAX_CODE + 1} strings), cannot add {string!r}')
+            self.codes[string] = code
+            self.strings.append(string)
+        return code
+
+
+class StringTable():
+    """Free text (words, definitions, examples), utf-8 encoded in one
+    bytearray; a string is known by its position in the table"""
+    def __init__(self):
+        self.blob    = bytearray()
+        self.offsets = array('Q', [0, 0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, text_id) -> str:
+        return self.blob[self.offsets[text_id]:self.offsets[text_id + 1]].decode('utf-8')
+
+    def add(self, string: str) -> int:
+        if not string:
+            return EMPTY
+        self.blob += string.encode('utf-8')
+        self.offsets.append(len(self.blob))
+        return len(self.offsets) - 2
+
+
+class EntryStore():
+    """Keeps DictEntry trees in flat arrays instead of Python objects.
+
+    Labels, parts of speech, numbers, frequencies and phonetic dialects
+    and qualifiers are interned in a Vocabulary; identical Keywords and
+    Phonetics are stored once; free text goes to a StringTable. The
+    definitions of a list (and the sentences of an example group) are
+    contiguous, so a list is a (start, count) pair.
+
+    store[entry_id] builds the DictEntry back, only when asked for.
+    """
+    def __init__(self, dict_entries=()):
+        self.vocab = Vocabulary()
+        self.texts = StringTable()
+
+        # keywords: id -> start in keyword_codes, and the count of each kind
+        self._keywords_ids   = {(): EMPTY}
+        self.keyword_starts  = array('I', [0])
+        self.keyword_counts  = array('B', [0] * len(KEYWORD_KINDS))
+        self.keyword_codes   = array('H')
+
+        # phonetics: id -> spelling text, dialect code, qualifier code
+        self._phonetics_ids   = {}
+        self.phon_spellings   = array('I')
+        self.phon_dialects    = array('H')
+        self.phon_qualifiers  = array('H')
+
+        # entries
+        self.entry_words      = array('I')
+        self.entry_freqs      = array('H')
+        self.entry_sources    = array('I')
+        self.entry_keywords   = array('I')
+        self.entry_pos        = array('I', [0])
+        self.pos_codes        = array('H')
+        self.entry_phonetics  = array('I', [0])
+        self.phonetics_ids    = array('I')
+        self.entry_defns      = array('I')
+        self.entry_defn_count = array('H')
+
+        # definitions
+        self.defn_texts       = array('I')
+        self.defn_numbers     = array('H')
+        self.defn_keywords    = array('I')
+        # KEYWORDS_LIST definitions: defn_keywords is a start in
+        # keyword_lists, holding the count then the keywords ids
+        self.defn_keyword_forms = array('B')
+        self.keyword_lists    = array('I')
+        self.defn_examples    = array('I')
+        self.defn_example_count = array('H')
+        self.defn_subdefns    = array('I')
+        self.defn_subdefn_count = array('H')
+
+        # example groups
+        self.group_patterns   = array('I')
+        self.group_sentences  = array('I')
+        self.group_count      = array('H')
+        self.sentence_texts   = array('I')
+
+        for dict_entry in dict_entries:
+            self.add(dict_entry)
+
+    def __len__(self):
+        return len(self.entry_words)
+
+    def __getitem__(self, entry_id) -> DictEntry:
+        if entry_id < 0:
+            entry_id += len(self)
+        if not 0 <= entry_id < len(self):
+            raise IndexError('entry id out of range')
+        vocab = self.vocab.strings
+        return DictEntry(
+            word=self.texts[self.entry_words[entry_id]],
+            pos=[vocab[code] for code in self.pos_codes[self.entry_pos[entry_id]:self.entry_pos[entry_id + 1]]],
+            phonetics=[
+                self._phonetics(phonetics_id) for phonetics_id in
+                self.phonetics_ids[self.entry_phonetics[entry_id]:self.entry_phonetics[entry_id + 1]]
+            ],
+            keywords=self._keywords(self.entry_keywords[entry_id]),
+            defns=self._defns(self.entry_defns[entry_id], self.entry_defn_count[entry_id]),
+            freq=vocab[self.entry_freqs[entry_id]],
+            source=self.texts[self.entry_sources[entry_id]],
+        )
+
+    def __iter__(self):
+        for entry_id in range(len(self)):
+            yield self[entry_id]
+
+    def word(self, entry_id) -> str:
+        """The headword of an entry, without building the entry"""
+        return self.texts[self.entry_words[entry_id]]
+
+    def add(self, dict_entry: DictEntry) -> int:
+        entry_id = len(self.entry_words)
+        self.entry_words.append(self.texts.add(dict_entry.word))
+        self.entry_freqs.append(self.vocab.code(dict_entry.freq))
+        self.entry_sources.append(self.texts.add(dict_entry.source))
+        self.entry_keywords.append(self._add_keywords(dict_entry.keywords))
+
+        self.pos_codes.extend(self.vocab.code(pos) for pos in dict_entry.pos)
+        self.entry_pos.append(len(self.pos_codes))
+        self.phonetics_ids.extend(self._add_phonetics(phonetics) for phonetics in dict_entry.phonetics)
+        self.entry_phonetics.append(len(self.phonetics_ids))
+
+        self.entry_defns.append(self._add_defns(dict_entry.defns))
+        self.entry_defn_count.append(len(dict_entry.defns))
+        return entry_id
+
+    def add_all(self, dict_entries):
+        for dict_entry in dict_entries:
+            self.add(dict_entry)
+
+    def _add_keywords(self, keywords) -> int:
+        list_codes = [tuple(self.vocab.code(label) for label in getattr(keywords, kind)) for kind in KEYWORD_KINDS]
+        key = tuple(list_codes) if any(list_codes) else ()
+        keywords_id = self._keywords_ids.get(key)
+        if keywords_id is None:
+            keywords_id = self._keywords_ids[key] = len(self.keyword_starts)
+            self.keyword_starts.append(len(self.keyword_codes))
+            for codes in list_codes:
+                self.keyword_counts.append(len(codes))
+                self.keyword_codes.extend(codes)
+        return keywords_id
+
+    def _keywords(self, keywords_id) -> Keywords:
+        vocab = self.vocab.strings
+        position = self.keyword_starts[keywords_id]
+        dict_labels = {}
+        for index, kind in enumerate(KEYWORD_KINDS):
+            count = self.keyword_counts[keywords_id * len(KEYWORD_KINDS) + index]
+            dict_labels[kind] = [vocab[code] for code in self.keyword_codes[position:position + count]]
+            position += count
+        return Keywords(**dict_labels)
+
+    def _defn_keywords(self, slot):
+        if self.defn_keyword_forms[slot] == KEYWORDS_OBJECT:
+            return self._keywords(self.defn_keywords[slot])
+        start = self.defn_keywords[slot]
+        count = self.keyword_lists[start]
+        return [self._keywords(keywords_id) for keywords_id in self.keyword_lists[start + 1:start + 1 + count]]
+
+    def _add_phonetics(self, phonetics) -> int:
+        key = (phonetics.spelling, phonetics.dialect, phonetics.qualifier)
+        phonetics_id = self._phonetics_ids.get(key)
+        if phonetics_id is None:
+            phonetics_id = self._phonetics_ids[key] = len(self.phon_spellings)
+            self.phon_spellings.append(self.texts.add(phonetics.spelling))
+            self.phon_dialects.append(self.vocab.code(phonetics.dialect))
+            self.phon_qualifiers.append(self.vocab.code(phonetics.qualifier))
+        return phonetics_id
+
+    def _phonetics(self, phonetics_id) -> Phonetics:
+        vocab = self.vocab.strings
+        return Phonetics(
+            spelling=self.texts[self.phon_spellings[phonetics_id]],
+            dialect=vocab[self.phon_dialects[phonetics_id]],
+            qualifier=vocab[self.phon_qualifiers[phonetics_id]],
+        )
+
+    def _add_defns(self, list_defns) -> int:
+        """Stores a list of definitions in consecutive slots, then their
+        sub-definitions; returns the first slot"""
+        start = len(self.defn_texts)
+        for defn in list_defns:
+            self.defn_texts.append(self.texts.add(defn.defn))
+            self.defn_numbers.append(self.vocab.code(defn.number))
+            if isinstance(defn.keywords, list):
+                self.defn_keyword_forms.append(KEYWORDS_LIST)
+                self.defn_keywords.append(len(self.keyword_lists))
+                self.keyword_lists.append(len(defn.keywords))
+                self.keyword_lists.extend(self._add_keywords(keywords) for keywords in defn.keywords)
+            else:
+                self.defn_keyword_forms.append(KEYWORDS_OBJECT)
+                self.defn_keywords.append(self._add_keywords(defn.keywords))
+            self.defn_examples.append(len(self.group_patterns))
+            self.defn_example_count.append(len(defn.examples))
+            for example_group in defn.examples:
+                self.group_patterns.append(self.texts.add(example_group.pattern))
+                self.group_sentences.append(len(self.sentence_texts))
+                self.group_count.append(len(example_group.examples))
+                self.sentence_texts.extend(self.texts.add(example) for example in example_group.examples)
+            self.defn_subdefns.append(0)
+            self.defn_subdefn_count.append(len(defn.subdefns))
+
+        for slot, defn in enumerate(list_defns, start):
+            if defn.subdefns:
+                self.defn_subdefns[slot] = self._add_defns(defn.subdefns)
+        return start
+
+    def _defns(self, start, count) -> list[WordDefinition]:
+        vocab = self.vocab.strings
+        list_defns = []
+        for slot in range(start, start + count):
+            list_groups = []
+            group_start = self.defn_examples[slot]
+            for group in range(group_start, group_start + self.defn_example_count[slot]):
+                sentence_start = self.group_sentences[group]
+                list_groups.append(ExampleGroup(
+                    examples=[
+                        self.texts[text_id] for text_id in
+                        self.sentence_texts[sentence_start:sentence_start + self.group_count[group]]
+                    ],
+                    pattern=self.texts[self.group_patterns[group]],
+                ))
+            list_defns.append(WordDefinition(
+                defn=self.texts[self.defn_texts[slot]],
+                number=vocab[self.defn_numbers[slot]],
+                keywords=self._defn_keywords(slot),
+                examples=list_groups,
+                subdefns=self._defns(self.defn_subdefns[slot], self.defn_subdefn_count[slot]),
+            ))
+        return list_defns
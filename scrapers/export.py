@@ -0,0 +1,322 @@
+"""Export a word list as a dictionary file.
+
+    python export.py words.txt -o dictionary.jsonl
+    cat words.txt | python export.py - -o dictionary/ --format parquet
+
+Words are looked up with bounded parallelism and the records are written
+as soon as their lookup completes. With --checkpoint, an interrupted
+export resumes from where it stopped, trying the failed words again.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from contextlib import aclosing
+
+import serialize
+from batch import BatchLookup
+from models import ErrorList
+
+
+def read_words(source):
+    """Yields the non-empty lines of a file (or of stdin, for '-')"""
+    file = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        for line in file:
+            word = line.strip()
+            if word:
+                yield word
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+class Checkpoint():
+    """Remembers which positions of the word list are exported.
+
+    Attributes:
+        path            the JSON checkpoint file
+        done_through    every position below this one is exported
+        done            exported positions at or above done_through
+    """
+    def __init__(self, path):
+        self.path         = path
+        self.done_through = 0
+        self.done         = set()
+        if os.path.exists(path):
+            with open(path) as file:
+                data = json.load(file)
+            self.done_through = data['done_through']
+            self.done         = set(data['done'])
+
+    def is_done(self, index) -> bool:
+        return index < self.done_through or index in self.done
+
+    def mark(self, index):
+        self.done.add(index)
+        while self.done_through in self.done:
+            self.done.remove(self.done_through)
+            self.done_through += 1
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'done_through': self.done_through, 'done': sorted(self.done)}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+
+def make_record(index, word, result) -> dict:
+    """The exported record of one lookup"""
+    if isinstance(result, BaseException):
+        return {'index': index, 'word': word, 'status': 'failed', 'reason': repr(result)}
+    if isinstance(result, ErrorList):
+        return {'index': index, 'word': word, 'status': 'not_found', 'error': serialize.to_dict(result)}
+    return {
+        'index': index,
+        'word': word,
+        'status': 'found',
+        'entries': [serialize.to_dict(entry) for entry in result],
+    }
+
+
+def flatten_record(record) -> list[dict]:
+    """
+    Flattens a record into one row per definition (sub-definitions
+    included), with the examples as a list of sentences and a list
+    of the pattern of each sentence
+    """
+    base = {'index': record['index'], 'word': record['word'], 'status': record['status']}
+    if record['status'] != 'found':
+        return [dict(base,
+            reason=record.get('reason'),
+            suggestions=record.get('error', {}).get('wordlist'),
+        )]
+
+    list_rows = []
+
+    def add_defns(entry, entry_number, list_defns, parent_number):
+        for defn in list_defns:
+            list_examples = []
+            list_patterns = []
+            for example_group in defn['examples']:
+                for example in example_group['examples']:
+                    list_examples.append(example)
+                    list_patterns.append(example_group['pattern'])
+            list_rows.append(dict(base,
+                headword=entry['word'],
+                entry_number=entry_number,
+                pos=entry['pos'],
+                freq=entry['freq'],
+                source=entry['source'],
+                defn_number=defn['number'],
+                parent_number=parent_number,
+                defn=defn['defn'],
+                grammar=defn['keywords']['grammar'],
+                style=defn['keywords']['style'],
+                dialect=defn['keywords']['dialect'],
+                warnings=defn['keywords']['warnings'],
+                examples=list_examples,
+                example_patterns=list_patterns,
+            ))
+            add_defns(entry, entry_number, defn['subdefns'], defn['number'])
+
+    for entry_number, entry in enumerate(record['entries']):
+        add_defns(entry, entry_number, entry['defns'], None)
+    return list_rows
+
+
+class JsonlWriter():
+    def __init__(self, path, append=False):
+        self.file = sys.stdout if path == '-' else open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        self.file.flush()
+        if self.file is not sys.stdout:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class ParquetWriter():
+    """Writes flattened records to a directory of Parquet files, in
+    row groups of `row_group_size` rows. Requires pyarrow.
+
+    A Parquet file cannot be read before it is closed (its footer is
+    written last), so every flush closes the current part: the rows of
+    a checkpoint are all in closed parts. A part is written as
+    _part-NNNNN.parquet, hidden from the readers of the directory, and
+    renamed once closed; the ones left by a crash are removed when the
+    export resumes.
+    """
+    def __init__(self, directory, append=False, row_group_size=10000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa            = pa
+        self._pq            = pq
+        self.directory      = directory
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([
+            ('index',            pa.int64()),
+            ('word',             pa.string()),
+            ('status',           pa.string()),
+            ('reason',           pa.string()),
+            ('suggestions',      pa.list_(pa.string())),
+            ('headword',         pa.string()),
+            ('entry_number',     pa.int32()),
+            ('pos',              pa.list_(pa.string())),
+            ('freq',             pa.string()),
+            ('source',           pa.string()),
+            ('defn_number',      pa.string()),
+            ('parent_number',    pa.string()),
+            ('defn',             pa.string()),
+            ('grammar',          pa.list_(pa.string())),
+            ('style',            pa.list_(pa.string())),
+            ('dialect',          pa.list_(pa.string())),
+            ('warnings',         pa.list_(pa.string())),
+            ('examples',         pa.list_(pa.string())),
+            ('example_patterns', pa.list_(pa.string())),
+        ])
+        os.makedirs(directory, exist_ok=True)
+        list_parts = []
+        for name in os.listdir(directory):
+            if not name.endswith('.parquet'):
+                continue
+            if name.startswith('_') or not append:
+                os.remove(os.path.join(directory, name))
+            else:
+                list_parts.append(name)
+        self._part   = len(list_parts)
+        self._writer = None
+        self._rows   = []
+
+    def _part_path(self, hidden=False) -> str:
+        name = f'part-{self._part:05d}.parquet'
+        return os.path.join(self.directory, '_' + name if hidden else name)
+
+    def write(self, record):
+        self._rows.extend(flatten_record(record))
+        if len(self._rows) >= self.row_group_size:
+            self._write_rows()
+
+    def _write_rows(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self._part_path(hidden=True), self.schema)
+        self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema))
+        self._rows = []
+
+    def flush(self):
+        """Writes the pending rows and closes the current part"""
+        self._write_rows()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._part_path(hidden=True), self._part_path())
+            self._part += 1
+
+    def close(self):
+        self.flush()
+
+
+WRITERS = {
+    'jsonl': JsonlWriter,
+    'parquet': ParquetWriter,
+}
+
+
+async def export_async(words, writer, checkpoint=None, checkpoint_every=100, **lookup_options):
+    """
+    Looks up words and writes their records with writer as they
+    complete. Positions already in the checkpoint are skipped; failed
+    lookups are written but not checkpointed, so a resumed export tries
+    them again (and writes a second record for them).
+    Returns the number of records written.
+    """
+    # positions (in the original word list) of the words handed to the lookup
+    dict_positions = {}
+
+    def pending_words():
+        position = 0
+        for index, word in enumerate(words):
+            if checkpoint is not None and checkpoint.is_done(index):
+                continue
+            dict_positions[position] = index
+            position += 1
+            yield word
+
+    batch = BatchLookup(**lookup_options)
+    num_written = 0
+    # closed on a writer error, so that the lookups in flight are cancelled
+    async with aclosing(batch.lookup_indexed(pending_words(), return_exceptions=True)) as results:
+        async for position, word, result in results:
+            index = dict_positions.pop(position)
+            record = make_record(index, word, result)
+            writer.write(record)
+            num_written += 1
+            if checkpoint is not None:
+                # failed lookups are left out, to be tried again on resume
+                if record['status'] != 'failed':
+                    checkpoint.mark(index)
+                if num_written % checkpoint_every == 0:
+                    writer.flush()
+                    checkpoint.save()
+
+    writer.flush()
+    if checkpoint is not None:
+        checkpoint.save()
+    return num_written
+
+
+def export(words, output, format='jsonl', checkpoint=None, **options):
+    """Synchronous wrapper of export_async, writing to output (a path)"""
+    checkpoint = Checkpoint(checkpoint) if isinstance(checkpoint, str) else checkpoint
+    resuming = checkpoint is not None and (checkpoint.done_through or checkpoint.done)
+    writer = WRITERS[format](output, append=bool(resuming))
+    try:
+        return asyncio.run(export_async(words, writer, checkpoint=checkpoint, **options))
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('words', help="word list, one word per line ('-' for stdin)")
+    parser.add_argument('-o', '--output', default='-', help="output file, or directory for parquet ('-' for stdout)")
+    parser.add_argument('--format', default='jsonl', choices=WRITERS)
+    parser.add_argument('--dial', default=None, choices=('american', 'british'))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=2.0, help='requests per second per host')
+    parser.add_argument('--checkpoint', help='checkpoint file, to resume an interrupted export')
+    parser.add_argument('--checkpoint-every', type=int, default=100)
+    parser.add_argument('--response-cache', help='SQLite file of a ResponseCache')
+    parser.add_argument('--entry-cache', help='SQLite file of an EntryCache')
+    args = parser.parse_args()
+
+    cache = entry_cache = None
+    if args.response_cache or args.entry_cache:
+        from cache import ResponseCache, EntryCache
+        cache = ResponseCache(args.response_cache) if args.response_cache else None
+        entry_cache = EntryCache(args.entry_cache) if args.entry_cache else None
+
+    num_written = export(
+        read_words(args.words), args.output, format=args.format,
+        checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every,
+        dial=args.dial, concurrency=args.concurrency, rate=args.rate,
+        cache=cache, entry_cache=entry_cache,
+    )
+    print(f'{num_written} records written', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
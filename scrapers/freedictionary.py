@@ -0,0 +1,96 @@
+import json
+
+from scraper import DictScraper
+from registry import register
+from models import (
+    ExampleGroup,
+    WordDefinition,
+    DictEntry,
+    Phonetics,
+    Keywords,
+    ErrorList
+)
+
+
+@register
+class FreeDictionaryScraper(DictScraper):
+    """Adapter of the Free Dictionary API (dictionaryapi.dev), which
+    answers with JSON instead of HTML pages"""
+    name         = 'freedictionary'
+    search_url   = 'https://api.dictionaryapi.dev/api/v2/entries/{dial}/{word}'
+    slug_url     = 'https://api.dictionaryapi.dev/api/v2/entries/{dial}/{slug}'
+    dial_options = ('en',)
+    source       = 'Free Dictionary API'
+
+    # the audio files end with the dialect they are recorded in
+    audio_dialects = {'-us.mp3': 'US', '-uk.mp3': 'UK', '-au.mp3': 'AU', '-ca.mp3': 'CA'}
+
+    def __init__(self, word=None, slug=None, dial=None, transport=None, cache=None):
+        super().__init__(word, slug=slug, dial=dial, transport=transport, cache=cache)
+        self._data = None
+
+    def data(self):
+        if self._data is None:
+            self._data = json.loads(self.raw().content)
+        return self._data
+
+    def is_error_page(self) -> bool:
+        """
+        A 404 (a word not found) is an error page; other HTTP errors,
+        whose bodies are not the API's JSON, are raised
+        """
+        response = self.raw()
+        if response.status_code == 404:
+            return True
+        response.raise_for_status()
+        return not isinstance(self.data(), list)
+
+    def parse_error_page(self) -> ErrorList:
+        try:
+            data = self.data()
+        except ValueError:
+            # a 404 from a proxy or the like, not from the API
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        return ErrorList(
+            texts=[data[key] for key in ('title', 'message', 'resolution') if data.get(key)],
+            wordlist=[]
+        )
+
+    def parse_word_page(self) -> list[DictEntry]:
+        """One DictEntry per part of speech of each returned entry"""
+        list_sanitized_entries = []
+        for scraped_entry in self.data():
+            list_sanitized_phonetics = []
+            for scraped_phonetics in scraped_entry.get('phonetics', []):
+                if not scraped_phonetics.get('text'):
+                    continue
+                audio = scraped_phonetics.get('audio', '')
+                list_sanitized_phonetics.append(Phonetics(
+                    spelling=scraped_phonetics['text'],
+                    dialect=next((dialect for suffix, dialect in self.audio_dialects.items() if audio.endswith(suffix)), ''),
+                ))
+
+            for scraped_meaning in scraped_entry.get('meanings', []):
+                list_sanitized_defns = []
+                for number, scraped_defn in enumerate(scraped_meaning.get('definitions', []), 1):
+                    list_sanitized_examples = []
+                    if scraped_defn.get('example'):
+                        list_sanitized_examples.append(ExampleGroup(examples=[scraped_defn['example']]))
+                    list_sanitized_defns.append(WordDefinition(
+                        defn=scraped_defn.get('definition', ''),
+                        number=str(number),
+                        keywords=Keywords(),
+                        examples=list_sanitized_examples,
+                    ))
+
+                list_sanitized_entries.append(DictEntry(
+                    word=scraped_entry.get('word', self.word),
+                    pos=[scraped_meaning['partOfSpeech']] if scraped_meaning.get('partOfSpeech') else [],
+                    phonetics=list_sanitized_phonetics,
+                    keywords=Keywords(),
+                    defns=list_sanitized_defns,
+                    source=self.source,
+                ))
+        return list_sanitized_entries
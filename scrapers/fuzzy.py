@@ -0,0 +1,168 @@
+from models import ErrorList
+
+
+def edit_distance(word_a: str, word_b: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent
+    transpositions), or max_distance + 1 when it is larger. Only the
+    cells within max_distance of the diagonal are computed.
+    """
+    if word_a == word_b:
+        return 0
+    len_a, len_b = len(word_a), len(word_b)
+    if abs(len_a - len_b) > max_distance:
+        return max_distance + 1
+    too_far = max_distance + 1
+    previous_previous = None
+    previous = [j if j <= max_distance else too_far for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        start = max(1, i - max_distance)
+        stop = min(len_b, i + max_distance)
+        current = [too_far] * (len_b + 1)
+        current[0] = i if i <= max_distance else too_far
+        row_minimum = current[0]
+        char_a = word_a[i - 1]
+        for j in range(start, stop + 1):
+            char_b = word_b[j - 1]
+            value = previous[j - 1] + (char_a != char_b)
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char_a == word_b[j - 2] and word_a[i - 2] == char_b \
+                    and previous_previous[j - 2] + 1 < value:
+                value = previous_previous[j - 2] + 1
+            current[j] = value
+            if value < row_minimum:
+                row_minimum = value
+        if row_minimum > max_distance:
+            return too_far
+        previous_previous, previous = previous, current
+    return min(previous[len_b], too_far)
+
+
+def _deletes(word: str, max_distance: int) -> set[str]:
+    set_deletes = {word}
+    list_edges = [word]
+    for _ in range(max_distance):
+        list_next = []
+        for edge in list_edges:
+            for index in range(len(edge)):
+                delete = edge[:index] + edge[index + 1:]
+                if delete not in set_deletes:
+                    set_deletes.add(delete)
+                    list_next.append(delete)
+        list_edges = list_next
+    return set_deletes
+
+
+class SpellIndex():
+    """A SymSpell-style index of the known headwords, answering
+    "did you mean" questions without going to the dictionary site.
+
+    Every headword is stored under all the strings obtained by deleting
+    up to max_distance characters from its first prefix_length
+    characters; a lookup generates the deletes of the query and only
+    checks the headwords sharing one of them.
+
+    Attributes:
+        max_distance    largest edit distance of a suggestion
+        prefix_length   characters of each word used for the deletes
+        authoritative   whether the headwords are the whole dictionary,
+                        so that an unknown word can be answered with
+                        suggestions and no request at all
+    """
+    def __init__(self, words=(), max_distance=2, prefix_length=7, authoritative=False):
+        self.max_distance  = max_distance
+        self.prefix_length = prefix_length
+        self.authoritative = authoritative
+        self.counts        = {}
+        self.spellings     = {}
+        self._deletes      = {}
+        for word in words:
+            self.add(word)
+
+    @classmethod
+    def from_entry_index(cls, entry_index, **options):
+        """Builds the index from the headwords (weighted by frequency
+        stars) of an index.EntryIndex"""
+        spell_index = cls(**options)
+        for entry_id in range(len(entry_index)):
+            spell_index.add(entry_index.headword(entry_id), count=1 + entry_index.freq(entry_id))
+        return spell_index
+
+    def __contains__(self, word) -> bool:
+        return word.lower() in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, word, count=1):
+        key = word.lower()
+        if key in self.counts:
+            self.counts[key] = max(self.counts[key], count)
+            return
+        self.counts[key] = count
+        self.spellings[key] = word
+        for delete in _deletes(key[:self.prefix_length], self.max_distance):
+            bucket = self._deletes.get(delete)
+            if bucket is None:
+                self._deletes[delete] = key
+            elif isinstance(bucket, str):
+                self._deletes[delete] = [bucket, key]
+            else:
+                bucket.append(key)
+
+    def lookup(self, word, max_distance=None, limit=10) -> list[tuple[str, int]]:
+        """
+        Returns (headword, distance) tuples, the closest and most
+        frequent headwords first
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        key = word.lower()
+        prefix = key[:self.prefix_length]
+
+        set_checked = set()
+        list_candidates = []
+        for delete in _deletes(prefix, max_distance):
+            bucket = self._deletes.get(delete)
+            if bucket is None:
+                continue
+            for candidate in ((bucket,) if isinstance(bucket, str) else bucket):
+                if candidate in set_checked:
+                    continue
+                set_checked.add(candidate)
+                distance = edit_distance(key, candidate, max_distance)
+                if distance <= max_distance:
+                    list_candidates.append((distance, -self.counts[candidate], candidate))
+
+        list_candidates.sort()
+        return [(self.spellings[candidate], distance) for distance, _, candidate in list_candidates[:limit]]
+
+    def correct(self, word, ratio=4):
+        """
+        Returns the headword word surely stands for, or None when it is
+        not confident: the word itself when known, else the only
+        suggestion at distance 1, or one at distance 1 at least `ratio`
+        times more frequent than the others at that distance
+        """
+        if word in self:
+            return self.spellings[word.lower()]
+        list_suggestions = [
+            candidate for candidate, distance in self.lookup(word, max_distance=1, limit=None)
+        ]
+        if len(list_suggestions) == 1:
+            return list_suggestions[0]
+        if len(list_suggestions) > 1:
+            count_best = self.counts[list_suggestions[0].lower()]
+            count_next = self.counts[list_suggestions[1].lower()]
+            if count_best >= ratio * count_next:
+                return list_suggestions[0]
+        return None
+
+    def suggest(self, word, limit=10) -> ErrorList:
+        """The suggestions for word, as the ErrorList of an error page"""
+        return ErrorList(
+            texts=[f'Sorry, no search result for {word}', 'Did you mean:'],
+            wordlist=[candidate for candidate, _ in self.lookup(word, limit=limit)]
+        )
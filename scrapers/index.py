@@ -0,0 +1,363 @@
+"""A local, memory-mapped index over scraped DictEntry records.
+
+    python index.py build dictionary.idx dictionary.jsonl
+    python index.py complete dictionary.idx "run"
+    python index.py search dictionary.idx "move quickly" --grammar intransitive
+"""
+import argparse
+import json
+import mmap
+import re
+import struct
+from array import array
+from bisect import bisect_left
+
+import serialize
+from models import DictEntry
+
+
+MAGIC   = b'DXIX'
+VERSION = 2
+
+# filter labels are stored as terms starting with this character,
+# so they can never clash with words of the definitions
+LABEL_MARK = '\x01'
+LABEL_KINDS = ('grammar', 'style', 'dialect')
+
+# posting lists up to this size are turned into sets when intersecting
+SET_POSTING_SIZE = 4096
+
+re_word = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list[str]:
+    return re_word.findall(text.lower())
+
+
+def label_term(kind, label) -> str:
+    return f'{LABEL_MARK}{kind}:{label.strip().lower()}'
+
+
+def _iter_defns(list_defns):
+    for defn in list_defns:
+        yield defn
+        yield from _iter_defns(defn.subdefns)
+
+
+class IndexBuilder():
+    """Collects DictEntry objects and writes an index file for EntryIndex.
+
+    Indexed:
+        headword        prefix (autocomplete) lookups
+        defn, examples  full-text (reverse dictionary) lookups
+        keywords        grammar/style/dialect filters, from the entry
+                        and from each of its definitions
+        freq            minimum number of stars
+    """
+    def __init__(self):
+        self.headwords = []
+        self.freqs     = array('B')
+        self.records   = []
+        self.postings  = {}
+
+    def add(self, dict_entry: DictEntry) -> int:
+        entry_id = len(self.headwords)
+        self.headwords.append(dict_entry.word)
+        self.freqs.append(min(255, dict_entry.freq.count('\u2605')))
+        self.records.append(serialize.encode(dict_entry))
+
+        list_keywords = [dict_entry.keywords]
+        set_terms = set()
+        for defn in _iter_defns(dict_entry.defns):
+            set_terms.update(tokenize(defn.defn))
+            for example_group in defn.examples:
+                for example in example_group.examples:
+                    set_terms.update(tokenize(example))
+            list_keywords.append(defn.keywords)
+        for keywords in list_keywords:
+            for kind in LABEL_KINDS:
+                for label in getattr(keywords, kind):
+                    set_terms.add(label_term(kind, label))
+
+        for term in set_terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = array('I')
+            posting.append(entry_id)
+        return entry_id
+
+    def add_all(self, dict_entries):
+        for dict_entry in dict_entries:
+            self.add(dict_entry)
+
+    def add_jsonl(self, path):
+        """Adds the entries of an export.py JSONL file"""
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                record = json.loads(line)
+                if record.get('status') == 'found':
+                    for entry in record['entries']:
+                        self.add(serialize.from_dict(DictEntry, entry))
+
+    def write(self, path):
+        num_entries = len(self.headwords)
+
+        # entries, in id order
+        headword_blob, headword_offsets = pack_strings(self.headwords)
+        record_offsets = array('Q', [0])
+        for record in self.records:
+            record_offsets.append(record_offsets[-1] + len(record))
+
+        # headword keys, sorted for prefix lookups
+        list_sorted = sorted(range(num_entries), key=lambda entry_id: (self.headwords[entry_id].lower(), entry_id))
+        key_blob, key_offsets = pack_strings(self.headwords[entry_id].lower() for entry_id in list_sorted)
+        key_ids = array('I', list_sorted)
+
+        # terms, sorted, and their posting lists
+        list_terms = sorted(self.postings, key=lambda term: term.encode('utf-8'))
+        term_blob, term_offsets = pack_strings(list_terms)
+        posting_offsets = array('Q', [0])
+        list_postings = []
+        for term in list_terms:
+            list_postings.append(self.postings[term])
+            posting_offsets.append(posting_offsets[-1] + len(self.postings[term]))
+
+        sections = {}
+        with open(path, 'wb') as file:
+            header_size = 4096
+            file.write(b'\0' * header_size)
+
+            def write_section(name, *chunks):
+                position = file.tell()
+                if position % 8:
+                    file.write(b'\0' * (8 - position % 8))
+                    position = file.tell()
+                for chunk in chunks:
+                    file.write(chunk)
+                sections[name] = [position, file.tell() - position]
+
+            write_section('headword_blob', headword_blob)
+            write_section('headword_offsets', headword_offsets.tobytes())
+            write_section('freqs', self.freqs.tobytes())
+            write_section('records', *self.records)
+            write_section('record_offsets', record_offsets.tobytes())
+            write_section('key_blob', key_blob)
+            write_section('key_offsets', key_offsets.tobytes())
+            write_section('key_ids', key_ids.tobytes())
+            write_section('term_blob', term_blob)
+            write_section('term_offsets', term_offsets.tobytes())
+            write_section('postings', *(posting.tobytes() for posting in list_postings))
+            write_section('posting_offsets', posting_offsets.tobytes())
+
+            header = json.dumps({
+                'entries': num_entries,
+                'terms': len(list_terms),
+                'record_format': serialize.FORMAT_VERSION,
+                'sections': sections,
+            }).encode('utf-8')
+            if len(header) + 12 > header_size:
+                raise ValueError('index header too large')
+            file.seek(0)
+            file.write(MAGIC + struct.pack('<II', VERSION, len(header)) + header)
+
+
+def pack_strings(strings):
+    """Returns the utf-8 blob of strings and the offsets of each one"""
+    list_encoded = [string.encode('utf-8') for string in strings]
+    offsets = array('Q', [0])
+    for encoded in list_encoded:
+        offsets.append(offsets[-1] + len(encoded))
+    return b''.join(list_encoded), offsets
+
+
+class PackedStrings():
+    """The strings of pack_strings, read back as bytes from their blob
+    and offsets (e.g. memoryviews of a mapped file)"""
+    def __init__(self, blob, offsets):
+        self.blob    = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index) -> bytes:
+        return self.blob[self.offsets[index]:self.offsets[index + 1]]
+
+
+class EntryIndex():
+    """Reads an index file written by IndexBuilder.
+
+    The file is memory-mapped, so opening it is cheap and its pages are
+    shared by every process that opens the same file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        version, header_size = struct.unpack_from('<II', self._mmap, 4)
+        if self._mmap[:4] != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not an index file (version {VERSION})')
+        header = json.loads(bytes(self._mmap[12:12 + header_size]))
+        if header['record_format'] != serialize.FORMAT_VERSION:
+            raise ValueError(f"{path} stores its records in format {header['record_format']}, rebuild it")
+        self.num_entries = header['entries']
+
+        def section(name, fmt=None):
+            start, size = header['sections'][name]
+            part = view[start:start + size]
+            return part.cast(fmt) if fmt else part
+
+        self._headwords      = PackedStrings(section('headword_blob'), section('headword_offsets', 'Q'))
+        self._freqs          = section('freqs')
+        self._records        = section('records')
+        self._record_offsets = section('record_offsets', 'Q')
+        self._keys           = PackedStrings(section('key_blob'), section('key_offsets', 'Q'))
+        self._key_ids        = section('key_ids', 'I')
+        self._terms          = PackedStrings(section('term_blob'), section('term_offsets', 'Q'))
+        self._postings       = section('postings', 'I')
+        self._posting_offsets = section('posting_offsets', 'Q')
+
+    def __len__(self):
+        return self.num_entries
+
+    def headword(self, entry_id) -> str:
+        return bytes(self._headwords[entry_id]).decode('utf-8')
+
+    def freq(self, entry_id) -> int:
+        return self._freqs[entry_id]
+
+    def entry(self, entry_id) -> DictEntry:
+        start = self._record_offsets[entry_id]
+        return serialize.decode(self._records[start:self._record_offsets[entry_id + 1]])
+
+    def complete(self, prefix: str, limit=10) -> list[tuple[str, int]]:
+        """Returns (headword, entry id) of the headwords starting with prefix"""
+        encoded = prefix.lower().encode('utf-8')
+        index = bisect_packed(self._keys, encoded)
+        list_matches = []
+        while index < len(self._keys) and len(list_matches) < limit:
+            if not bytes(self._keys[index]).startswith(encoded):
+                break
+            entry_id = self._key_ids[index]
+            list_matches.append((self.headword(entry_id), entry_id))
+            index += 1
+        return list_matches
+
+    def posting(self, term: str):
+        """Returns the ids of the entries containing term (a memoryview)"""
+        encoded = term.encode('utf-8')
+        index = bisect_packed(self._terms, encoded)
+        if index == len(self._terms) or bytes(self._terms[index]) != encoded:
+            return self._postings[0:0]
+        return self._postings[self._posting_offsets[index]:self._posting_offsets[index + 1]]
+
+    def search(self, text='', grammar=(), style=(), dialect=(), min_freq=0, limit=20) -> list[int]:
+        """
+        Returns the ids of the entries whose definitions or examples
+        contain every word of text, and that have all the given
+        grammar/style/dialect labels and at least min_freq stars
+        """
+        list_terms = tokenize(text)
+        for kind, labels in (('grammar', grammar), ('style', style), ('dialect', dialect)):
+            list_terms.extend(label_term(kind, label) for label in labels)
+
+        if list_terms:
+            list_postings = sorted((self.posting(term) for term in list_terms), key=len)
+            candidates = list_postings[0]
+            # small posting lists are checked with sets, large ones by
+            # bisecting, so common terms are only probed until the limit
+            list_checks = []
+            for posting in list_postings[1:]:
+                if len(posting) <= SET_POSTING_SIZE:
+                    list_checks.append(set(posting.tolist()).__contains__)
+                else:
+                    list_checks.append(lambda entry_id, posting=posting: _contains(posting, entry_id))
+        else:
+            candidates = range(self.num_entries)
+            list_checks = []
+
+        list_ids = []
+        for entry_id in candidates:
+            if min_freq and self._freqs[entry_id] < min_freq:
+                continue
+            for check in list_checks:
+                if not check(entry_id):
+                    break
+            else:
+                list_ids.append(entry_id)
+                if limit and len(list_ids) >= limit:
+                    break
+        return list_ids
+
+    def close(self):
+        for name in list(vars(self)):
+            if name.startswith('_') and isinstance(getattr(self, name), (memoryview, PackedStrings)):
+                delattr(self, name)
+        self._mmap.close()
+        self._file.close()
+
+
+def bisect_packed(table, encoded) -> int:
+    """The position of encoded in a PackedStrings sorted by bytes, as
+    bisect_left"""
+    low, high = 0, len(table)
+    while low < high:
+        middle = (low + high) // 2
+        if bytes(table[middle]) < encoded:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _contains(posting, entry_id) -> bool:
+    index = bisect_left(posting, entry_id)
+    return index < len(posting) and posting[index] == entry_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_build = subparsers.add_parser('build', help='build an index from export.py JSONL files')
+    parser_build.add_argument('index')
+    parser_build.add_argument('jsonl', nargs='+')
+
+    parser_complete = subparsers.add_parser('complete', help='headwords starting with a prefix')
+    parser_complete.add_argument('index')
+    parser_complete.add_argument('prefix')
+    parser_complete.add_argument('--limit', type=int, default=10)
+
+    parser_search = subparsers.add_parser('search', help='entries whose definitions or examples match')
+    parser_search.add_argument('index')
+    parser_search.add_argument('text')
+    for kind in LABEL_KINDS:
+        parser_search.add_argument(f'--{kind}', action='append', default=[])
+    parser_search.add_argument('--min-freq', type=int, default=0)
+    parser_search.add_argument('--limit', type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        builder = IndexBuilder()
+        for path in args.jsonl:
+            builder.add_jsonl(path)
+        builder.write(args.index)
+        print(f'{len(builder.headwords)} entries, {len(builder.postings)} terms')
+        return
+
+    index = EntryIndex(args.index)
+    if args.command == 'complete':
+        for headword, entry_id in index.complete(args.prefix, limit=args.limit):
+            print(f'{entry_id}\t{headword}')
+    elif args.command == 'search':
+        for entry_id in index.search(args.text, grammar=args.grammar, style=args.style,
+                dialect=args.dialect, min_freq=args.min_freq, limit=args.limit):
+            dict_entry = index.entry(entry_id)
+            first_defn = dict_entry.defns[0].defn if dict_entry.defns else ''
+            print(f'{entry_id}\t{dict_entry.word}\t{first_defn}')
+
+
+if __name__ == '__main__':
+    main()
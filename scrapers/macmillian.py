@@ -1,84 +1,324 @@
-from bs4 import BeautifulSoup as Soup
-import lxml
-import cchardet
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from utils import split_list
-from scraper import Scraper
+from scraper import DictScraper
+from registry import register
+from singleflight import canonical_url
+import metrics
 from models import (
     ExampleGroup,
     WordDefinition,
     DictEntry,
     Phonetics,
     Keywords,
-    ErrorList
+    ErrorList,
+    LazyDictEntry
 )
 
 
-class MacMillianDictScraper(Scraper):
+@register
+class MacMillianDictScraper(DictScraper):
+    name       = 'macmillan'
     search_url = 'https://www.macmillandictionary.com/us/search/{dial}/direct/?q={word}'
     slug_url   = 'https://www.macmillandictionary.com/dictionary/{dial}/{slug}'
     dial_options = ('american', 'british')
-
-
-    def __init__(self, word=None, slug=None, dial=None, recursive=True):
-        self.dial      = 'american' if dial not in self.dial_options else dial
-        self.word      = '' if word is None else word
-        self.slug      = '' if slug is None else slug
-        self.recursive = recursive
-
-        if slug:
-            final_url = self.slug_url.format(dial=self.dial, slug=self.slug)
-        else:
-            final_url = self.search_url.format(dial=self.dial, word=self.word)
-        super().__init__(final_url)
+    engines      = ('bs4', 'lxml')
+    source       = 'MacMillian Dicionary'
+    # bump whenever a change in the scrape_* methods changes their output,
+    # results stored in an EntryCache under older versions are ignored
+    parser_version = 1
+
+
+    def __init__(self, word=None, slug=None, dial=None, recursive=True,
+            transport=None, cache=None, entry_cache=None, engine='bs4', memo=None,
+            speller=None, lazy=False, related_workers=4, related_deadline=None, salvage=False):
+        self.recursive   = recursive
+        self.entry_cache = entry_cache
+        self.engine      = engine if engine in self.engines else 'bs4'
+        self.memo        = memo
+        self.speller     = speller
+        self.lazy        = lazy
+        self.related_workers  = related_workers
+        self.related_deadline = related_deadline
+        self.related_missing  = []
+        # with salvage, the senses and related entries that fail are
+        # left out of the result and their errors recorded here
+        self.salvage          = salvage
+        self.salvage_errors   = []
+        self._started     = None
+        self._lxml_parser = None
+        super().__init__(word, slug=slug, dial=dial, transport=transport, cache=cache)
+
+
+    def entry_key(self) -> str:
+        kind = 'slug' if self.slug else 'word'
+        name = self.slug if self.slug else self.word
+        depth = 'recursive' if self.recursive else 'single'
+        return f'{kind}:{name} {self.dial} {depth} p{self.parser_version}'
+
+
+    def resolve_spelling(self):
+        """
+        Checks the searched word against the speller (a fuzzy.SpellIndex)
+        before anything is fetched: a confident correction replaces the
+        word; otherwise, with an authoritative speller, the suggestions
+        are returned as an ErrorList, without going to the site
+        """
+        if self.speller is None or self.slug or self.word in self.speller:
+            return None
+        correction = self.speller.correct(self.word)
+        if correction is not None:
+            self.word = correction
+            self.url = self.search_url.format(dial=self.dial, word=self.word)
+            return None
+        if self.speller.authoritative:
+            return self.speller.suggest(self.word)
+        return None
 
 
     def extract(self):
-        self.load()
+        self._started = time.monotonic()
+        with metrics.lookup():
+            offline_error = self.resolve_spelling()
+            if offline_error is not None:
+                return offline_error
+
+            # lazy entries are not cached: storing them would parse them whole
+            if self.entry_cache is None or self.lazy:
+                return self._extract()
+
+            entry_key = self.entry_key()
+            sanitized_data = self.entry_cache.get(entry_key)
+            if sanitized_data is None:
+                sanitized_data = self._extract()
+                # entries missing related pages or senses are not stored
+                if not self.related_missing and not self.salvage_errors:
+                    self.entry_cache.put(entry_key, sanitized_data)
+            return sanitized_data
+
+
+    def _extract(self):
+        self.raw()
         if self.is_error_page():
             return self.parse_error_page()
         return self.parse_word_page()
 
 
+    def lxml_parser(self):
+        from macmillian_lxml import MacMillianLxmlParser
+        if self._lxml_parser is None or self._lxml_parser.tree is not self.tree():
+            self._lxml_parser = MacMillianLxmlParser(
+                self.tree(), source=self.source, url=self.full_url(),
+                salvage_errors=self.salvage_errors if self.salvage else None
+            )
+        return self._lxml_parser
+
+
     def is_error_page(self) -> bool:
+        """
+        Whether the page is the search results of a word not found.
+        HTTP errors (404, 5xx...) are raised: their bodies are not
+        dictionary pages, and the fetch should be tried again or failed,
+        not parsed and salvaged
+        """
+        self.raw().raise_for_status()
+        if self.engine == 'lxml':
+            return self.lxml_parser().is_error_page()
         return bool(self.html().select('#search-results'))
 
 
+    @metrics.timed('scrape.parse_word_page')
     def parse_word_page(self) -> list[DictEntry]:
+        # the deadline runs from the start of the lookup
+        start = time.monotonic() if self._started is None else self._started
         sanitized_entries = []
 
         # get main page entry
-        sanitized_main_entry = self.scrape_word_page()
+        sanitized_main_entry = self.scrape_word_page(lazy=self.lazy)
         sanitized_entries.append(sanitized_main_entry)
 
         # get related pages
-        text_title = sanitized_main_entry.word
-        list_elm_related_links = self.html().select("#innerleftcol .related-entries-item a")
         if self.recursive:
-            for elm_related_links in list_elm_related_links:
-                elm_related_word = elm_related_links.select('.BASE')
+            list_slugs = self.related_slugs(sanitized_main_entry.word)
+            deadline = None
+            if self.related_deadline is not None:
+                deadline = start + self.related_deadline
+            for sanitized_data in self.extract_related(list_slugs, deadline):
+                sanitized_entries.extend(sanitized_data)
 
-                if elm_related_word:
-                    text_related_word = elm_related_word[0].get_text()
+        return sanitized_entries
 
-                    if text_title == text_related_word:
-                        # get the page
-                        slug = elm_related_links.attrs['href'].split('/')[-1]
-                        sanitized_data = MacMillianDictScraper(
-                            slug=slug, dial=self.dial, recursive=False
-                        ).extract()
-                        sanitized_entries.extend(sanitized_data)
 
-        return sanitized_entries
+    def extract_related(self, list_slugs, deadline=None) -> list:
+        """
+        Extracts the related entries of list_slugs, fetching up to
+        related_workers of them at the same time. Returns their results
+        in the order of list_slugs; the entries not done by deadline (a
+        time.monotonic() value) are left out and their slugs put in
+        related_missing, as are the entries that fail to parse with
+        salvage. Fetch errors (OSError, as the requests exceptions and
+        DeadlineExceeded) are always raised, to be retried by the caller
+        """
+        self.related_missing = []
+        list_related = []
+        for slug in list_slugs:
+            related_scraper = self.related_scraper(slug)
+            if deadline is not None:
+                related_scraper.timeout = max(0.1, min(related_scraper.timeout, deadline - time.monotonic()))
+            list_related.append(related_scraper)
+        metrics.increment('related', len(list_related))
+
+        if deadline is None and (len(list_related) <= 1 or self.related_workers <= 1):
+            list_results = []
+            for slug, related_scraper in zip(list_slugs, list_related):
+                try:
+                    sanitized_data, list_errors = self._extract_related(related_scraper)
+                    list_results.append(sanitized_data)
+                    self.salvage_errors.extend(list_errors)
+                except Exception as exception:
+                    if not self.salvage or isinstance(exception, OSError):
+                        raise
+                    self._salvage_related(slug, exception)
+            return list_results
+
+        pool = ThreadPoolExecutor(min(self.related_workers, len(list_related)) or 1, thread_name_prefix='related')
+        try:
+            # the workers report to the metrics lookup of this one
+            list_futures = [
+                pool.submit(contextvars.copy_context().run, self._extract_related, related_scraper)
+                for related_scraper in list_related
+            ]
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            wait(list_futures, timeout=timeout)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        # the workers still running past the deadline only write to the
+        # errors of their own scraper, those of the finished ones are merged
+        list_results = []
+        for slug, future in zip(list_slugs, list_futures):
+            if not future.done() or future.cancelled():
+                self.related_missing.append(slug)
+                continue
+            exception = future.exception()
+            if exception is None:
+                sanitized_data, list_errors = future.result()
+                list_results.append(sanitized_data)
+                self.salvage_errors.extend(list_errors)
+            elif isinstance(exception, OSError) and deadline is not None and time.monotonic() >= deadline:
+                # cut short by the deadline (its timeout ends with it)
+                self.related_missing.append(slug)
+            elif self.salvage and not isinstance(exception, OSError):
+                self._salvage_related(slug, exception)
+            else:
+                raise exception
+        if self.related_missing:
+            metrics.increment('related_missing', len(self.related_missing))
+        return list_results
+
 
+    def _salvage_related(self, slug, exception):
+        self.related_missing.append(slug)
+        self.salvage_errors.append(f'related {slug}: {exception!r}')
 
-    def scrape_word_page(self) -> DictEntry:
+
+    def _extract_related(self, related_scraper):
+        """
+        Returns the result of related_scraper and the errors salvaged
+        from it, shared through the memo with the other lookups of the
+        batch
+        """
+        def extract():
+            return related_scraper.extract(), list(related_scraper.salvage_errors)
+
+        if self.memo is not None:
+            return self.memo.do(canonical_url(related_scraper.full_url()), extract)
+        return extract()
+
+
+    @metrics.timed('scrape.related_slugs')
+    def related_slugs(self, text_title) -> list[str]:
+        """
+        Returns the slugs of the related entries whose headword
+        is the same as text_title (e.g. run_1, run_2)
+        """
+        if self.engine == 'lxml':
+            return self.lxml_parser().related_slugs(text_title)
+
+        list_slugs = []
+        list_elm_related_links = self.html().select("#innerleftcol .related-entries-item a")
+        for elm_related_links in list_elm_related_links:
+            elm_related_word = elm_related_links.select('.BASE')
+
+            if elm_related_word:
+                text_related_word = elm_related_word[0].get_text()
+
+                if text_title == text_related_word:
+                    slug = elm_related_links.attrs['href'].split('/')[-1]
+                    list_slugs.append(slug)
+        return list_slugs
+
+
+    def related_scraper(self, slug):
+        """
+        Returns a non-recursive scraper for a related entry page,
+        sharing this scraper's settings (dialect, transport, caches, memo)
+        """
+        related_scraper = type(self)(
+            slug=slug, dial=self.dial, recursive=False,
+            transport=self.transport, cache=self.cache,
+            entry_cache=self.entry_cache, engine=self.engine, memo=self.memo,
+            lazy=self.lazy, salvage=self.salvage
+        )
+        return related_scraper
+
+
+    @metrics.timed('scrape.word_page')
+    def scrape_word_page(self, lazy=False) -> DictEntry:
         """
         Receives a dict entry from MacMillian dictioanary
-        Returns a DictEntry object
+        Returns a DictEntry object, or a LazyDictEntry parsing each
+        field on first access when lazy is True
         """
+        if lazy:
+            return LazyDictEntry(
+                word=self.scrape_word,
+                pos=self.scrape_pos,
+                phonetics=self.scrape_phonetics,
+                keywords=self.scrape_entry_keywords,
+                defns=self.scrape_entry_defns,
+                freq=self.scrape_freq,
+                source=lambda: self.source,
+            )
+        if self.engine == 'lxml':
+            return self.lxml_parser().scrape_word_page()
+
+        return DictEntry(
+           word=self.scrape_word(),
+           pos=self.scrape_pos(),
+           phonetics=self.scrape_phonetics(),
+           keywords=self.scrape_entry_keywords(),
+           defns=self.scrape_entry_defns(),
+           freq=self.scrape_freq(),
+           source=self.source
+        )
+
+
+    @metrics.timed('scrape.word')
+    def scrape_word(self) -> str:
+        if self.engine == 'lxml':
+            return self.lxml_parser().scrape_word()
+
         # get word of the page
-        sanitized_word = self.html().select('.big-title > .BASE')[0].get_text()
+        return self.html().select('.big-title > .BASE')[0].get_text()
+
+
+    @metrics.timed('scrape.phonetics')
+    def scrape_phonetics(self) -> list[Phonetics]:
+        if self.engine == 'lxml':
+            return self.lxml_parser().scrape_phonetics()
 
         # get word phonetic pronunciation, if any
         list_scraped_phonetics = self.html().select('div.PRONS')
@@ -91,19 +331,26 @@ class MacMillianDictScraper(Scraper):
                 sanitized_phonetics_spelling = scraped_spelling[0].get_text().strip()
                 sanitized_phonetics_dialect = scraped_dialect[0].get_text()
 
+            # GET QUALIFIER (e.g. STRONG, WEAK, US, UK) [only sometimes]
+            scraped_qualifier = scraped_phonetics.select('.QUALIFIER')
+            sanitized_phonetics_qualifier = ''
+            if scraped_qualifier:
+                sanitized_phonetics_qualifier = scraped_qualifier[0].get_text()
+
             # CREATE PHONETICS OBJECT
             sanitized_phonetics = Phonetics(
                 spelling=sanitized_phonetics_spelling,
                 dialect=sanitized_phonetics_dialect,
+                qualifier=sanitized_phonetics_qualifier,
             )
             list_sanitized_phonetics.append(sanitized_phonetics)
+        return list_sanitized_phonetics
 
-            # GET QUALIFIER (e.g. STRONG, WEAK, US, UK) [only sometimes]
-            scraped_qualifier = scraped_phonetics.select('.QUALIFIER')
-            if scraped_qualifier:
-                 sanitized_phonetics_qualifier= scraped_qualifier[0].get_text()
-                 sanitized_phonetics.qualifier = sanitized_phonetics_qualifier
 
+    @metrics.timed('scrape.pos')
+    def scrape_pos(self) -> list[str]:
+        if self.engine == 'lxml':
+            return self.lxml_parser().scrape_pos()
 
         # get word part of speech, if any
         scraped_pos = self.html().select('.entry-labels > .PART-OF-SPEECH')
@@ -111,6 +358,13 @@ class MacMillianDictScraper(Scraper):
         if scraped_pos:
             self._remove_zero_space(scraped_pos[0])
             list_sanitized_pos = scraped_pos[0].get_text().split(', ')
+        return list_sanitized_pos
+
+
+    @metrics.timed('scrape.entry_keywords')
+    def scrape_entry_keywords(self) -> Keywords:
+        if self.engine == 'lxml':
+            return self.lxml_parser().scrape_entry_keywords()
 
         # get word keywrods (e.g. TRANSITIVE, COUNTABLE, PLURAL ...)
         elm_entry_labels = self.html().find(True, class_='entry-labels')
@@ -121,7 +375,13 @@ class MacMillianDictScraper(Scraper):
             'GRAMMAR-TEXT',
             'DIALECT'
         ], recursive=False)
-        sanitized_keywords = self.scrape_keywords(list_scraped_keywords)
+        return self.scrape_keywords(list_scraped_keywords)
+
+
+    @metrics.timed('scrape.freq')
+    def scrape_freq(self) -> str:
+        if self.engine == 'lxml':
+            return self.lxml_parser().scrape_freq()
 
         # get frequency info (red stars)
         list_red_stars = self.html().select('.entry-red-star')
@@ -129,23 +389,22 @@ class MacMillianDictScraper(Scraper):
         if list_red_stars:
             text_num_stars = len(list_red_stars)
             text_frequency = '\u2605' * text_num_stars
-        
+        return text_frequency
+
+
+    @metrics.timed('scrape.entry_defns')
+    def scrape_entry_defns(self, limit=None) -> list[WordDefinition]:
+        """The definitions of the page, only the first `limit` ones
+        (with their sub-definitions) if limit is given"""
+        if self.engine == 'lxml':
+            return self.lxml_parser().scrape_entry_defns(limit)
 
         # get dict entries
         list_scraped_defns = self.html().select('.SENSE-BODY, .SUB-SENSE-BODY')
-        list_sanitized_defns = self.scrape_defns(list_scraped_defns)
-        
-        return DictEntry(
-           word=sanitized_word,
-           pos=list_sanitized_pos,
-           phonetics=list_sanitized_phonetics,
-           keywords=sanitized_keywords,
-           defns=list_sanitized_defns,
-           freq=text_frequency,
-           source='MacMillian Dicionary'
-        )
+        return self.scrape_defns(list_scraped_defns, limit)
 
 
+    @metrics.timed('scrape.keywords')
     def scrape_keywords(self, list_scraped_tags) -> Keywords:
         keywords_grammar     = []
         keywords_style       = []
@@ -172,68 +431,98 @@ class MacMillianDictScraper(Scraper):
         )
 
 
-    def scrape_defns(self, list_scraped_defns) -> list[WordDefinition]:
+    @metrics.timed('scrape.defns')
+    def scrape_defns(self, list_scraped_defns, limit=None) -> list[WordDefinition]:
         """
         Receives a list of .SENSE-BODY or .SUB-SENSE-BODY html elements
         from a MacMillian Dicionary entry page
 
-        Return a list of WordDefinition objects
+        Return a list of WordDefinition objects, stopping after the
+        first `limit` definitions if limit is given. With salvage, the
+        senses that cannot be parsed are left out with their sub-senses,
+        and their errors recorded in salvage_errors
         """
         list_sanitized_defns = []
-        for scraped_defn in list_scraped_defns:
-
-            # definition number
-            scraped_number = scraped_defn.select('.SENSE-NUM')
-            sanitized_number = '' if not scraped_number else scraped_number[0].get_text()
-
-            scraped_defn = scraped_defn.find(True, class_=['SENSE-CONTENT', 'SUB-SENSE-CONTENT'])
-            # meaning info (e.g TRANSITIVE, COUNTABLE...)
-            # .STYNTAX-CODING: transitive ...
-            # .RESTRICTION-CLASS: never progressive ...
-            # .STYLE-LEVEL: mainly spoaken ...
-            list_scraped_keywords = scraped_defn.find_all(True,
-                class_=[
-                    'SYNTAX-CODING',
-                    'RESTRICTION-CLASS',
-                    'STYLE-LEVEL',
-                    'GRAMMAR-TEXT',
-                    'DIALECT'
-                ],
-            recursive=False)
-            sanitized_keywords = self.scrape_keywords(list_scraped_keywords)
-
-            # extracting definition
-            scraped_meaning = scraped_defn.select('.DEFINITION, .SAMEAS, .QUICK-DEFINITION')
-            sanitized_meaning = scraped_meaning[0].get_text()
-
-            # extracting sentences examples and collocations
-            list_sanitized_examples = []
-            list_scraped_examples = scraped_defn.find_all('div', class_='EXAMPLES', recursive=True)
-            if list_scraped_examples:
-                list_sanitized_examples = self.scrape_defn_examples(list_scraped_examples)
-
-            sanitized_defn = WordDefinition(
-                number=sanitized_number,
-                defn=sanitized_meaning,
-                examples=list_sanitized_examples,
-                keywords=sanitized_keywords
-            )
-
-            # append in list_sanitized_defns
-            if scraped_defn.attrs['class'][0] == 'SUB-SENSE-CONTENT':
-                if class_last_defn == 'SUB-SENSE-CONTENT':
-                    list_sanitized_defns[-1].subdefns.append(sanitized_defn)
-                else:
-                    last_sanitized_defn.subdefns.append(sanitized_defn)
+        parent_failed = False
+        for position, scraped_body in enumerate(list_scraped_defns):
+            scraped_defn = scraped_body.find(True, class_=['SENSE-CONTENT', 'SUB-SENSE-CONTENT'])
+            is_subsense = scraped_defn is not None and scraped_defn.attrs['class'][0] == 'SUB-SENSE-CONTENT'
+            if limit is not None and len(list_sanitized_defns) >= limit and not is_subsense:
+                break
+
+            # the sub-senses of a sense that failed would end up under
+            # the sense before it: they are left out with their sense
+            if is_subsense and parent_failed:
+                self.salvage_errors.append(f'{self.full_url()} sense {position}: sub-sense of a sense that failed')
+                continue
+
+            try:
+                sanitized_defn = self.scrape_defn(scraped_body, scraped_defn)
+            except Exception as exception:
+                if not self.salvage:
+                    raise
+                self.salvage_errors.append(f'{self.full_url()} sense {position}: {exception!r}')
+                if not is_subsense:
+                    parent_failed = True
+                continue
+            if not is_subsense:
+                parent_failed = False
+
+            # sub-senses go under the last sense, unless the page opens with one
+            if is_subsense and list_sanitized_defns:
+                list_sanitized_defns[-1].subdefns.append(sanitized_defn)
             else:
                 list_sanitized_defns.append(sanitized_defn)
 
-            class_last_defn = scraped_defn.attrs['class'][0]
-            last_sanitized_defn = sanitized_defn
-
         return list_sanitized_defns
 
 
+    def scrape_defn(self, scraped_body, scraped_defn) -> WordDefinition:
+        """
+        Receives a .SENSE-BODY or .SUB-SENSE-BODY html element and its
+        .SENSE-CONTENT or .SUB-SENSE-CONTENT element
+        """
+        if scraped_defn is None:
+            raise ValueError('sense without content')
+
+        # definition number
+        scraped_number = scraped_body.select('.SENSE-NUM')
+        sanitized_number = '' if not scraped_number else scraped_number[0].get_text()
+
+        # meaning info (e.g TRANSITIVE, COUNTABLE...)
+        # .STYNTAX-CODING: transitive ...
+        # .RESTRICTION-CLASS: never progressive ...
+        # .STYLE-LEVEL: mainly spoaken ...
+        list_scraped_keywords = scraped_defn.find_all(True,
+            class_=[
+                'SYNTAX-CODING',
+                'RESTRICTION-CLASS',
+                'STYLE-LEVEL',
+                'GRAMMAR-TEXT',
+                'DIALECT'
+            ],
+        recursive=False)
+        sanitized_keywords = self.scrape_keywords(list_scraped_keywords)
+
+        # extracting definition
+        scraped_meaning = scraped_defn.select('.DEFINITION, .SAMEAS, .QUICK-DEFINITION')
+        sanitized_meaning = scraped_meaning[0].get_text()
+
+        # extracting sentences examples and collocations
+        list_sanitized_examples = []
+        list_scraped_examples = scraped_defn.find_all('div', class_='EXAMPLES', recursive=True)
+        if list_scraped_examples:
+            list_sanitized_examples = self.scrape_defn_examples(list_scraped_examples)
+
+        return WordDefinition(
+            number=sanitized_number,
+            defn=sanitized_meaning,
+            examples=list_sanitized_examples,
+            keywords=sanitized_keywords
+        )
+
+
+    @metrics.timed('scrape.defn_examples')
     def scrape_defn_examples(self, list_scraped_examples) -> list[ExampleGroup]:
         """
         Receives a list of div.EXAMPLES HTML elements
@@ -274,12 +563,16 @@ class MacMillianDictScraper(Scraper):
         return self.scrape_error_page()
 
 
+    @metrics.timed('scrape.error_page')
     def scrape_error_page(self) -> ErrorList:
         """
         Scrape the content of the error page
         (e.g. when you types an word that does not exist)
         Returns an ErrorList object
         """
+        if self.engine == 'lxml':
+            return self.lxml_parser().scrape_error_page()
+
         # scrape the texts
         text_title = self.html().select('#search-results h1')[0].get_text()
         text_subtitle = self.html().select('.entry-bold')[0].get_text()
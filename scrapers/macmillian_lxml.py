@@ -0,0 +1,301 @@
+from lxml import etree
+
+from utils import split_list
+from models import (
+    ExampleGroup,
+    WordDefinition,
+    DictEntry,
+    Phonetics,
+    Keywords,
+    ErrorList
+)
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _classes(elm):
+    return elm.get('class', '').split()
+
+
+def _text(elm):
+    return elm.text_content()
+
+
+KEYWORD_CLASSES = frozenset((
+    'SYNTAX-CODING',
+    'RESTRICTION-CLASS',
+    'STYLE-LEVEL',
+    'GRAMMAR-TEXT',
+    'DIALECT'
+))
+CONTENT_CLASSES    = frozenset(('SENSE-CONTENT', 'SUB-SENSE-CONTENT'))
+DEFINITION_CLASSES = frozenset(('DEFINITION', 'SAMEAS', 'QUICK-DEFINITION'))
+
+XPATH_WORD          = etree.XPath(f"//*[{_has_class('big-title')}]/*[{_has_class('BASE')}]")
+XPATH_PRONS         = etree.XPath(f"//div[{_has_class('PRONS')}]")
+XPATH_POS           = etree.XPath(f"//*[{_has_class('entry-labels')}]/*[{_has_class('PART-OF-SPEECH')}]")
+XPATH_ENTRY_LABELS  = etree.XPath(f"//*[{_has_class('entry-labels')}]")
+XPATH_RED_STARS     = etree.XPath(f"count(//*[{_has_class('entry-red-star')}])")
+XPATH_SENSES        = etree.XPath(f"//*[{_has_class('SENSE-BODY')} or {_has_class('SUB-SENSE-BODY')}]")
+XPATH_RELATED_LINKS = etree.XPath(f"//*[@id='innerleftcol']//*[{_has_class('related-entries-item')}]//a")
+XPATH_BASE          = etree.XPath(f".//*[{_has_class('BASE')}]")
+XPATH_SEARCH        = etree.XPath("//*[@id='search-results']")
+XPATH_ERROR_TITLE   = etree.XPath("//*[@id='search-results']//h1")
+XPATH_ERROR_TEXT    = etree.XPath(f"//*[{_has_class('entry-bold')}]")
+XPATH_ERROR_WORDS   = etree.XPath(f"//*[{_has_class('display-list')}]//li")
+XPATH_ZERO_SPACE    = etree.XPath(f".//span[{_has_class('zwsp')}]")
+
+
+class MacMillianLxmlParser():
+    """Extracts the same models as MacMillianDictScraper, working on
+    an lxml.html tree with precompiled XPath expressions instead of
+    BeautifulSoup select() calls.
+
+    Each sense body is walked once: the number and the content element
+    are taken from the body, then keywords, definition and examples
+    from a single walk of the content.
+    """
+    def __init__(self, tree, source='', url='', salvage_errors=None):
+        self.tree           = tree
+        self.source         = source
+        self.url            = url
+        # a list to salvage the parsable senses into, see scrape_defns
+        self.salvage_errors = salvage_errors
+
+    def is_error_page(self) -> bool:
+        return bool(XPATH_SEARCH(self.tree))
+
+    def related_slugs(self, text_title) -> list[str]:
+        list_slugs = []
+        for elm_related_links in XPATH_RELATED_LINKS(self.tree):
+            elm_related_word = XPATH_BASE(elm_related_links)
+            if elm_related_word and _text(elm_related_word[0]) == text_title:
+                list_slugs.append(elm_related_links.get('href').split('/')[-1])
+        return list_slugs
+
+    def scrape_word_page(self) -> DictEntry:
+        return DictEntry(
+           word=self.scrape_word(),
+           pos=self.scrape_pos(),
+           phonetics=self.scrape_phonetics(),
+           keywords=self.scrape_entry_keywords(),
+           defns=self.scrape_entry_defns(),
+           freq=self.scrape_freq(),
+           source=self.source
+        )
+
+    def scrape_word(self) -> str:
+        return _text(XPATH_WORD(self.tree)[0])
+
+    def scrape_phonetics(self) -> list[Phonetics]:
+        # get word phonetic pronunciation, if any
+        list_sanitized_phonetics = []
+        for scraped_phonetics in XPATH_PRONS(self.tree):
+            scraped_spelling  = None
+            scraped_dialect   = None
+            scraped_qualifier = None
+            for elm in scraped_phonetics.iterdescendants(etree.Element):
+                class_list = _classes(elm)
+                if scraped_spelling is None and 'PRON' in class_list:
+                    scraped_spelling = elm
+                if scraped_dialect is None and 'pron_resource' in class_list:
+                    scraped_dialect = elm
+                if scraped_qualifier is None and 'QUALIFIER' in class_list:
+                    scraped_qualifier = elm
+
+            if scraped_spelling is not None:
+                sanitized_phonetics_spelling = _text(scraped_spelling).strip()
+                sanitized_phonetics_dialect = _text(scraped_dialect)
+
+            sanitized_phonetics_qualifier = ''
+            if scraped_qualifier is not None:
+                sanitized_phonetics_qualifier = _text(scraped_qualifier)
+
+            list_sanitized_phonetics.append(Phonetics(
+                spelling=sanitized_phonetics_spelling,
+                dialect=sanitized_phonetics_dialect,
+                qualifier=sanitized_phonetics_qualifier,
+            ))
+        return list_sanitized_phonetics
+
+    def scrape_pos(self) -> list[str]:
+        # get word part of speech, if any
+        scraped_pos = XPATH_POS(self.tree)
+        list_sanitized_pos = []
+        if scraped_pos:
+            self._remove_zero_space(scraped_pos[0])
+            list_sanitized_pos = _text(scraped_pos[0]).split(', ')
+        return list_sanitized_pos
+
+    def scrape_entry_keywords(self) -> Keywords:
+        elm_entry_labels = XPATH_ENTRY_LABELS(self.tree)[0]
+        return self.scrape_keywords(
+            elm for elm in elm_entry_labels.iterchildren(tag=etree.Element)
+            if KEYWORD_CLASSES.intersection(_classes(elm))
+        )
+
+    def scrape_freq(self) -> str:
+        # get frequency info (red stars)
+        return '\u2605' * int(XPATH_RED_STARS(self.tree))
+
+    def scrape_entry_defns(self, limit=None) -> list[WordDefinition]:
+        return self.scrape_defns(XPATH_SENSES(self.tree), limit)
+
+    def scrape_keywords(self, list_scraped_tags) -> Keywords:
+        keywords_grammar     = []
+        keywords_style       = []
+        keywords_dialect     = []
+        keywords_restriction = []
+        for scraped_keyword in list_scraped_tags:
+            self._remove_zero_space(scraped_keyword)
+            sanitized_keyword = _text(scraped_keyword).strip()
+
+            class_list = _classes(scraped_keyword)[0]
+            if class_list == 'SYNTAX-CODING':
+                keywords_grammar.append(sanitized_keyword)
+            elif class_list == 'STYLE-LEVEL':
+                keywords_style.append(sanitized_keyword)
+            elif class_list == 'DIALECT':
+                keywords_dialect.append(sanitized_keyword)
+            elif class_list == 'RESTRICTION-CLASS':
+                keywords_restriction.append(sanitized_keyword)
+        return Keywords(
+            grammar=keywords_grammar,
+            style=keywords_style,
+            dialect=keywords_dialect,
+            warnings=keywords_restriction
+        )
+
+    def scrape_defns(self, list_scraped_defns, limit=None) -> list[WordDefinition]:
+        list_sanitized_defns = []
+        parent_failed = False
+        for position, scraped_body in enumerate(list_scraped_defns):
+
+            # definition number and content, from one walk of the body
+            scraped_number = None
+            scraped_defn   = None
+            for elm in scraped_body.iterdescendants(etree.Element):
+                class_list = _classes(elm)
+                if scraped_number is None and 'SENSE-NUM' in class_list:
+                    scraped_number = elm
+                if scraped_defn is None and CONTENT_CLASSES.intersection(class_list):
+                    scraped_defn = elm
+                if scraped_number is not None and scraped_defn is not None:
+                    break
+            is_subsense = scraped_defn is not None and _classes(scraped_defn)[0] == 'SUB-SENSE-CONTENT'
+            if limit is not None and len(list_sanitized_defns) >= limit and not is_subsense:
+                break
+
+            # the sub-senses of a sense that failed would end up under
+            # the sense before it: they are left out with their sense
+            if is_subsense and parent_failed:
+                self.salvage_errors.append(f'{self.url} sense {position}: sub-sense of a sense that failed')
+                continue
+
+            try:
+                sanitized_defn = self.scrape_defn(scraped_number, scraped_defn)
+            except Exception as exception:
+                if self.salvage_errors is None:
+                    raise
+                self.salvage_errors.append(f'{self.url} sense {position}: {exception!r}')
+                if not is_subsense:
+                    parent_failed = True
+                continue
+            if not is_subsense:
+                parent_failed = False
+
+            # sub-senses go under the last sense, unless the page opens with one
+            if is_subsense and list_sanitized_defns:
+                list_sanitized_defns[-1].subdefns.append(sanitized_defn)
+            else:
+                list_sanitized_defns.append(sanitized_defn)
+
+        return list_sanitized_defns
+
+    def scrape_defn(self, scraped_number, scraped_defn) -> WordDefinition:
+        if scraped_defn is None:
+            raise ValueError('sense without content')
+        sanitized_number = '' if scraped_number is None else _text(scraped_number)
+
+        # keywords are direct children of the content
+        sanitized_keywords = self.scrape_keywords(
+            elm for elm in scraped_defn.iterchildren(tag=etree.Element)
+            if KEYWORD_CLASSES.intersection(_classes(elm))
+        )
+
+        # definition and examples, from one walk of the content
+        scraped_meaning = None
+        list_scraped_examples = []
+        for elm in scraped_defn.iterdescendants(etree.Element):
+            class_list = _classes(elm)
+            if scraped_meaning is None and DEFINITION_CLASSES.intersection(class_list):
+                scraped_meaning = elm
+            if elm.tag == 'div' and 'EXAMPLES' in class_list:
+                list_scraped_examples.append(elm)
+        if scraped_meaning is None:
+            raise IndexError('list index out of range')
+        sanitized_meaning = _text(scraped_meaning)
+
+        list_sanitized_examples = []
+        if list_scraped_examples:
+            list_sanitized_examples = self.scrape_defn_examples(list_scraped_examples)
+
+        return WordDefinition(
+            number=sanitized_number,
+            defn=sanitized_meaning,
+            examples=list_sanitized_examples,
+            keywords=sanitized_keywords
+        )
+
+    def scrape_defn_examples(self, list_scraped_examples) -> list[ExampleGroup]:
+        # first .PATTERNS-COLLOCATIONS and p.EXAMPLE of each div.EXAMPLES
+        list_scraped_pairs = []
+        list_pattern_indexes = []
+        for index, scraped_example in enumerate(list_scraped_examples):
+            scraped_pattern = None
+            scraped_sentence = None
+            for elm in scraped_example.iterdescendants(etree.Element):
+                class_list = _classes(elm)
+                if scraped_pattern is None and 'PATTERNS-COLLOCATIONS' in class_list:
+                    scraped_pattern = elm
+                if scraped_sentence is None and elm.tag == 'p' and 'EXAMPLE' in class_list:
+                    scraped_sentence = elm
+            if scraped_pattern is not None:
+                list_pattern_indexes.append(index)
+            list_scraped_pairs.append((scraped_pattern, scraped_sentence))
+
+        list_sanitized_patterns = []
+        list_parts = split_list(list_scraped_pairs, indexes=list_pattern_indexes)
+        for part in list_parts:
+            scraped_pattern = part[0][0]
+            list_sanitized_examples = []
+            for _, scraped_sentence in part:
+                if scraped_sentence is None:
+                    raise IndexError('list index out of range')
+                list_sanitized_examples.append(_text(scraped_sentence))
+
+            sanitized_pattern = '' if scraped_pattern is None else _text(scraped_pattern)
+            list_sanitized_patterns.append(ExampleGroup(
+                pattern=sanitized_pattern, examples=list_sanitized_examples
+            ))
+
+        return list_sanitized_patterns
+
+    def scrape_error_page(self) -> ErrorList:
+        text_title = _text(XPATH_ERROR_TITLE(self.tree)[0])
+        text_subtitle = _text(XPATH_ERROR_TEXT(self.tree)[0])
+        wordlist = [_text(elm_word) for elm_word in XPATH_ERROR_WORDS(self.tree)]
+        return ErrorList(
+            texts=[text_title, text_subtitle],
+            wordlist=wordlist
+        )
+
+    def _remove_zero_space(self, elm):
+        unnecessary_elm = XPATH_ZERO_SPACE(elm)
+        if unnecessary_elm:
+            unnecessary_elm = unnecessary_elm[0]
+            unnecessary_elm.text = None
+            for child in list(unnecessary_elm):
+                unnecessary_elm.remove(child)
@@ -0,0 +1,343 @@
+"""Timings and counters of the scrapers, sent to a pluggable sink.
+
+    import metrics
+    sink = metrics.HistogramSink()
+    metrics.set_sink(sink)
+    MacMillianDictScraper('run').extract()
+    print(sink.report())
+
+Nothing is measured while no sink is set: the instrumented functions
+only check a module variable, so the overhead is a few hundred
+nanoseconds per call.
+
+Metrics:
+    stage_seconds{stage}    duration of each stage: load, parse.html,
+                            parse.tree, scrape.*, render.*
+    fetch_wait_seconds      time until the response headers arrived
+                            (connect, TLS, server time)
+    fetch_download_seconds  time spent reading the body after that
+    response_bytes          size of each loaded page
+    lookup_seconds          duration of a whole lookup
+    lookup_fetches          pages loaded by a lookup
+    lookup_related          related entries extracted by a lookup
+"""
+import contextvars
+import functools
+import json
+import logging
+import math
+import os
+import threading
+from time import perf_counter
+
+
+_sink = None
+
+# the counters of the lookup in progress, if any
+_lookup_counts = contextvars.ContextVar('lookup_counts', default=None)
+
+
+def set_sink(sink):
+    """Sets the sink receiving the metrics (None disables them)"""
+    global _sink
+    _sink = sink
+
+
+def get_sink():
+    return _sink
+
+
+def enabled() -> bool:
+    return _sink is not None
+
+
+def observe(metric, value, **labels):
+    sink = _sink
+    if sink is not None:
+        sink.observe(metric, value, labels)
+
+
+def increment(name, amount=1):
+    """Counts an event, in the totals and in the lookup in progress"""
+    sink = _sink
+    if sink is None:
+        return
+    sink.increment(name, amount, {})
+    counts = _lookup_counts.get()
+    if counts is not None:
+        counts[name] = counts.get(name, 0) + amount
+
+
+class _NullStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage():
+    def __init__(self, sink, name):
+        self.sink  = sink
+        self.name  = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.observe('stage_seconds', perf_counter() - self.start, {'stage': self.name})
+        return False
+
+
+def stage(name):
+    """Context manager timing a block as the stage `name`"""
+    sink = _sink
+    if sink is None:
+        return _NULL_STAGE
+    return _Stage(sink, name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as the stage `name`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            sink = _sink
+            if sink is None:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sink.observe('stage_seconds', perf_counter() - start, {'stage': name})
+        return wrapper
+    return decorator
+
+
+class _Lookup():
+    def __init__(self, sink):
+        self.sink   = sink
+        self.counts = {'fetches': 0, 'related': 0}
+        self.token  = None
+        self.start  = 0.0
+
+    def __enter__(self):
+        self.token = _lookup_counts.set(self.counts)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.observe('lookup_seconds', perf_counter() - self.start, {})
+        for name, count in self.counts.items():
+            self.sink.observe(f'lookup_{name}', count, {})
+        _lookup_counts.reset(self.token)
+        return False
+
+
+def lookup():
+    """
+    Context manager around one lookup, reporting its duration and the
+    pages and related entries it needed; nested lookups (the related
+    entries of a lookup) are counted in the outer one
+    """
+    sink = _sink
+    if sink is None or _lookup_counts.get() is not None:
+        return _NULL_STAGE
+    return _Lookup(sink)
+
+
+def _labels_key(labels) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class Histogram():
+    """Counts values in geometric buckets (each one about 19% wider
+    than the previous), enough for percentiles of latencies and sizes"""
+    growth = 2 ** 0.25
+
+    def __init__(self):
+        self.count   = 0
+        self.sum     = 0.0
+        self.min     = math.inf
+        self.max     = -math.inf
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        bucket = math.ceil(math.log(value, self.growth)) if value > 0 else None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, percent) -> float:
+        """The upper bound of the bucket holding the percentile"""
+        if not self.count:
+            return 0.0
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets, key=lambda bucket: -math.inf if bucket is None else bucket):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return 0.0 if bucket is None else min(self.growth ** bucket, self.max)
+        return self.max
+
+
+class HistogramSink():
+    """Keeps a Histogram per metric (and labels) and a total per counter"""
+    def __init__(self):
+        self.histograms = {}
+        self.counters   = {}
+        self._lock      = threading.Lock()
+
+    def observe(self, metric, value, labels):
+        key = (metric, _labels_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.add(value)
+
+    def increment(self, name, amount, labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def summary(self) -> dict:
+        """{'metric{label=value}': {count, sum, mean, p50, p90, p99, max}}"""
+        dict_summary = {}
+        with self._lock:
+            for (metric, labels), histogram in sorted(self.histograms.items()):
+                name = metric + ('{' + ','.join(f'{key}={value}' for key, value in labels) + '}' if labels else '')
+                dict_summary[name] = {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'mean': histogram.sum / histogram.count,
+                    'p50': histogram.percentile(50),
+                    'p90': histogram.percentile(90),
+                    'p99': histogram.percentile(99),
+                    'max': histogram.max,
+                }
+        return dict_summary
+
+    def report(self) -> str:
+        list_lines = [f"{'metric':<52}{'count':>8}{'mean':>12}{'p50':>12}{'p99':>12}{'max':>12}"]
+        for name, row in self.summary().items():
+            scale, unit = (1000, 'ms') if '_seconds' in name else (1, '')
+            list_lines.append(
+                f"{name:<52}{row['count']:>8}"
+                + ''.join(f'{row[column] * scale:>10.2f}{unit:<2}' for column in ('mean', 'p50', 'p99', 'max'))
+            )
+        return '\n'.join(list_lines)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class LogSink():
+    """Writes every observation as one JSON log record"""
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logging.getLogger('scrapers.metrics') if logger is None else logger
+        self.level  = level
+
+    def observe(self, metric, value, labels):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps({'metric': metric, 'value': value, **labels}))
+
+    def increment(self, name, amount, labels):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps({'counter': name, 'amount': amount, **labels}))
+
+
+class PrometheusSink():
+    """Aggregates the metrics as Prometheus histograms and counters;
+    render() returns them in the text exposition format (e.g. for a
+    /metrics endpoint or the node exporter textfile collector)"""
+    SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    BYTES_BUCKETS   = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+    COUNT_BUCKETS   = (0, 1, 2, 4, 8, 16, 32, 64)
+
+    def __init__(self, prefix='dict_scraper_'):
+        self.prefix     = prefix
+        self.histograms = {}
+        self.counters   = {}
+        self._lock      = threading.Lock()
+
+    def buckets(self, metric) -> tuple:
+        if metric.endswith('_seconds'):
+            return self.SECONDS_BUCKETS
+        if metric.endswith('_bytes'):
+            return self.BYTES_BUCKETS
+        return self.COUNT_BUCKETS
+
+    def observe(self, metric, value, labels):
+        key = (metric, _labels_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets(metric)), 0, 0.0]
+            for index, bound in enumerate(self.buckets(metric)):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    def increment(self, name, amount, labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self) -> str:
+        def format_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+        list_lines = []
+        with self._lock:
+            list_metrics = sorted({metric for metric, _ in self.histograms})
+            for metric in list_metrics:
+                name = self.prefix + metric
+                list_lines.append(f'# TYPE {name} histogram')
+                for (other, labels), (counts, count, total) in sorted(self.histograms.items()):
+                    if other != metric:
+                        continue
+                    for bound, bucket_count in zip(self.buckets(metric), counts):
+                        list_lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {bucket_count}")
+                    list_lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+                    list_lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                    list_lines.append(f'{name}_count{format_labels(labels)} {count}')
+            for (counter, labels), amount in sorted(self.counters.items()):
+                name = f'{self.prefix}{counter}_total'
+                list_lines.append(f'# TYPE {name} counter')
+                list_lines.append(f'{name}{format_labels(labels)} {amount}')
+        return '\n'.join(list_lines) + '\n'
+
+    def write(self, path):
+        """Writes render() to path atomically"""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+
+class TeeSink():
+    """Sends the metrics to several sinks"""
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def observe(self, metric, value, labels):
+        for sink in self.sinks:
+            sink.observe(metric, value, labels)
+
+    def increment(self, name, amount, labels):
+        for sink in self.sinks:
+            sink.increment(name, amount, labels)
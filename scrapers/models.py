@@ -1,4 +1,4 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 
 
 @dataclass(slots=True, frozen=True, kw_only=True)
@@ -57,6 +57,55 @@ class DictEntry():
     source:    str                  = field(default_factory=str)
 
 
+class LazyDictEntry():
+    """A DictEntry whose fields are parsed from the page on first access.
+
+    Built with one function per DictEntry field; each one is called at
+    most once. first_defns(count) parses only the first definitions
+    (keeping the longest list parsed for the next calls), and
+    materialize() returns the equivalent DictEntry.
+    """
+    __slots__ = ('_loaders', '_values', '_first_defns', '_first_count')
+
+    def __init__(self, **loaders):
+        self._loaders     = loaders
+        self._values      = {}
+        self._first_defns = []
+        self._first_count = 0
+
+    def __getattr__(self, name):
+        if name not in DICT_ENTRY_FIELDS:
+            raise AttributeError(name)
+        if name not in self._values:
+            self._values[name] = self._loaders[name]()
+        return self._values[name]
+
+    def first_defns(self, count) -> list[WordDefinition]:
+        if 'defns' in self._values:
+            return self._values['defns'][:count]
+        if count > self._first_count:
+            self._first_defns = self._loaders['defns'](count)
+            self._first_count = count
+        return self._first_defns[:count]
+
+    def materialize(self) -> DictEntry:
+        return DictEntry(**{name: getattr(self, name) for name in DICT_ENTRY_FIELDS})
+
+    def __eq__(self, other):
+        if isinstance(other, LazyDictEntry):
+            other = other.materialize()
+        return self.materialize() == other
+
+    # unhashable, like DictEntry with its list fields
+    __hash__ = None
+
+    def __repr__(self):
+        return f'LazyDictEntry(parsed={list(self._values)})'
+
+
+DICT_ENTRY_FIELDS = tuple(field_.name for field_ in fields(DictEntry))
+
+
 @dataclass(slots=True, frozen=True, kw_only=True)
 class ErrorList:
     """
@@ -0,0 +1,265 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from registry import get_source
+from singleflight import canonical_url
+from transport import make_response, default_transport
+
+
+class PageParseError(Exception):
+    """A page failed to parse in a parser process. Holds the repr of
+    the original exception, which may not be picklable (lxml errors
+    are not)"""
+
+
+def parse_page(url, content, headers=None, dial=None, engine='bs4', main_page=True, source='macmillan'):
+    """
+    Parses a downloaded page of a registered dictionary source, without
+    any network access. Runs in the parser processes, so it only takes
+    and returns picklable values (the source is given by its registry
+    name), and raises its errors as PageParseError.
+
+    Returns (result, related_slugs): for a main (search) page, result
+    is an ErrorList or a list with the main DictEntry and related_slugs
+    are the related entries still to fetch (sources without related
+    entries give the whole result of the page and no slugs); for a
+    related page, result is the list returned by extract() and
+    related_slugs is empty.
+    """
+    try:
+        scraper = get_source(source)(slug='_', dial=dial)
+        has_related = hasattr(scraper, 'related_slugs')
+        if has_related:
+            # the pipeline fetches the related entries itself
+            scraper.recursive = False
+            scraper.engine = engine if engine in scraper.engines else scraper.engine
+        scraper.feed(make_response(url, content, headers=headers))
+        if not main_page:
+            return scraper.extract(), []
+        if scraper.is_error_page():
+            return scraper.parse_error_page(), []
+        if not has_related:
+            return scraper.parse_word_page(), []
+        sanitized_main_entry = scraper.scrape_word_page()
+        return [sanitized_main_entry], scraper.related_slugs(sanitized_main_entry.word)
+    except Exception as exception:
+        raise PageParseError(f'{url}: {exception!r}') from None
+
+
+class _Lookup():
+    """The state of one word going through the pipeline"""
+    def __init__(self, index, word):
+        self.index     = index
+        self.word      = word
+        self.result    = None
+        self.related   = []
+        self.remaining = 0
+
+    def set_related(self, slot, result) -> bool:
+        """Fills a related entry, returns whether the lookup is complete"""
+        self.related[slot] = result
+        self.remaining -= 1
+        return self.remaining == 0 and not self.failed
+
+    def fail(self, exception) -> bool:
+        """
+        Makes exception the result of the lookup, returns whether the
+        lookup is complete (it is not when it had already failed)
+        """
+        if self.failed:
+            return False
+        self.result = exception
+        return True
+
+    @property
+    def failed(self) -> bool:
+        return isinstance(self.result, Exception)
+
+    def finish(self):
+        if self.related and not self.failed:
+            for related_entries in self.related:
+                self.result.extend(related_entries)
+        return self.result
+
+
+class ParsePipeline():
+    """Looks up words with a two-stage pipeline: I/O threads fetch the
+    pages (search pages, then related entries) through the scraper fetch
+    path, and a pool of parser processes turns them into DictEntry lists.
+
+    The fetch stage stops when `max_fetched` pages are waiting for a
+    parser, so a slow parse stage holds the downloads back.
+
+    A related entry wanted by several words in flight is fetched and
+    parsed once (keyed by its canonical url); with memo=True, it is
+    also remembered for the rest of the run.
+
+    Attributes:
+        source          registry name of the dictionary source
+        scraper_class   the scraper of the source, used to fetch the pages
+        fetch_workers   number of fetching threads
+        parse_workers   number of parser processes (default: one per core)
+        max_fetched     pages downloaded but not yet parsed, at most
+        max_words       words in the pipeline at the same time, at most
+        executed        related entries fetched and parsed
+        shared          related entries taken from one already in flight
+        hits            related entries taken from the memo
+    """
+    def __init__(self, fetch_workers=8, parse_workers=None, max_fetched=None,
+            max_words=None, dial=None, engine='bs4', recursive=True,
+            transport=None, cache=None, memo=False, source='macmillan'):
+        self.source        = source
+        self.scraper_class = get_source(source)
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.max_fetched   = max_fetched or 2 * self.parse_workers
+        self.max_words     = max_words or 4 * (self.fetch_workers + self.parse_workers)
+        self.dial          = dial
+        self.engine        = engine
+        self.recursive     = recursive
+        self.transport     = default_transport() if transport is None else transport
+        self.cache         = cache
+        self.memo          = memo
+        self.executed      = 0
+        self.shared        = 0
+        self.hits          = 0
+
+    def scraper(self, word=None, slug=None):
+        # only fetches: the parse options go to parse_page
+        return self.scraper_class(
+            word, slug=slug, dial=self.dial, transport=self.transport, cache=self.cache
+        )
+
+    def fetch(self, scraper):
+        scraper.load()
+        response = scraper.raw()
+        # an HTTP error fails the fetch, its body is not parsed
+        response.raise_for_status()
+        return response.url, response.content, dict(response.headers)
+
+    def stats(self) -> dict:
+        return {
+            'executed': self.executed,
+            'shared': self.shared,
+            'hits': self.hits,
+            'saved': self.shared + self.hits,
+        }
+
+    def run(self, words):
+        """
+        Yields (word, result) tuples as the lookups complete, where
+        result is a list of DictEntry objects, an ErrorList or the
+        exception raised fetching or parsing the word or one of its
+        related entries: a failed word does not stop the run
+        """
+        iter_words = enumerate(words)
+        words_exhausted = False
+        num_words = 0
+
+        # (job, scraper): job is a _Lookup for a main page, or the
+        # canonical url of a related entry
+        to_fetch = deque()
+        fetched  = deque()
+        pending  = {}
+
+        # canonical url -> [(lookup, slot)] waiting for a related entry
+        related_waiting = {}
+        related_memo    = {}
+
+        with ThreadPoolExecutor(self.fetch_workers) as fetch_pool, \
+                ProcessPoolExecutor(self.parse_workers) as parse_pool:
+            while True:
+                # start new words when there is room in the pipeline
+                while not words_exhausted and num_words < self.max_words \
+                        and len(to_fetch) < self.fetch_workers:
+                    try:
+                        index, word = next(iter_words)
+                    except StopIteration:
+                        words_exhausted = True
+                        break
+                    num_words += 1
+                    to_fetch.append((_Lookup(index, word), self.scraper(word)))
+
+                # fetch stage, held back while the parsers are behind
+                num_fetching = sum(1 for kind, _ in pending.values() if kind == 'fetch')
+                while to_fetch and len(fetched) < self.max_fetched \
+                        and num_fetching < self.fetch_workers:
+                    job, scraper = to_fetch.popleft()
+                    future = fetch_pool.submit(self.fetch, scraper)
+                    pending[future] = ('fetch', job)
+                    num_fetching += 1
+
+                # parse stage
+                num_parsing = len(pending) - num_fetching
+                while fetched and num_parsing < self.parse_workers * 2:
+                    job, (url, content, headers) = fetched.popleft()
+                    future = parse_pool.submit(
+                        parse_page, url, content, headers=headers, dial=self.dial,
+                        engine=self.engine, main_page=isinstance(job, _Lookup), source=self.source
+                    )
+                    pending[future] = ('parse', job)
+                    num_parsing += 1
+
+                if not pending:
+                    if words_exhausted and not to_fetch and not fetched:
+                        return
+                    continue
+
+                list_finished = []
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, job = pending.pop(future)
+                    exception = future.exception()
+                    if exception is not None:
+                        # the word fails, or every word waiting for the related entry
+                        if isinstance(job, _Lookup):
+                            list_waiting = [(job, None)]
+                        else:
+                            list_waiting = related_waiting.pop(job)
+                        for lookup, _ in list_waiting:
+                            if lookup.fail(exception):
+                                list_finished.append(lookup)
+                        continue
+
+                    if kind == 'fetch':
+                        fetched.append((job, future.result()))
+                        continue
+
+                    result, list_slugs = future.result()
+                    if not isinstance(job, _Lookup):
+                        # a related entry: hand it to every lookup waiting for it
+                        if self.memo:
+                            related_memo[job] = result
+                        for lookup, slot in related_waiting.pop(job):
+                            if lookup.set_related(slot, result):
+                                list_finished.append(lookup)
+                        continue
+
+                    lookup = job
+                    lookup.result = result
+                    if not self.recursive or not list_slugs:
+                        list_finished.append(lookup)
+                        continue
+
+                    lookup.related = [None] * len(list_slugs)
+                    lookup.remaining = len(list_slugs)
+                    for slot, slug in enumerate(list_slugs):
+                        scraper = self.scraper(slug=slug)
+                        key = canonical_url(scraper.full_url())
+                        if key in related_memo:
+                            self.hits += 1
+                            if lookup.set_related(slot, related_memo[key]):
+                                list_finished.append(lookup)
+                        elif key in related_waiting:
+                            self.shared += 1
+                            related_waiting[key].append((lookup, slot))
+                        else:
+                            self.executed += 1
+                            related_waiting[key] = [(lookup, slot)]
+                            # related entries go first, to finish the words in flight
+                            to_fetch.appendleft((key, scraper))
+
+                for lookup in list_finished:
+                    num_words -= 1
+                    yield lookup.word, lookup.finish()
@@ -0,0 +1,331 @@
+"""Refresh the stored entries of a word list, re-parsing only what changed.
+
+    python refresh.py words.txt --validators validators.sqlite --entry-cache entries.sqlite
+    python refresh.py words.txt --validators validators.sqlite --entry-cache entries.sqlite --head
+    python refresh.py words.txt --validators validators.sqlite --entry-cache entries.sqlite --snapshot snapshot/
+
+Every page is fetched with a conditional GET (If-None-Match and
+If-Modified-Since from the validators of the last run). When the main
+page and the related pages of a word are all unchanged, the word is not
+parsed and its stored entry is only marked as fresh again. With
+--snapshot, the entries parsed again are published to a snapshot.py
+directory at the end of the run, as a single delta segment.
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+from macmillian import MacMillianDictScraper
+from models import ErrorList
+from transport import default_transport
+
+
+def content_hash(content) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class ValidatorStore():
+    """Keeps the validators of each page (by full url): ETag,
+    Last-Modified, the hash and size of the content and, for main
+    pages, the slugs of their related entries"""
+    def __init__(self, path):
+        self.path  = path
+        self._lock = threading.Lock()
+        self._db   = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS validators (
+                url           TEXT PRIMARY KEY,
+                etag          TEXT,
+                last_modified TEXT,
+                content_hash  TEXT NOT NULL,
+                size          INTEGER NOT NULL,
+                related       TEXT,
+                checked_at    REAL NOT NULL,
+                changed_at    REAL NOT NULL
+            )
+        ''')
+        self._db.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute('SELECT * FROM validators WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        row = dict(row)
+        row['related'] = None if row['related'] is None else json.loads(row['related'])
+        return row
+
+    def put(self, url, response, hashed, changed=True):
+        now = time.time()
+        with self._lock:
+            self._db.execute('''
+                INSERT INTO validators VALUES (?, ?, ?, ?, ?, NULL, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    content_hash = excluded.content_hash,
+                    size = excluded.size,
+                    checked_at = excluded.checked_at,
+                    changed_at = CASE WHEN ? THEN excluded.changed_at ELSE changed_at END
+            ''', (
+                url,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                hashed,
+                len(response.content),
+                now,
+                now,
+                changed,
+            ))
+            self._db.commit()
+
+    def set_related(self, url, list_slugs):
+        with self._lock:
+            self._db.execute('UPDATE validators SET related = ? WHERE url = ?', (json.dumps(list_slugs), url))
+            self._db.commit()
+
+    def touch(self, url):
+        with self._lock:
+            self._db.execute('UPDATE validators SET checked_at = ? WHERE url = ?', (time.time(), url))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RefreshReport():
+    """What a refresh run did.
+
+    Attributes:
+        pages_checked       pages asked to the server
+        not_modified        pages answered with a 304
+        head_unchanged      pages found unchanged by a HEAD request
+        same_content        pages downloaded again with the same content
+        pages_changed       pages new or changed
+        bytes_downloaded    bytes of the bodies downloaded
+        bytes_saved         bytes of the bodies not downloaded
+        words_skipped       words not parsed, their pages being unchanged
+        words_updated       words parsed again and stored
+        words_failed        words whose refresh raised an exception
+        entries_published   snapshot entries added, changed or removed
+    """
+    def __init__(self):
+        self.pages_checked     = 0
+        self.not_modified      = 0
+        self.head_unchanged    = 0
+        self.same_content      = 0
+        self.pages_changed     = 0
+        self.bytes_downloaded  = 0
+        self.bytes_saved       = 0
+        self.words_skipped     = 0
+        self.words_updated     = 0
+        self.words_failed      = 0
+        self.entries_published = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+    def __str__(self):
+        return '\n'.join(f'{name:<19}{value:>12}' for name, value in vars(self).items())
+
+
+class _PrefetchedTransport():
+    """Serves the bodies already downloaded by the refresh, and fetches
+    the others (pages answered with a 304, new related pages) with the
+    refresher transport, remembering their validators"""
+    def __init__(self, responses, refresher):
+        self.responses = responses
+        self.refresher = refresher
+
+    def get(self, url, timeout=None, headers=None):
+        response = self.responses.pop(url, None)
+        if response is None:
+            response = self.refresher.transport.get(url, timeout=timeout, headers=headers)
+            self.refresher.report.bytes_downloaded += len(response.content)
+            if response.status_code == 200:
+                self.refresher.validators.put(url, response, content_hash(response.content))
+        return response
+
+
+class Refresher():
+    """Refreshes the entries stored in an EntryCache.
+
+    Attributes:
+        validators  a ValidatorStore
+        entry_cache the cache.EntryCache holding the entries
+        use_head    check pages with a HEAD request first, for servers
+                    that send validators but ignore conditional GETs
+        snapshot    a snapshot.SnapshotStore the parsed entries are
+                    published to, keyed word#position
+        report      the RefreshReport of the run
+    """
+    scraper_class = MacMillianDictScraper
+
+    def __init__(self, validators, entry_cache, transport=None, dial=None,
+            engine='bs4', recursive=True, use_head=False, timeout=4, snapshot=None):
+        self.validators  = validators
+        self.entry_cache = entry_cache
+        self.transport   = default_transport() if transport is None else transport
+        self.dial        = dial
+        self.engine      = engine
+        self.recursive   = recursive
+        self.use_head    = use_head
+        self.timeout     = timeout
+        self.snapshot    = snapshot
+        self.report      = RefreshReport()
+        self._published  = {}
+
+    def check(self, url):
+        """
+        Asks the server whether the page at url changed. Returns
+        (changed, response): response is the downloaded page, or None
+        when the server said the page is unchanged
+        """
+        row = self.validators.get(url)
+        self.report.pages_checked += 1
+
+        headers = {}
+        if row is not None:
+            if row['etag']:
+                headers['If-None-Match'] = row['etag']
+            if row['last_modified']:
+                headers['If-Modified-Since'] = row['last_modified']
+
+        if self.use_head and row is not None and headers:
+            response = self.transport.head(url, timeout=self.timeout, headers=headers)
+            same_etag = row['etag'] and response.headers.get('ETag') == row['etag']
+            same_date = row['last_modified'] and response.headers.get('Last-Modified') == row['last_modified']
+            if response.status_code == 304 or (response.status_code == 200 and (same_etag or same_date)):
+                self.report.head_unchanged += 1
+                self.report.bytes_saved += row['size']
+                self.validators.touch(url)
+                return False, None
+
+        response = self.transport.get(url, timeout=self.timeout, headers=headers or None)
+        if row is not None and response.status_code == 304:
+            self.report.not_modified += 1
+            self.report.bytes_saved += row['size']
+            self.validators.touch(url)
+            return False, None
+
+        self.report.bytes_downloaded += len(response.content)
+        if response.status_code != 200:
+            return True, response
+
+        hashed = content_hash(response.content)
+        changed = row is None or row['content_hash'] != hashed
+        self.validators.put(url, response, hashed, changed=changed)
+        if changed:
+            self.report.pages_changed += 1
+        else:
+            self.report.same_content += 1
+        return changed, response
+
+    def refresh_word(self, word) -> bool:
+        """Refreshes the entry of word, returns whether it was parsed again"""
+        scraper = self.scraper_class(word, dial=self.dial, recursive=self.recursive, engine=self.engine)
+        main_url = scraper.full_url()
+        changed, response = self.check(main_url)
+        dict_responses = {main_url: response} if response is not None else {}
+
+        # the related pages, as found when the word was last parsed
+        list_slugs = None
+        row = self.validators.get(main_url)
+        if row is not None:
+            list_slugs = row['related']
+        if self.recursive and list_slugs:
+            for slug in list_slugs:
+                related_url = scraper.related_scraper(slug).full_url()
+                related_changed, related_response = self.check(related_url)
+                changed = changed or related_changed
+                if related_response is not None:
+                    dict_responses[related_url] = related_response
+
+        entry_key = scraper.entry_key()
+        if not changed and list_slugs is not None and self.entry_cache.touch(entry_key):
+            self.report.words_skipped += 1
+            return False
+
+        scraper = self.scraper_class(
+            word, dial=self.dial, recursive=self.recursive, engine=self.engine,
+            transport=_PrefetchedTransport(dict_responses, self)
+        )
+        sanitized_data = scraper.extract()
+        list_slugs = []
+        if not isinstance(sanitized_data, ErrorList) and self.recursive:
+            list_slugs = scraper.related_slugs(sanitized_data[0].word)
+        self.validators.set_related(main_url, list_slugs)
+        self.entry_cache.put(entry_key, sanitized_data)
+        if self.snapshot is not None:
+            self._published[word] = [] if isinstance(sanitized_data, ErrorList) else sanitized_data
+        self.report.words_updated += 1
+        return True
+
+    def refresh(self, words):
+        """Yields (word, status), status being 'skipped', 'updated' or 'failed'"""
+        for word in words:
+            try:
+                parsed = self.refresh_word(word)
+            except Exception:
+                self.report.words_failed += 1
+                yield word, 'failed'
+                continue
+            yield word, 'updated' if parsed else 'skipped'
+        if self.snapshot is not None:
+            self.publish()
+
+    def publish(self):
+        """
+        Publishes the entries parsed again to the snapshot: the words
+        skipped are not even read, so the cost follows what changed
+        """
+        dict_upserts = {}
+        list_removals = []
+        with self.snapshot.open() as snapshot:
+            for word, list_entries in self._published.items():
+                for position, dict_entry in enumerate(list_entries):
+                    dict_upserts[f'{word}#{position}'] = dict_entry
+                # entries the word no longer has
+                position = len(list_entries)
+                while f'{word}#{position}' in snapshot:
+                    list_removals.append(f'{word}#{position}')
+                    position += 1
+        self._published = {}
+        dict_stats = self.snapshot.apply(dict_upserts, list_removals)
+        self.report.entries_published += dict_stats['added'] + dict_stats['changed'] + dict_stats['removed']
+
+
+def main():
+    from cache import EntryCache
+    from export import read_words
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('words', help="word list, one word per line ('-' for stdin)")
+    parser.add_argument('--validators', required=True, help='SQLite file of the page validators')
+    parser.add_argument('--entry-cache', required=True, help='SQLite file of the EntryCache to refresh')
+    parser.add_argument('--dial', default=None, choices=('american', 'british'))
+    parser.add_argument('--head', action='store_true', help='check pages with HEAD requests first')
+    parser.add_argument('--snapshot', help='snapshot.py directory to publish the parsed entries to')
+    args = parser.parse_args()
+
+    snapshot = None
+    if args.snapshot:
+        from snapshot import SnapshotStore
+        snapshot = SnapshotStore(args.snapshot, background=False)
+    refresher = Refresher(
+        ValidatorStore(args.validators), EntryCache(args.entry_cache),
+        dial=args.dial, use_head=args.head, snapshot=snapshot
+    )
+    for word, status in refresher.refresh(read_words(args.words)):
+        print(f'{status}\t{word}')
+    print(refresher.report, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
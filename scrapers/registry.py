@@ -0,0 +1,175 @@
+import importlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from models import ErrorList
+
+
+# source name -> DictScraper subclass
+REGISTRY = {}
+
+# modules of the adapters shipped with the scrapers, imported on first use
+BUILTIN_ADAPTERS = ('macmillian', 'freedictionary')
+
+
+def register(scraper_class):
+    """Class decorator adding a DictScraper subclass to the registry"""
+    if not scraper_class.name:
+        raise ValueError(f'{scraper_class.__name__} has no source name')
+    if getattr(scraper_class, '__abstractmethods__', None):
+        missing = ', '.join(sorted(scraper_class.__abstractmethods__))
+        raise TypeError(f'{scraper_class.__name__} does not implement {missing}')
+    REGISTRY[scraper_class.name] = scraper_class
+    return scraper_class
+
+
+_builtins_loaded = False
+_builtins_lock   = threading.Lock()
+
+
+def _load_builtins():
+    global _builtins_loaded
+    with _builtins_lock:
+        if not _builtins_loaded:
+            for module_name in BUILTIN_ADAPTERS:
+                importlib.import_module(module_name)
+            _builtins_loaded = True
+
+
+def sources() -> list[str]:
+    """Names of the registered sources, in registration order"""
+    _load_builtins()
+    return list(REGISTRY)
+
+
+def get_source(name):
+    _load_builtins()
+    try:
+        return REGISTRY[name]
+    except KeyError:
+        raise KeyError(f'unknown dictionary source: {name}') from None
+
+
+class SourceTimeout(TimeoutError):
+    """A source did not answer within its timeout"""
+
+
+class FanOut():
+    """Looks a word up in several dictionaries at the same time.
+
+    Every source runs in its own worker thread with its own timeout
+    (the HTTP timeout of its scraper, and the time the caller waits for
+    it), so a slow dictionary does not hold the others back.
+
+    Attributes:
+        names       the sources to query (default: all registered)
+        timeout     seconds each source is waited for
+        timeouts    per-source timeouts, overriding timeout
+    """
+    def __init__(self, names=None, timeout=5.0, timeouts=None, dial=None,
+            transport=None, cache=None):
+        self.names     = sources() if names is None else [get_source(name).name for name in names]
+        self.timeout   = timeout
+        self.timeouts  = timeouts or {}
+        self.dial      = dial
+        self.transport = transport
+        self.cache     = cache
+        self._pool     = ThreadPoolExecutor(max(4, 2 * len(self.names)), thread_name_prefix='fanout')
+
+    def source_timeout(self, name) -> float:
+        return self.timeouts.get(name, self.timeout)
+
+    def scraper(self, name, word):
+        scraper = get_source(name)(word, dial=self.dial, transport=self.transport, cache=self.cache)
+        scraper.timeout = self.source_timeout(name)
+        return scraper
+
+    def _submit(self, word, names):
+        start = time.monotonic()
+        return {
+            self._pool.submit(self.scraper(name, word).extract): (name, start + self.source_timeout(name))
+            for name in names
+        }
+
+    def all(self, word) -> dict:
+        """
+        Returns {source: result}, result being a list of DictEntry, an
+        ErrorList or the exception raised (SourceTimeout when the source
+        did not answer in time)
+        """
+        pending = self._submit(word, self.names)
+        dict_results = {}
+        while pending:
+            now = time.monotonic()
+            for future, (name, deadline) in list(pending.items()):
+                if not future.done() and now >= deadline:
+                    del pending[future]
+                    dict_results[name] = SourceTimeout(f'{name} did not answer in {self.source_timeout(name)}s')
+            if not pending:
+                break
+            next_deadline = min(deadline for _, deadline in pending.values())
+            done, _ = wait(pending, timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, _ = pending.pop(future)
+                exception = future.exception()
+                dict_results[name] = exception if exception is not None else future.result()
+        return {name: dict_results[name] for name in self.names}
+
+    def first(self, word):
+        """
+        Returns (source, entries) of the first source that found the
+        word, or (None, ErrorList) with the suggestions of all the
+        sources when none did
+        """
+        pending = self._submit(word, self.names)
+        list_errors = []
+        while pending:
+            now = time.monotonic()
+            for future, (name, deadline) in list(pending.items()):
+                if not future.done() and now >= deadline:
+                    del pending[future]
+            if not pending:
+                break
+            next_deadline = min(deadline for _, deadline in pending.values())
+            done, _ = wait(pending, timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, _ = pending.pop(future)
+                if future.exception() is not None:
+                    continue
+                result = future.result()
+                if isinstance(result, ErrorList):
+                    list_errors.append(result)
+                    continue
+                for other in pending:
+                    other.cancel()
+                return name, result
+        return None, merge_errors(list_errors)
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def merge_entries(dict_results) -> list:
+    """The entries found by all the sources, in the order of the sources"""
+    list_entries = []
+    for result in dict_results.values():
+        if isinstance(result, list):
+            list_entries.extend(result)
+    return list_entries
+
+
+def merge_errors(list_errors) -> ErrorList:
+    """One ErrorList with the messages and suggestions of several"""
+    list_texts = []
+    list_words = []
+    for error in list_errors:
+        list_texts.extend(text for text in error.texts if text not in list_texts)
+        list_words.extend(word for word in error.wordlist if word not in list_words)
+    return ErrorList(texts=list_texts, wordlist=list_words)
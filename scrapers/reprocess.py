@@ -0,0 +1,312 @@
+"""Parse an archive of saved pages again, without any network access.
+
+    python reprocess.py pages/ -o entries.jsonl --state reprocess.sqlite
+    python reprocess.py crawl.warc.gz -o entries.jsonl --state reprocess.sqlite
+    python reprocess.py pages.tar.gz -o - --workers 8 --engine lxml
+
+The archive is a directory of .html files, a tar file of them, or a
+WARC file (the 200 responses are used). Pages are parsed by a pool of
+processes; with --state, a page is only parsed again when its content
+or MacMillianDictScraper.parser_version changed since the last run.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tarfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import serialize
+from macmillian import MacMillianDictScraper
+from models import ErrorList
+from pipeline import parse_page
+
+
+PAGE_EXTENSIONS = ('.html', '.htm')
+
+
+def page_url(name) -> str:
+    """The url a saved page was fetched from, guessed from its file name"""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if stem.startswith('search-'):
+        return MacMillianDictScraper.search_url.format(dial='american', word=stem[len('search-'):])
+    return MacMillianDictScraper.slug_url.format(dial='american', slug=stem)
+
+
+def iter_directory(path):
+    for root, list_dirs, list_files in os.walk(path):
+        list_dirs.sort()
+        for file_name in sorted(list_files):
+            if file_name.endswith(PAGE_EXTENSIONS):
+                full_path = os.path.join(root, file_name)
+                with open(full_path, 'rb') as file:
+                    content = file.read()
+                name = os.path.relpath(full_path, path)
+                yield name, page_url(name), content, {}
+
+
+def iter_tar(path):
+    with tarfile.open(path, 'r:*') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith(PAGE_EXTENSIONS):
+                content = tar.extractfile(member).read()
+                yield member.name, page_url(member.name), content, {}
+
+
+def _split_http(block):
+    """Returns (status code, headers, body) of a raw HTTP response"""
+    head, _, body = block.partition(b'\r\n\r\n')
+    list_lines = head.decode('iso-8859-1').split('\r\n')
+    status_code = int(list_lines[0].split()[1])
+    headers = {}
+    for line in list_lines[1:]:
+        key, _, value = line.partition(':')
+        headers[key.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        list_chunks = []
+        while body:
+            size_line, _, body = body.partition(b'\r\n')
+            size = int(size_line.split(b';')[0], 16)
+            if size == 0:
+                break
+            list_chunks.append(body[:size])
+            body = body[size + 2:]
+        body = b''.join(list_chunks)
+        del headers['transfer-encoding']
+    encoding = headers.get('content-encoding', '').lower()
+    if encoding in ('gzip', 'deflate'):
+        body = zlib.decompress(body, 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+        del headers['content-encoding']
+    return status_code, headers, body
+
+
+def iter_warc(path):
+    """Yields the 200 responses of a WARC file (plain or gzipped)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as file:
+        while True:
+            line = file.readline()
+            if not line:
+                return
+            if not line.strip():
+                continue
+            if not line.startswith(b'WARC/'):
+                raise ValueError(f'{path}: not a WARC record at offset {file.tell()}')
+
+            warc_headers = {}
+            for line in iter(file.readline, b''):
+                if not line.strip():
+                    break
+                key, _, value = line.decode('utf-8').partition(':')
+                warc_headers[key.strip().lower()] = value.strip()
+            block = file.read(int(warc_headers['content-length']))
+
+            if warc_headers.get('warc-type') != 'response' or not block.startswith(b'HTTP/'):
+                continue
+            status_code, headers, body = _split_http(block)
+            if status_code == 200:
+                url = warc_headers.get('warc-target-uri', '').strip('<>')
+                yield url, url, body, headers
+
+
+def iter_pages(source):
+    """Yields (name, url, content, headers) of every page of an archive"""
+    if os.path.isdir(source):
+        return iter_directory(source)
+    if source.endswith(('.warc', '.warc.gz')):
+        return iter_warc(source)
+    if tarfile.is_tarfile(source):
+        return iter_tar(source)
+    raise ValueError(f'{source}: not a directory, tar or WARC archive')
+
+
+class ReprocessState():
+    """Remembers the content hash and parser version each page was
+    last parsed with, in a SQLite file"""
+    def __init__(self, path):
+        self.path = path
+        self._db  = sqlite3.connect(path)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            ' name TEXT PRIMARY KEY,'
+            ' content_hash TEXT NOT NULL,'
+            ' parser_version INTEGER NOT NULL,'
+            ' parsed_at REAL NOT NULL)'
+        )
+        self._db.commit()
+
+    def is_current(self, name, content_hash, parser_version) -> bool:
+        row = self._db.execute(
+            'SELECT content_hash, parser_version FROM pages WHERE name = ?', (name,)
+        ).fetchone()
+        return row is not None and row[0] == content_hash and row[1] == parser_version
+
+    def mark(self, name, content_hash, parser_version):
+        self._db.execute(
+            'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+            (name, content_hash, parser_version, time.time())
+        )
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+def content_hash(content) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def parse_batch(list_pages, dial=None, engine='lxml'):
+    """
+    Parses a batch of pages in a worker process. Returns (name, result)
+    tuples, result being the list of entries, an ErrorList, or the
+    repr of the exception raised by the parser
+    """
+    list_results = []
+    for name, url, content, headers in list_pages:
+        try:
+            result, _ = parse_page(url, content, headers=headers, dial=dial, engine=engine, main_page=False)
+        except Exception as exception:
+            result = repr(exception)
+        list_results.append((name, result))
+    return list_results
+
+
+class Reprocessor():
+    """Parses the pages of an archive with a pool of processes.
+
+    Attributes:
+        workers     number of parser processes (default: one per core)
+        batch_size  pages sent to a process at once
+        engine      parsing engine, see MacMillianDictScraper.engines
+        state       a ReprocessState, to skip the pages already parsed
+        parsed      pages parsed
+        skipped     pages unchanged since the last run
+        failed      pages the parser raised an exception on
+    """
+    def __init__(self, workers=None, batch_size=16, engine='lxml', dial=None, state=None):
+        self.workers    = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.engine     = engine
+        self.dial       = dial
+        self.state      = state
+        self.parsed     = 0
+        self.skipped    = 0
+        self.failed     = 0
+
+    def run(self, pages, before_commit=None):
+        """
+        Yields (name, url, result) for every changed page of pages, an
+        iterable of (name, url, content, headers), as they are parsed.
+        before_commit is called before the state is saved, e.g. to
+        flush the records already written.
+        """
+        parser_version = MacMillianDictScraper.parser_version
+        max_pending = 4 * self.workers
+        pending = {}
+
+        def changed_batches():
+            list_batch = []
+            for name, url, content, headers in pages:
+                hashed = content_hash(content)
+                if self.state is not None and self.state.is_current(name, hashed, parser_version):
+                    self.skipped += 1
+                    continue
+                list_batch.append((name, url, content, headers, hashed))
+                if len(list_batch) == self.batch_size:
+                    yield list_batch
+                    list_batch = []
+            if list_batch:
+                yield list_batch
+
+        iter_batches = changed_batches()
+        exhausted = False
+        with ProcessPoolExecutor(self.workers) as pool:
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    list_batch = next(iter_batches, None)
+                    if list_batch is None:
+                        exhausted = True
+                        break
+                    future = pool.submit(
+                        parse_batch, [page[:4] for page in list_batch],
+                        dial=self.dial, engine=self.engine
+                    )
+                    pending[future] = {page[0]: (page[1], page[4]) for page in list_batch}
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dict_pages = pending.pop(future)
+                    for name, result in future.result():
+                        url, hashed = dict_pages[name]
+                        if isinstance(result, str):
+                            self.failed += 1
+                        else:
+                            self.parsed += 1
+                        yield name, url, result
+                        # failed pages are tried again on the next run
+                        if self.state is not None and not isinstance(result, str):
+                            self.state.mark(name, hashed, parser_version)
+                if self.state is not None:
+                    if before_commit is not None:
+                        before_commit()
+                    self.state.commit()
+
+
+def make_record(name, url, result) -> dict:
+    if isinstance(result, str):
+        return {'page': name, 'url': url, 'status': 'failed', 'reason': result}
+    if isinstance(result, ErrorList):
+        return {'page': name, 'url': url, 'status': 'not_found', 'error': serialize.to_dict(result)}
+    return {
+        'page': name,
+        'url': url,
+        'status': 'found',
+        'entries': [serialize.to_dict(entry) for entry in result],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('archive', help='directory, tar or WARC file of saved pages')
+    parser.add_argument('-o', '--output', default='-', help="JSONL output ('-' for stdout)")
+    parser.add_argument('--state', help='SQLite file remembering the pages already parsed')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--engine', default='lxml', choices=MacMillianDictScraper.engines)
+    args = parser.parse_args()
+
+    state = ReprocessState(args.state) if args.state else None
+    reprocessor = Reprocessor(workers=args.workers, batch_size=args.batch_size, engine=args.engine, state=state)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    start = time.perf_counter()
+    try:
+        for name, url, result in reprocessor.run(iter_pages(args.archive), before_commit=output.flush):
+            output.write(json.dumps(make_record(name, url, result), ensure_ascii=False) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if state is not None:
+            state.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f'{reprocessor.parsed} parsed, {reprocessor.skipped} unchanged, {reprocessor.failed} failed'
+        f' in {elapsed:.1f}s ({reprocessor.parsed / elapsed if elapsed else 0:.0f} pages/s)',
+        file=sys.stderr
+    )
+
+
+if __name__ == '__main__':
+    main()
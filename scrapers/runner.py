@@ -0,0 +1,363 @@
+"""Look up a long word list without letting one failure stop the run.
+
+    python runner.py words.txt -o dictionary.jsonl --dead-letters dead.jsonl --checkpoint run.json
+    python runner.py dead.jsonl --retry -o retried.jsonl --dead-letters dead-2.jsonl
+
+Every word is looked up on its own: timeouts and server errors are
+tried again, the senses and related entries that cannot be parsed are
+left out of the record (salvaged), and the words that failed or were
+only partly parsed are written to the dead-letter file, to be run
+again with --retry. A circuit breaker pauses the fetches to the site
+while its error rate is too high.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+import requests
+
+from export import Checkpoint, JsonlWriter, make_record, read_words
+from macmillian import MacMillianDictScraper
+from scheduler import DeadlineExceeded, THROTTLE_STATUSES
+from transport import Transport
+
+
+# circuit breaker states
+CLOSED    = 'closed'
+OPEN      = 'open'
+HALF_OPEN = 'half-open'
+
+
+class ServerError(requests.HTTPError):
+    """The site answered with a 5xx or 429 status"""
+
+
+# errors worth trying the lookup again for
+TRANSIENT_ERRORS = (requests.Timeout, requests.ConnectionError, ServerError, DeadlineExceeded)
+
+
+def is_transient(exception) -> bool:
+    """Whether a lookup that raised exception is worth trying again:
+    a TRANSIENT_ERRORS one, or an HTTP error with a 5xx or 429 status
+    (as raised with a plain Transport)"""
+    if isinstance(exception, requests.HTTPError) and exception.response is not None:
+        status_code = exception.response.status_code
+        return status_code >= 500 or status_code in THROTTLE_STATUSES
+    return isinstance(exception, TRANSIENT_ERRORS)
+
+
+class CircuitBreaker():
+    """Pauses the requests to a site whose error rate spikes.
+
+        closed      requests go through; the outcomes of the last
+                    `window` ones are kept, and once at least
+                    `min_requests` of them have an error rate of
+                    `threshold` or more, the breaker opens
+        open        requests wait for `cooldown` seconds
+        half-open   one request is let through as a probe: its success
+                    closes the breaker, its failure opens it again for
+                    twice the cooldown (up to `max_cooldown`)
+
+    Attributes:
+        state           CLOSED, OPEN or HALF_OPEN
+        trips           times the breaker opened
+        paused_seconds  seconds requests spent waiting for the breaker
+    """
+    def __init__(self, window=50, threshold=0.5, min_requests=10, cooldown=10.0, max_cooldown=300.0):
+        self.window         = window
+        self.threshold      = threshold
+        self.min_requests   = min_requests
+        self.base_cooldown  = cooldown
+        self.max_cooldown   = max_cooldown
+        self.state          = CLOSED
+        self.trips          = 0
+        self.paused_seconds = 0.0
+        self._cooldown      = cooldown
+        self._open_until    = 0.0
+        self._probing       = False
+        self._outcomes      = deque(maxlen=window)
+        self._condition     = threading.Condition()
+
+    def before(self):
+        """Blocks until a request may be made"""
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self.state == OPEN and now >= self._open_until:
+                    self.state = HALF_OPEN
+                    self._probing = False
+                if self.state == CLOSED:
+                    break
+                if self.state == HALF_OPEN and not self._probing:
+                    self._probing = True
+                    break
+                self._condition.wait(self._open_until - now if self.state == OPEN else None)
+            self.paused_seconds += time.monotonic() - start
+
+    def record(self, ok):
+        """Records the outcome of a request"""
+        with self._condition:
+            if self.state == HALF_OPEN:
+                # the outcome of the probe
+                if ok:
+                    self.state = CLOSED
+                    self._cooldown = self.base_cooldown
+                    self._outcomes.clear()
+                else:
+                    self._cooldown = min(self.max_cooldown, self._cooldown * 2)
+                    self._trip()
+            elif self.state == CLOSED:
+                self._outcomes.append(ok)
+                failures = self._outcomes.count(False)
+                if len(self._outcomes) >= self.min_requests and failures / len(self._outcomes) >= self.threshold:
+                    self._trip()
+            self._condition.notify_all()
+
+    def _trip(self):
+        self.state = OPEN
+        self.trips += 1
+        self._open_until = time.monotonic() + self._cooldown
+        self._probing = False
+        self._outcomes.clear()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'state': self.state, 'trips': self.trips, 'paused_seconds': self.paused_seconds}
+
+
+class BreakerTransport():
+    """A transport whose requests go through a CircuitBreaker per host.
+
+    Responses with a 5xx or 429 status count as failures and raise
+    ServerError, so that a lookup fails instead of parsing an error
+    page. The inner transport should not retry them itself: by default
+    it is a Transport with retries=0.
+    """
+    def __init__(self, transport=None, **breaker_options):
+        self.transport       = Transport(retries=0) if transport is None else transport
+        self.breaker_options = breaker_options
+        self._breakers       = {}
+        self._lock           = threading.Lock()
+
+    def breaker(self, url) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(**self.breaker_options)
+            return breaker
+
+    def get(self, url, timeout=None, headers=None):
+        return self.request('GET', url, timeout=timeout, headers=headers)
+
+    def head(self, url, timeout=None, headers=None):
+        return self.request('HEAD', url, timeout=timeout, headers=headers)
+
+    def request(self, method, url, timeout=None, headers=None):
+        send = self.transport.get if method == 'GET' else self.transport.head
+        breaker = self.breaker(url)
+        breaker.before()
+        try:
+            response = send(url, timeout=timeout, headers=headers)
+        except Exception:
+            breaker.record(False)
+            raise
+        failed = response.status_code >= 500 or response.status_code in THROTTLE_STATUSES
+        breaker.record(not failed)
+        if failed:
+            raise ServerError(f'{response.status_code} for {url}', response=response)
+        return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {host: breaker.stats() for host, breaker in self._breakers.items()}
+
+    def close(self):
+        self.transport.close()
+
+
+class DeadLetters():
+    """A JSONL file of the words that failed or were only partly
+    parsed, with their errors"""
+    def __init__(self, path):
+        self.path  = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def add(self, index, word, status, errors, attempts):
+        record = {
+            'index': index,
+            'word': word,
+            'status': status,
+            'errors': errors,
+            'attempts': attempts,
+            'time': time.time(),
+        }
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_dead_letters(path):
+    """Yields the words of a dead-letter file, once each"""
+    set_seen = set()
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            word = json.loads(line)['word']
+            if word not in set_seen:
+                set_seen.add(word)
+                yield word
+
+
+class BatchRunner():
+    """Looks up words with a pool of threads, isolating the failures.
+
+    Attributes:
+        workers     lookups run at the same time
+        retries     times a lookup is tried again after a transient
+                    error (timeout, connection error, 5xx or 429)
+        backoff     seconds before the first retry, doubled after each
+        counts      lookups per outcome ('found', 'not_found',
+                    'partial', 'failed'), and retries made
+    """
+    scraper_class = MacMillianDictScraper
+
+    def __init__(self, transport=None, dead_letters=None, workers=4, retries=2, backoff=1.0,
+            dial=None, engine='lxml', cache=None, entry_cache=None, timeout=10):
+        self.transport    = BreakerTransport() if transport is None else transport
+        self.dead_letters = dead_letters
+        self.workers      = workers
+        self.retries      = retries
+        self.backoff      = backoff
+        self.dial         = dial
+        self.engine       = engine
+        self.cache        = cache
+        self.entry_cache  = entry_cache
+        self.timeout      = timeout
+        self.counts       = {'found': 0, 'not_found': 0, 'partial': 0, 'failed': 0, 'retries': 0}
+        self._lock        = threading.Lock()
+
+    def lookup(self, word):
+        """Returns the result of word and the errors of the parts of it
+        that were salvaged"""
+        scraper = self.scraper_class(
+            word, dial=self.dial, transport=self.transport, cache=self.cache,
+            entry_cache=self.entry_cache, engine=self.engine, salvage=True
+        )
+        scraper.timeout = self.timeout
+        return scraper.extract(), scraper.salvage_errors
+
+    def run_word(self, index, word) -> dict:
+        """
+        The record of one word. Transient errors are tried again with
+        an exponential backoff; the other failures end up in the record
+        and the dead letters, they are never raised. Records with
+        salvaged parts carry their errors in 'salvage_errors'.
+        """
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                result, list_errors = self.lookup(word)
+                break
+            except Exception as exception:
+                if not is_transient(exception) or attempts > self.retries:
+                    result, list_errors = exception, [repr(exception)]
+                    break
+                with self._lock:
+                    self.counts['retries'] += 1
+                time.sleep(self.backoff * 2 ** (attempts - 1))
+
+        record = make_record(index, word, result)
+        status = record['status']
+        if list_errors and status != 'failed':
+            record['salvage_errors'] = list_errors
+            status = 'partial'
+        if self.dead_letters is not None and status in ('partial', 'failed'):
+            self.dead_letters.add(index, word, status, list_errors, attempts)
+        with self._lock:
+            self.counts[status] += 1
+        return record
+
+    def run(self, words, checkpoint=None):
+        """
+        Yields the record of every word as its lookup completes.
+        Positions already in the checkpoint are skipped.
+        """
+        max_pending = 4 * self.workers
+        iter_words = (
+            (index, word) for index, word in enumerate(words)
+            if checkpoint is None or not checkpoint.is_done(index)
+        )
+        pending = set()
+        exhausted = False
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='runner') as pool:
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    item = next(iter_words, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    pending.add(pool.submit(self.run_word, *item))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    if checkpoint is not None:
+                        checkpoint.mark(record['index'])
+                    yield record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('words', help="word list, one word per line ('-' for stdin), or a dead-letter file with --retry")
+    parser.add_argument('--retry', action='store_true', help='words is a dead-letter file to run again')
+    parser.add_argument('-o', '--output', default='-', help="JSONL output ('-' for stdout)")
+    parser.add_argument('--dead-letters', required=True, help='JSONL file of the words that failed')
+    parser.add_argument('--checkpoint', help='checkpoint file, to resume an interrupted run')
+    parser.add_argument('--checkpoint-every', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--dial', default=None, choices=('american', 'british'))
+    parser.add_argument('--engine', default='lxml', choices=MacMillianDictScraper.engines)
+    args = parser.parse_args()
+
+    words = read_dead_letters(args.words) if args.retry else read_words(args.words)
+    checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+    resuming = checkpoint is not None and (checkpoint.done_through or checkpoint.done)
+    writer = JsonlWriter(args.output, append=bool(resuming))
+    dead_letters = DeadLetters(args.dead_letters)
+    runner = BatchRunner(
+        dead_letters=dead_letters, workers=args.workers, retries=args.retries,
+        dial=args.dial, engine=args.engine, timeout=args.timeout
+    )
+    num_written = 0
+    try:
+        for record in runner.run(words, checkpoint=checkpoint):
+            writer.write(record)
+            num_written += 1
+            if checkpoint is not None and num_written % args.checkpoint_every == 0:
+                writer.flush()
+                checkpoint.save()
+    finally:
+        writer.close()
+        dead_letters.close()
+        if checkpoint is not None:
+            checkpoint.save()
+    print(json.dumps(dict(runner.counts, breakers=runner.transport.stats())), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
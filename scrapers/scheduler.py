@@ -0,0 +1,265 @@
+import heapq
+import itertools
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+from transport import Transport
+
+
+# request priorities, lower goes first
+INTERACTIVE = 0
+BULK        = 10
+
+# statuses telling the host is overloaded
+THROTTLE_STATUSES = (429, 503)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request could not be made (or completed) before its deadline"""
+
+
+def retry_after_seconds(response):
+    """The delay asked by the Retry-After header of response, or None"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Ticket():
+    def __init__(self, priority, deadline, sequence):
+        self.key       = (priority, deadline if deadline is not None else float('inf'), sequence)
+        self.deadline  = deadline
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class _HostState():
+    """The token bucket, the adaptive concurrency limit and the queue of
+    one host"""
+    def __init__(self, scheduler):
+        self.tokens       = float(scheduler.burst)
+        self.updated      = time.monotonic()
+        self.limit        = float(scheduler.initial_concurrency)
+        self.in_flight    = 0
+        self.paused_until = 0.0
+        self.queue        = []
+
+    def refill(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def head(self):
+        while self.queue and self.queue[0].cancelled:
+            heapq.heappop(self.queue)
+        return self.queue[0] if self.queue else None
+
+
+class Scheduler():
+    """Decides when each request to a host may start.
+
+    Per host:
+        token bucket    at most `rate` requests per second, in bursts
+                        of at most `burst`
+        concurrency     requests in flight, adapted AIMD-style: the
+                        limit grows by `increase` per window of healthy
+                        responses and is multiplied by `decrease` on a
+                        429/503 or a connection error; a Retry-After
+                        pauses the host for the asked delay
+        queue           waiting requests ordered by priority, then
+                        deadline (INTERACTIVE goes before BULK)
+
+    Attributes:
+        throttled   responses that made a host back off
+    """
+    def __init__(self, rate=2.0, burst=4, initial_concurrency=2, min_concurrency=1,
+            max_concurrency=16, increase=1.0, decrease=0.5, max_pause=60.0):
+        self.rate                = rate
+        self.burst               = burst
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency     = min_concurrency
+        self.max_concurrency     = max_concurrency
+        self.increase            = increase
+        self.decrease            = decrease
+        self.max_pause           = max_pause
+        self.throttled           = 0
+        self._hosts              = {}
+        self._sequence           = itertools.count()
+        self._condition          = threading.Condition()
+
+    def host_state(self, host) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self)
+        return state
+
+    def acquire(self, url, priority=BULK, deadline=None) -> str:
+        """
+        Blocks until a request to url may start, and returns its host
+        (to give back to release). deadline is a time.monotonic() value;
+        DeadlineExceeded is raised when it passes while waiting.
+        """
+        host = urlsplit(url).netloc
+        with self._condition:
+            state = self.host_state(host)
+            ticket = _Ticket(priority, deadline, next(self._sequence))
+            heapq.heappush(state.queue, ticket)
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    ticket.cancelled = True
+                    self._condition.notify_all()
+                    raise DeadlineExceeded(f'no slot for {url} before its deadline')
+
+                list_waits = []
+                if state.head() is ticket:
+                    state.refill(self.rate, self.burst, now)
+                    if now < state.paused_until:
+                        list_waits.append(state.paused_until - now)
+                    elif state.in_flight >= int(state.limit):
+                        list_waits.append(None)
+                    elif self.rate and state.tokens < 1:
+                        list_waits.append((1 - state.tokens) / self.rate)
+                    else:
+                        heapq.heappop(state.queue)
+                        if self.rate:
+                            state.tokens -= 1
+                        state.in_flight += 1
+                        # the next request in the queue may be able to start too
+                        self._condition.notify_all()
+                        return host
+                else:
+                    list_waits.append(None)
+
+                if deadline is not None:
+                    list_waits.append(deadline - now)
+                list_timeouts = [wait for wait in list_waits if wait is not None]
+                try:
+                    self._condition.wait(min(list_timeouts) if list_timeouts else None)
+                except BaseException:
+                    # e.g. KeyboardInterrupt: the ticket must not hold the queue
+                    ticket.cancelled = True
+                    self._condition.notify_all()
+                    raise
+
+    def release(self, host, response=None, error=None):
+        """
+        Ends a request, adapting the host limits to its outcome: a
+        throttled response or an error (a timeout or a connection error)
+        backs off, a healthy response raises the limit. Without either,
+        the slot is only given back
+        """
+        with self._condition:
+            state = self.host_state(host)
+            state.in_flight -= 1
+            throttled = error is not None or (
+                response is not None and response.status_code in THROTTLE_STATUSES
+            )
+            if throttled:
+                self.throttled += 1
+                state.limit = max(self.min_concurrency, state.limit * self.decrease)
+                delay = None if response is None else retry_after_seconds(response)
+                if delay:
+                    state.paused_until = max(state.paused_until, time.monotonic() + min(delay, self.max_pause))
+            elif response is not None:
+                # one more request per window of healthy responses
+                state.limit = min(self.max_concurrency, state.limit + self.increase / state.limit)
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                host: {
+                    'limit': state.limit,
+                    'in_flight': state.in_flight,
+                    'queued': sum(1 for ticket in state.queue if not ticket.cancelled),
+                    'tokens': state.tokens,
+                }
+                for host, state in self._hosts.items()
+            }
+
+    def transport(self, priority=BULK, deadline=None, transport=None, max_attempts=4):
+        """A ScheduledTransport with the given priority, sharing this scheduler"""
+        return ScheduledTransport(
+            scheduler=self, transport=transport, priority=priority,
+            deadline=deadline, max_attempts=max_attempts
+        )
+
+
+class ScheduledTransport():
+    """A transport whose requests wait for their turn in a Scheduler.
+
+    Throttled requests are tried again (up to `max_attempts` times)
+    through the scheduler instead of by the inner transport, so the
+    inner transport should not retry them itself: by default it is a
+    Transport with retries=0.
+
+    Attributes:
+        priority        INTERACTIVE or BULK (or any other number)
+        deadline        seconds a request may take, waiting included
+        max_attempts    tries of a throttled request
+    """
+    def __init__(self, scheduler=None, transport=None, priority=BULK, deadline=None, max_attempts=4):
+        self.scheduler    = Scheduler() if scheduler is None else scheduler
+        self.transport    = Transport(retries=0) if transport is None else transport
+        self.priority     = priority
+        self.deadline     = deadline
+        self.max_attempts = max_attempts
+
+    def get(self, url, timeout=None, headers=None, priority=None, deadline=None):
+        return self.request('GET', url, timeout=timeout, headers=headers, priority=priority, deadline=deadline)
+
+    def head(self, url, timeout=None, headers=None, priority=None, deadline=None):
+        return self.request('HEAD', url, timeout=timeout, headers=headers, priority=priority, deadline=deadline)
+
+    def request(self, method, url, timeout=None, headers=None, priority=None, deadline=None):
+        send = self.transport.get if method == 'GET' else self.transport.head
+        priority = self.priority if priority is None else priority
+        if deadline is None and self.deadline is not None:
+            deadline = time.monotonic() + self.deadline
+
+        for attempt in range(1, self.max_attempts + 1):
+            host = self.scheduler.acquire(url, priority=priority, deadline=deadline)
+            request_timeout = timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                request_timeout = remaining if timeout is None else min(timeout, remaining)
+                if request_timeout <= 0:
+                    self.scheduler.release(host)
+                    raise DeadlineExceeded(f'no time left for {url}')
+            try:
+                response = send(url, timeout=request_timeout, headers=headers)
+            except requests.Timeout as exception:
+                self.scheduler.release(host, error=exception)
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise DeadlineExceeded(f'{url} did not complete before its deadline') from exception
+                raise
+            except requests.ConnectionError as exception:
+                self.scheduler.release(host, error=exception)
+                raise
+            except BaseException:
+                # not a sign of an overloaded host (e.g. TooManyRedirects,
+                # InvalidURL): give the slot back without backing off
+                self.scheduler.release(host)
+                raise
+            self.scheduler.release(host, response=response)
+
+            if response.status_code not in THROTTLE_STATUSES or attempt == self.max_attempts:
+                return response
+        return response
+
+    def close(self):
+        self.transport.close()
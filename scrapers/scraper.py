@@ -1,36 +1,214 @@
-import requests
-from bs4 import BeautifulSoup as Soup
-import lxml
-import cchardet
+import codecs
+import re
+import threading
+from abc import ABC, abstractmethod
+from time import perf_counter
+
+import metrics
+from transport import default_transport
+
+
+# where to look for a <meta> charset declaration
+SNIFF_SIZE = 4096
+re_meta_charset = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+re_content_charset = re.compile(r'charset\s*=\s*["\']?([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def _known_encoding(name):
+    try:
+        return codecs.lookup(name.decode('ascii') if isinstance(name, bytes) else name).name
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def sniff_encoding(content, content_type=None):
+    """
+    Returns the encoding of an HTML body (bytes): the charset of the
+    Content-Type header, a byte order mark or a <meta> declaration in
+    the first SNIFF_SIZE bytes, and only failing those, the guess of
+    cchardet over the whole body
+    """
+    if content_type:
+        match = re_content_charset.search(content_type)
+        if match and _known_encoding(match.group(1)):
+            return _known_encoding(match.group(1))
+    for bom, encoding in BOMS:
+        if content[:len(bom)] == bom:
+            return encoding
+    match = re_meta_charset.search(memoryview(content)[:SNIFF_SIZE])
+    if match and _known_encoding(match.group(1)):
+        return _known_encoding(match.group(1))
+    import cchardet
+    guessed = cchardet.detect(content).get('encoding')
+    return _known_encoding(guessed) if guessed else 'utf-8'
+
+
+# one parser per encoding and thread: lxml locks a parser while it
+# parses, so a shared one would serialize the parsing threads
+_tree_parsers = threading.local()
+
+
+def _tree_parser(encoding):
+    dict_parsers = getattr(_tree_parsers, 'parsers', None)
+    if dict_parsers is None:
+        dict_parsers = _tree_parsers.parsers = {}
+    parser = dict_parsers.get(encoding)
+    if parser is None:
+        import lxml.html
+        parser = dict_parsers[encoding] = lxml.html.HTMLParser(encoding=encoding)
+    return parser
+
 
 class Scraper():
-    def __init__(self, url: str):
+    def __init__(self, url: str, transport=None, cache=None):
         self.url: str     = url
         self.timeout: int = 4
+        self._transport   = transport
+        self.cache        = cache
         self._source      = None
+        self._tree        = None
+        self._encoding    = None
         self._scraped     = None
         self._sanitazed   = None
+        # set to force the encoding of the pages instead of sniffing it
+        self.charset      = None
+
+    @property
+    def transport(self):
+        # the default transport (and requests) is loaded on first fetch
+        if self._transport is None:
+            self._transport = default_transport()
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
 
     def load(self):
-        self._scraped = requests.Session().get(self.full_url(), headers={
-            "User-Agent" : "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36"
-        }, timeout=self.timeout)
+        start = perf_counter()
+        if self.cache is not None:
+            self._scraped = self.cache.fetch(
+                self.cache_key(), self.full_url(), self.transport, timeout=self.timeout
+            )
+        else:
+            self._scraped = self.transport.get(self.full_url(), timeout=self.timeout)
+
+        if metrics.enabled():
+            elapsed = perf_counter() - start
+            # response.elapsed is the time until the headers arrived
+            seconds_wait = min(self._scraped.elapsed.total_seconds(), elapsed)
+            metrics.observe('stage_seconds', elapsed, stage='load')
+            metrics.observe('fetch_wait_seconds', seconds_wait)
+            metrics.observe('fetch_download_seconds', elapsed - seconds_wait)
+            metrics.observe('response_bytes', len(self._scraped.content))
+            metrics.increment('fetches')
 
     def raw(self):
-        if not self._scraped:
+        if self._scraped is None:
             self.load()
         return self._scraped
 
+    def feed(self, response):
+        """Use an already fetched response instead of loading it."""
+        self._scraped  = response
+        self._source   = None
+        self._tree     = None
+        self._encoding = None
+
+    def encoding(self) -> str:
+        """The encoding of the loaded page, see sniff_encoding"""
+        if self._encoding is None:
+            response = self.raw()
+            self._encoding = self.charset or sniff_encoding(
+                response.content, response.headers.get('Content-Type')
+            )
+        return self._encoding
+
     def html(self):
         if not self._source:
-            self._source = Soup(self.raw().text, 'lxml')
+            from bs4 import BeautifulSoup as Soup
+
+            # the bytes go straight to lxml, decoded by the parser itself
+            content = self.raw().content
+            encoding = self.encoding()
+            with metrics.stage('parse.html'):
+                self._source = Soup(content, 'lxml', from_encoding=encoding)
         return self._source
 
+    def tree(self):
+        if self._tree is None:
+            import lxml.html
+
+            content = self.raw().content
+            parser = _tree_parser(self.encoding())
+            with metrics.stage('parse.tree'):
+                self._tree = lxml.html.document_fromstring(content, parser=parser)
+        return self._tree
+
     def extract(self):
         if not self._sanitazed:
             self._sanitized = self.html()
-        return self._sanitized 
+        return self._sanitized
 
     def full_url(self) -> str:
         return self.url
 
+    def cache_key(self) -> str:
+        return self.full_url()
+
+
+class DictScraper(Scraper, ABC):
+    """Base of the dictionary site adapters (see registry.py).
+
+    An adapter declares its url templates and dialects, and implements
+    is_error_page, parse_word_page (a list of DictEntry) and
+    parse_error_page (an ErrorList): an adapter missing one of them
+    cannot be registered nor instantiated.
+
+    Attributes:
+        name            name of the source in the registry
+        search_url      template of a search, with {dial} and {word}
+        slug_url        template of an entry page, with {dial} and {slug}
+        dial_options    dialects of the site, the first is the default
+    """
+    name         = ''
+    search_url   = ''
+    slug_url     = ''
+    dial_options = ('',)
+
+    def __init__(self, word=None, slug=None, dial=None, transport=None, cache=None):
+        self.dial = self.dial_options[0] if dial not in self.dial_options else dial
+        self.word = '' if word is None else word
+        self.slug = '' if slug is None else slug
+        if self.slug:
+            final_url = self.slug_url.format(dial=self.dial, slug=self.slug)
+        else:
+            final_url = self.search_url.format(dial=self.dial, word=self.word)
+        super().__init__(final_url, transport=transport, cache=cache)
+
+    def cache_key(self) -> str:
+        return f'{self.full_url()} {self.dial}'
+
+    @abstractmethod
+    def is_error_page(self) -> bool:
+        """Whether the loaded page tells the word was not found"""
+
+    @abstractmethod
+    def parse_word_page(self):
+        """The list of DictEntry of the loaded page"""
+
+    @abstractmethod
+    def parse_error_page(self):
+        """The ErrorList of the loaded page"""
+
+    def extract(self):
+        self.raw()
+        if self.is_error_page():
+            return self.parse_error_page()
+        return self.parse_word_page()
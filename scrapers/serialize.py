@@ -0,0 +1,146 @@
+import hashlib
+import json
+import zlib
+from dataclasses import asdict, fields, is_dataclass
+
+from models import (
+    ExampleGroup,
+    WordDefinition,
+    DictEntry,
+    Phonetics,
+    Keywords,
+    ErrorList
+)
+
+
+# bump when the layout produced by to_plain (or encode) changes
+FORMAT_VERSION = 2
+
+MODELS = {model.__name__: model for model in (
+    ExampleGroup,
+    WordDefinition,
+    DictEntry,
+    Phonetics,
+    Keywords,
+    ErrorList,
+)}
+
+# field names of each model, dataclasses.fields is slow to call per object
+MODEL_FIELDS = {
+    model: tuple(model_field.name for model_field in fields(model))
+    for model in MODELS.values()
+}
+
+
+def to_plain(obj):
+    """
+    Converts a model tree (or a list of them) to nested tuples and lists.
+    Each model becomes a tuple of its class name and its field values
+    in declaration order, e.g. ('Phonetics', '/rʌn/', 'US', '')
+    """
+    if type(obj) is str:
+        return obj
+    if isinstance(obj, list):
+        return [to_plain(item) for item in obj]
+    names = MODEL_FIELDS.get(type(obj))
+    if names is None:
+        if not is_dataclass(obj):
+            return obj
+        names = tuple(model_field.name for model_field in fields(obj))
+    return (type(obj).__name__, *[to_plain(getattr(obj, name)) for name in names])
+
+
+def from_plain(data):
+    """Inverse of to_plain"""
+    if isinstance(data, tuple):
+        model = MODELS[data[0]]
+        return model(**{
+            name: from_plain(value)
+            for name, value in zip(MODEL_FIELDS[model], data[1:])
+        })
+    if isinstance(data, list):
+        return [from_plain(item) for item in data]
+    return data
+
+
+def encode(obj) -> bytes:
+    """
+    The stored form of a model tree (or a list of them): canonical,
+    compressed. Unlike marshal, it reads back the same with any
+    interpreter; FORMAT_VERSION tells the layout
+    """
+    return zlib.compress(canonical(obj))
+
+
+def decode(data: bytes):
+    """Inverse of encode"""
+    return _from_json(json.loads(zlib.decompress(data)))
+
+
+def _from_json(data):
+    # the model tuples of to_plain come back from JSON as lists
+    if not data or not isinstance(data, list):
+        return data
+    if isinstance(data[0], list):
+        return [_from_json(item) for item in data]
+    return _model_from_json(data)
+
+
+def _model_from_json(data):
+    model = MODELS[data[0]]
+    values = {}
+    for name, value in zip(MODEL_FIELDS[model], data[1:]):
+        nested = NESTED_MODELS.get((model, name))
+        if nested is not None and value:
+            if isinstance(value[0], list):
+                value = [_model_from_json(item) for item in value]
+            else:
+                value = _model_from_json(value)
+        values[name] = value
+    return model(**values)
+
+
+def canonical(obj) -> bytes:
+    """
+    A byte encoding of a model tree that only depends on its content:
+    compact JSON of to_plain, fields in declaration order and nested
+    subdefns included.
+    """
+    return json.dumps(to_plain(obj), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def content_hash(obj) -> bytes:
+    """The 16 bytes blake2b digest of canonical(obj)"""
+    return hashlib.blake2b(canonical(obj), digest_size=16).digest()
+
+
+# model of the items of the list fields, and of the nested model fields
+NESTED_MODELS = {
+    (DictEntry, 'phonetics'):     Phonetics,
+    (DictEntry, 'keywords'):      Keywords,
+    (DictEntry, 'defns'):         WordDefinition,
+    (WordDefinition, 'keywords'): Keywords,
+    (WordDefinition, 'examples'): ExampleGroup,
+    (WordDefinition, 'subdefns'): WordDefinition,
+}
+
+
+def to_dict(obj) -> dict:
+    """Converts a model tree to JSON-friendly dicts and lists"""
+    return asdict(obj)
+
+
+def from_dict(model, data: dict):
+    """Inverse of to_dict, e.g. from_dict(DictEntry, data)"""
+    values = {}
+    for model_field in fields(model):
+        if model_field.name not in data:
+            continue
+        value = data[model_field.name]
+        nested = NESTED_MODELS.get((model, model_field.name))
+        if nested is not None and isinstance(value, list):
+            value = [from_dict(nested, item) for item in value]
+        elif nested is not None and isinstance(value, dict):
+            value = from_dict(nested, value)
+        values[model_field.name] = value
+    return model(**values)
@@ -0,0 +1,333 @@
+"""Serve dictionary lookups over HTTP, keeping caches and connections warm.
+
+    python server.py --port 8080 --entry-cache entries.sqlite
+    curl 'localhost:8080/lookup?word=run&dial=british'
+    curl 'localhost:8080/lookup?word=run&format=html'
+    curl 'localhost:8080/batch?word=run&word=set'
+    printf 'run\\nset\\n' | curl --data-binary @- localhost:8080/batch
+
+/lookup answers with the JSON record of the word (as written by
+export.py) or, with format=html, with the page rendered by
+DictEntriesToHTML, streamed as it is rendered. /batch streams one JSON
+record per line (NDJSON) as each lookup completes; records carry the
+index of their word. /stats reports the cache and coalescing counters.
+"""
+import argparse
+import http.server
+import json
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit, parse_qs
+
+import metrics
+from export import make_record
+from macmillian import MacMillianDictScraper
+from singleflight import SingleFlight
+from transport import default_transport
+from viewhtml import DictEntriesToHTML
+
+
+class MemoryCache():
+    """A thread-safe LRU of lookup results, by entry key.
+
+    Attributes:
+        max_size    results kept
+        hits        results served from memory
+        misses      results that were not in memory
+    """
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.hits     = 0
+        self.misses   = 0
+        self._lock    = threading.Lock()
+        self._results = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._results)}
+
+
+class LookupService():
+    """The lookups behind the server, shared by all its requests.
+
+    Results are kept in a MemoryCache (and in entry_cache, an
+    EntryCache, when given), along with their encoded JSON records.
+    Concurrent lookups of the same word are coalesced by a SingleFlight:
+    one of them scrapes the word, the others wait for its result.
+
+    The lookups of /batch requests run in a pool of `workers` threads
+    shared by all the requests; each request keeps at most `workers`
+    of its words in the pool, so a long batch does not queue ahead of
+    the batches of the other clients.
+
+    Attributes:
+        workers     lookups a /batch request runs at the same time
+    """
+    scraper_class = MacMillianDictScraper
+
+    def __init__(self, transport=None, cache=None, entry_cache=None, engine='lxml',
+            memory_size=4096, workers=8, related_workers=4, related_deadline=None):
+        self.transport        = default_transport() if transport is None else transport
+        self.cache            = cache
+        self.entry_cache      = entry_cache
+        self.engine           = engine
+        self.workers          = workers
+        self.related_workers  = related_workers
+        self.related_deadline = related_deadline
+        self.memory           = MemoryCache(memory_size)
+        self.bodies           = MemoryCache(memory_size)
+        self.flight           = SingleFlight()
+        self._pool            = ThreadPoolExecutor(workers, thread_name_prefix='batch')
+
+    def scraper(self, word, dial=None):
+        return self.scraper_class(
+            word, dial=dial, transport=self.transport, cache=self.cache,
+            entry_cache=self.entry_cache, engine=self.engine,
+            related_workers=self.related_workers, related_deadline=self.related_deadline
+        )
+
+    def lookup(self, word, dial=None):
+        """The list of DictEntry of word, or an ErrorList"""
+        scraper = self.scraper(word, dial)
+        entry_key = scraper.entry_key()
+        sanitized_data = self.memory.get(entry_key)
+        if sanitized_data is not None:
+            return sanitized_data
+
+        def compute():
+            sanitized_data = scraper.extract()
+            # partial results (related entries past the deadline) are not kept
+            if not scraper.related_missing:
+                self.memory.put(entry_key, sanitized_data)
+            return sanitized_data
+
+        return self.flight.do(entry_key, compute)
+
+    def lookup_body(self, word, dial=None):
+        """
+        Returns (found, body), body being the JSON record of word,
+        encoded once per result: encoding a large entry costs more
+        than the rest of a warm lookup
+        """
+        entry_key = self.scraper(word, dial).entry_key()
+        body = self.bodies.get(entry_key)
+        if body is None:
+            record = make_record(0, word, self.lookup(word, dial))
+            body = (record['status'] == 'found', json.dumps(record, ensure_ascii=False).encode('utf-8'))
+            if entry_key in self.memory:
+                self.bodies.put(entry_key, body)
+        return body
+
+    def lookup_many(self, words, dial=None):
+        """
+        Yields (index, word, result) as the lookups complete, with at
+        most `workers` of them submitted to the pool at a time
+        """
+        iter_words = enumerate(words)
+        dict_futures = {}
+        while True:
+            for index, word in iter_words:
+                dict_futures[self._pool.submit(self.lookup, word, dial)] = (index, word)
+                if len(dict_futures) >= self.workers:
+                    break
+            if not dict_futures:
+                return
+            done, _ = wait(dict_futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, word = dict_futures.pop(future)
+                exception = future.exception()
+                yield index, word, exception if exception is not None else future.result()
+
+    def stats(self) -> dict:
+        dict_stats = {'memory': self.memory.stats(), 'bodies': self.bodies.stats(), 'coalesced': self.flight.stats()}
+        if self.entry_cache is not None:
+            dict_stats['entry_cache'] = self.entry_cache.stats()
+        return dict_stats
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _ChunkedWriter():
+    """Writes text to a response with chunked transfer encoding"""
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        if data:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+
+    def close(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+class LookupHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    service = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/lookup':
+            self.lookup(query)
+        elif url.path == '/batch':
+            self.batch(query.get('word', []), query)
+        elif url.path == '/stats':
+            self.send_json(200, self.service.stats())
+        else:
+            self.send_json(404, {'error': f'no such endpoint: {url.path}'})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/batch':
+            self.send_json(404, {'error': f'no such endpoint: {url.path}'})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                list_words = json.loads(body)
+            except ValueError:
+                list_words = None
+            if not isinstance(list_words, list) or not all(isinstance(word, str) for word in list_words):
+                self.send_json(400, {'error': 'expected a JSON list of words'})
+                return
+            list_words = [word.strip() for word in list_words if word.strip()]
+        else:
+            list_words = [line.strip() for line in body.splitlines() if line.strip()]
+        self.batch(list_words, parse_qs(url.query))
+
+    def lookup(self, query):
+        word = query.get('word', [''])[0].strip()
+        if not word:
+            self.send_json(400, {'error': 'missing word'})
+            return
+        dial = query.get('dial', [None])[0]
+        html = query.get('format', ['json'])[0] == 'html'
+        try:
+            with metrics.stage('serve.lookup'):
+                if html:
+                    sanitized_data = self.service.lookup(word, dial)
+                else:
+                    found, body = self.service.lookup_body(word, dial)
+        except Exception as exception:
+            self.send_json(502, make_record(0, word, exception))
+            return
+
+        if html:
+            if isinstance(sanitized_data, list):
+                status, list_entries = 200, sanitized_data
+            else:
+                status, list_entries = 404, []
+            writer = self.start_chunked(status, 'text/html; charset=utf-8')
+            DictEntriesToHTML(list_entries, title=word).write(writer)
+            writer.close()
+            return
+
+        self.send_body(200 if found else 404, 'application/json', body)
+
+    def batch(self, list_words, query):
+        if not list_words:
+            self.send_json(400, {'error': 'missing words'})
+            return
+        dial = query.get('dial', [None])[0]
+        writer = self.start_chunked(200, 'application/x-ndjson')
+        for index, word, result in self.service.lookup_many(list_words, dial):
+            writer.write(json.dumps(make_record(index, word, result), ensure_ascii=False) + '\n')
+        writer.close()
+
+    def start_chunked(self, status, content_type) -> _ChunkedWriter:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return _ChunkedWriter(self.wfile)
+
+    def send_json(self, status, data):
+        self.send_body(status, 'application/json', json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LookupServer(http.server.ThreadingHTTPServer):
+    """A threaded HTTP server answering with a LookupService"""
+    daemon_threads = True
+
+    def __init__(self, service, host='127.0.0.1', port=8080):
+        self.service = service
+        handler = type('LookupHandler', (LookupHandler,), {'service': service})
+        super().__init__((host, port), handler)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address
+        return f'http://{host}:{port}'
+
+
+def main():
+    from cache import ResponseCache, EntryCache
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache', help='SQLite file of the ResponseCache')
+    parser.add_argument('--entry-cache', help='SQLite file of the EntryCache')
+    parser.add_argument('--engine', default='lxml', choices=MacMillianDictScraper.engines)
+    parser.add_argument('--memory-size', type=int, default=4096, help='results kept in memory')
+    parser.add_argument('--workers', type=int, default=8, help='lookups run at once by a /batch request, in a pool shared by all of them')
+    parser.add_argument('--related-deadline', type=float, default=None,
+        help='seconds after which a lookup returns without its missing related entries')
+    args = parser.parse_args()
+
+    service = LookupService(
+        cache=ResponseCache(args.cache) if args.cache else None,
+        entry_cache=EntryCache(args.entry_cache) if args.entry_cache else None,
+        engine=args.engine, memory_size=args.memory_size, workers=args.workers,
+        related_deadline=args.related_deadline
+    )
+    server = LookupServer(service, args.host, args.port)
+    print(f'serving on {server.base_url}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
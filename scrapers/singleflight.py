@@ -0,0 +1,169 @@
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+
+def canonical_url(url: str) -> str:
+    """Normalizes url so the same page always gets the same key"""
+    parts = urlsplit(url)
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        parts.path.rstrip('/') or '/',
+        parts.query,
+        '',
+    ))
+
+
+class _Call():
+    def __init__(self):
+        self.done      = threading.Event()
+        self.result    = None
+        self.exception = None
+
+
+class SingleFlight():
+    """Runs at most one call per key at a time: threads asking for a
+    key that is already in flight wait for that call and share its
+    result (or exception).
+
+    Attributes:
+        executed    calls actually run
+        shared      calls answered by a call already in flight
+    """
+    def __init__(self):
+        self.executed = 0
+        self.shared   = 0
+        self._lock    = threading.Lock()
+        self._calls   = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func()
+            except BaseException as exception:
+                call.exception = exception
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.exception is not None:
+            raise call.exception
+        return call.result
+
+    def stats(self) -> dict:
+        return {'executed': self.executed, 'shared': self.shared}
+
+
+class BatchMemo():
+    """A SingleFlight that also remembers the results, so that within
+    one batch run each key is computed at most once.
+
+    Attributes:
+        hits    calls answered from the memo
+    """
+    def __init__(self):
+        self.hits    = 0
+        self.flight  = SingleFlight()
+        self._lock   = threading.Lock()
+        self._memo   = {}
+
+    def do(self, key, func):
+        with self._lock:
+            if key in self._memo:
+                self.hits += 1
+                return self._memo[key]
+
+        def compute():
+            result = func()
+            with self._lock:
+                self._memo[key] = result
+            return result
+
+        return self.flight.do(key, compute)
+
+    def stats(self) -> dict:
+        return {
+            'executed': self.flight.executed,
+            'shared': self.flight.shared,
+            'hits': self.hits,
+            'saved': self.flight.shared + self.hits,
+        }
+
+
+class AsyncSingleFlight():
+    """SingleFlight for coroutines: do(key, func) awaits func() once per
+    key in flight, func being a function returning an awaitable"""
+    def __init__(self):
+        self.executed = 0
+        self.shared   = 0
+        self._calls   = {}
+
+    async def do(self, key, func):
+        # only called from a running event loop, asyncio is loaded by then
+        import asyncio
+
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+        else:
+            self.executed += 1
+            call = self._calls[key] = {'future': asyncio.ensure_future(func()), 'waiters': 0}
+            call['future'].add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # shielded so that one cancelled waiter does not cancel the
+        # others, the call itself is cancelled with its last waiter
+        future = call['future']
+        call['waiters'] += 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if call['waiters'] == 1 and not future.done():
+                future.cancel()
+                await asyncio.wait([future])
+            raise
+        finally:
+            call['waiters'] -= 1
+
+    def stats(self) -> dict:
+        return {'executed': self.executed, 'shared': self.shared}
+
+
+class AsyncBatchMemo():
+    """BatchMemo for coroutines"""
+    def __init__(self):
+        self.hits   = 0
+        self.flight = AsyncSingleFlight()
+        self._memo  = {}
+
+    async def do(self, key, func):
+        if key in self._memo:
+            self.hits += 1
+            return self._memo[key]
+
+        async def compute():
+            result = await func()
+            self._memo[key] = result
+            return result
+
+        return await self.flight.do(key, compute)
+
+    def stats(self) -> dict:
+        return {
+            'executed': self.flight.executed,
+            'shared': self.flight.shared,
+            'hits': self.hits,
+            'saved': self.flight.shared + self.hits,
+        }
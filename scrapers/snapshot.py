@@ -0,0 +1,475 @@
+"""Incremental snapshots of a dictionary, published as delta segments.
+
+    python snapshot.py publish snapshot/ dictionary.jsonl
+    python snapshot.py get snapshot/ 'run#0'
+    python snapshot.py compact snapshot/
+    python snapshot.py info snapshot/
+
+A snapshot is a directory of segment files and a MANIFEST.json listing
+them, oldest first. Publishing writes one segment with only the entries
+added, changed (by content hash, see serialize.content_hash) or removed
+since the last publication; once there are more than max_segments,
+they are merged in a background thread. Readers memory-map the segments
+of the manifest, a key being answered by the newest segment holding it.
+
+A snapshot directory has a single writer (one SnapshotStore); any
+number of processes can read it.
+"""
+import argparse
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+import serialize
+from index import pack_strings, PackedStrings, bisect_packed
+from models import DictEntry
+
+
+MAGIC    = b'DXSG'
+VERSION  = 2
+MANIFEST = 'MANIFEST.json'
+
+HASH_SIZE = 16
+
+# flags of a segment item
+REMOVED = 1
+
+
+def write_segment(path, list_items, generation):
+    """
+    Writes a segment file from list_items, (key, hash, record) tuples
+    sorted by key, record being the serialize.encode bytes of the entry
+    or None for a removed key
+    """
+    keys_blob, key_offsets = pack_strings(key for key, _, _ in list_items)
+    flags = array('B', (REMOVED if record is None else 0 for _, _, record in list_items))
+    record_offsets = array('Q', [0])
+    for _, _, record in list_items:
+        record_offsets.append(record_offsets[-1] + (0 if record is None else len(record)))
+
+    sections = {}
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        header_size = 4096
+        file.write(b'\0' * header_size)
+
+        def write_section(name, *chunks):
+            position = file.tell()
+            if position % 8:
+                file.write(b'\0' * (8 - position % 8))
+                position = file.tell()
+            for chunk in chunks:
+                file.write(chunk)
+            sections[name] = [position, file.tell() - position]
+
+        write_section('key_blob', keys_blob)
+        write_section('key_offsets', key_offsets.tobytes())
+        write_section('hashes', *(hashed for _, hashed, _ in list_items))
+        write_section('flags', flags.tobytes())
+        write_section('records', *(record for _, _, record in list_items if record is not None))
+        write_section('record_offsets', record_offsets.tobytes())
+
+        header = json.dumps({
+            'entries': len(list_items),
+            'removed': flags.count(REMOVED),
+            'generation': generation,
+            'record_format': serialize.FORMAT_VERSION,
+            'sections': sections,
+        }).encode('utf-8')
+        if len(header) + 12 > header_size:
+            raise ValueError('segment header too large')
+        file.seek(0)
+        file.write(MAGIC + struct.pack('<II', VERSION, len(header)) + header)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return os.path.getsize(path)
+
+
+class Segment():
+    """A memory-mapped segment file"""
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        version, header_size = struct.unpack_from('<II', self._mmap, 4)
+        if self._mmap[:4] != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a snapshot segment (version {VERSION})')
+        header = json.loads(bytes(self._mmap[12:12 + header_size]))
+        if header['record_format'] != serialize.FORMAT_VERSION:
+            raise ValueError(f"{path} stores its records in format {header['record_format']}, rebuild it")
+        self.num_entries = header['entries']
+        self.num_removed = header['removed']
+        self.generation  = header['generation']
+
+        def section(name, fmt=None):
+            start, size = header['sections'][name]
+            part = view[start:start + size]
+            return part.cast(fmt) if fmt else part
+
+        self._keys           = PackedStrings(section('key_blob'), section('key_offsets', 'Q'))
+        self._hashes         = section('hashes')
+        self._flags          = section('flags')
+        self._records        = section('records')
+        self._record_offsets = section('record_offsets', 'Q')
+
+    def __len__(self):
+        return self.num_entries
+
+    def find(self, encoded_key) -> int:
+        """The position of a (utf-8) key, or -1"""
+        index = bisect_packed(self._keys, encoded_key)
+        if index < len(self._keys) and bytes(self._keys[index]) == encoded_key:
+            return index
+        return -1
+
+    def key(self, index) -> bytes:
+        return bytes(self._keys[index])
+
+    def hash(self, index) -> bytes:
+        return bytes(self._hashes[index * HASH_SIZE:(index + 1) * HASH_SIZE])
+
+    def is_removed(self, index) -> bool:
+        return bool(self._flags[index] & REMOVED)
+
+    def record(self, index) -> bytes:
+        return bytes(self._records[self._record_offsets[index]:self._record_offsets[index + 1]])
+
+    def close(self):
+        for name in list(vars(self)):
+            if name.startswith('_') and isinstance(getattr(self, name), (memoryview, PackedStrings)):
+                delattr(self, name)
+        self._mmap.close()
+        self._file.close()
+
+
+def merge_segments(list_segments):
+    """
+    Yields (key bytes, segment, index) of the live keys of segments
+    (oldest first), in key order, each key from the newest segment
+    holding it
+    """
+    def iter_segment(position, segment):
+        for index in range(len(segment)):
+            # for the same key, the newest segment comes first
+            yield segment.key(index), -position, index
+
+    list_iters = [iter_segment(position, segment) for position, segment in enumerate(list_segments)]
+    last_key = None
+    for encoded, position, index in heapq.merge(*list_iters):
+        if encoded == last_key:
+            continue
+        last_key = encoded
+        segment = list_segments[-position]
+        if not segment.is_removed(index):
+            yield encoded, segment, index
+
+
+def read_manifest(directory) -> dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'generation': 0, 'segments': []}
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+class Snapshot():
+    """Reads the snapshot of a directory, as listed by its manifest when
+    opened: later publications are not seen until it is opened again"""
+    def __init__(self, directory):
+        self.directory  = directory
+        self.generation = 0
+        self.segments   = []
+        self._length    = None
+
+        # a merge may remove the segments of the manifest just read
+        for attempt in range(3):
+            manifest = read_manifest(directory)
+            try:
+                for name in manifest['segments']:
+                    self.segments.append(Segment(os.path.join(directory, name)))
+            except FileNotFoundError:
+                self.close()
+                self.segments = []
+                if attempt == 2:
+                    raise
+                continue
+            self.generation = manifest['generation']
+            break
+
+    def _find(self, key):
+        encoded = key.encode('utf-8')
+        for segment in reversed(self.segments):
+            index = segment.find(encoded)
+            if index >= 0:
+                if segment.is_removed(index):
+                    return None, -1
+                return segment, index
+        return None, -1
+
+    def get(self, key) -> DictEntry:
+        """The entry of key, or None"""
+        segment, index = self._find(key)
+        return None if segment is None else serialize.decode(segment.record(index))
+
+    def entry_hash(self, key) -> bytes:
+        """The content hash of the entry of key, or None"""
+        segment, index = self._find(key)
+        return None if segment is None else segment.hash(index)
+
+    def __contains__(self, key):
+        return self._find(key)[0] is not None
+
+    def _merged(self):
+        return merge_segments(self.segments)
+
+    def hashes(self):
+        """Yields (key, content hash) of every entry, in key order"""
+        for encoded, segment, index in self._merged():
+            yield encoded.decode('utf-8'), segment.hash(index)
+
+    def items(self):
+        """Yields (key, DictEntry) of every entry, in key order"""
+        for encoded, segment, index in self._merged():
+            yield encoded.decode('utf-8'), serialize.decode(segment.record(index))
+
+    def keys(self):
+        for encoded, _, _ in self._merged():
+            yield encoded.decode('utf-8')
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(1 for _ in self._merged())
+        return self._length
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SnapshotStore():
+    """Publishes the snapshots of a directory.
+
+    Attributes:
+        max_segments    segments kept before they are merged
+        background      merge in a background thread (else on publish)
+    """
+    def __init__(self, directory, max_segments=8, background=True):
+        self.directory    = directory
+        self.max_segments = max_segments
+        self.background   = background
+        self._lock        = threading.Lock()
+        self._compactor   = None
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self) -> Snapshot:
+        """A reader of the latest snapshot"""
+        with self._lock:
+            return Snapshot(self.directory)
+
+    def apply(self, upserts=None, removals=()) -> dict:
+        """
+        Publishes the entries of upserts (a dict key -> DictEntry) and
+        the removal of the keys of removals. Entries whose content hash
+        did not change are skipped; nothing is written when nothing
+        changed. Returns the counts of the publication.
+        """
+        upserts = upserts or {}
+        dict_stats = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0, 'bytes': 0}
+        list_items = []
+        with self.open() as snapshot:
+            for key, dict_entry in upserts.items():
+                hashed = serialize.content_hash(dict_entry)
+                old_hash = snapshot.entry_hash(key)
+                if old_hash == hashed:
+                    dict_stats['unchanged'] += 1
+                    continue
+                dict_stats['added' if old_hash is None else 'changed'] += 1
+                list_items.append((key, hashed, serialize.encode(dict_entry)))
+            for key in removals:
+                if key not in upserts and key in snapshot:
+                    dict_stats['removed'] += 1
+                    list_items.append((key, b'\0' * HASH_SIZE, None))
+            generation = snapshot.generation
+
+        if list_items:
+            list_items.sort(key=lambda item: item[0].encode('utf-8'))
+            generation, dict_stats['bytes'] = self._add_segment(list_items)
+            self._maybe_compact()
+        dict_stats['generation'] = generation
+        return dict_stats
+
+    def publish(self, entries) -> dict:
+        """
+        Publishes a full dictionary, entries being a dict key ->
+        DictEntry (or an iterable of pairs): only its differences with
+        the latest snapshot are written, and the keys missing from it
+        are removed
+        """
+        dict_entries = dict(entries)
+        with self.open() as snapshot:
+            list_removals = [key for key in snapshot.keys() if key not in dict_entries]
+        return self.apply(dict_entries, list_removals)
+
+    def _add_segment(self, list_items):
+        with self._lock:
+            manifest = read_manifest(self.directory)
+            manifest['generation'] += 1
+            name = f"{manifest['generation']:08d}.seg"
+            size = write_segment(os.path.join(self.directory, name), list_items, manifest['generation'])
+            manifest['segments'].append(name)
+            write_manifest(self.directory, manifest)
+            return manifest['generation'], size
+
+    def _maybe_compact(self):
+        if len(read_manifest(self.directory)['segments']) <= self.max_segments:
+            return
+        if not self.background:
+            self.compact()
+        elif self._compactor is None or not self._compactor.is_alive():
+            self._compactor = threading.Thread(target=self.compact, name='snapshot-compact', daemon=True)
+            self._compactor.start()
+
+    def compact(self) -> int:
+        """
+        Merges the segments of the manifest into one, without the
+        removed keys. Segments published in the meantime are kept after
+        it. Returns the size of the merged segment.
+        """
+        with self._lock:
+            manifest = read_manifest(self.directory)
+            list_names = list(manifest['segments'])
+            if len(list_names) <= 1:
+                return 0
+            manifest['generation'] += 1
+            generation = manifest['generation']
+            write_manifest(self.directory, manifest)
+
+        list_segments = [Segment(os.path.join(self.directory, name)) for name in list_names]
+        try:
+            # records are copied as they are, without decoding them
+            list_items = [
+                (encoded.decode('utf-8'), segment.hash(index), segment.record(index))
+                for encoded, segment, index in merge_segments(list_segments)
+            ]
+            name = f'{generation:08d}.seg'
+            size = write_segment(os.path.join(self.directory, name), list_items, generation)
+        finally:
+            for segment in list_segments:
+                segment.close()
+
+        with self._lock:
+            manifest = read_manifest(self.directory)
+            list_newer = [segment_name for segment_name in manifest['segments'] if segment_name not in list_names]
+            manifest['segments'] = [name] + list_newer
+            write_manifest(self.directory, manifest)
+        # readers still mapping the old segments keep their pages
+        for segment_name in list_names:
+            os.remove(os.path.join(self.directory, segment_name))
+        return size
+
+    def wait(self):
+        """Waits for a background merge to end"""
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def stats(self) -> dict:
+        manifest = read_manifest(self.directory)
+        return {
+            'generation': manifest['generation'],
+            'segments': len(manifest['segments']),
+            'bytes': sum(os.path.getsize(os.path.join(self.directory, name)) for name in manifest['segments']),
+        }
+
+
+def jsonl_entries(path):
+    """
+    Yields (key, DictEntry) of the entries of an export.py JSONL file,
+    keyed by the looked up word and the position of the entry (run#0,
+    run#1...)
+    """
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            if record.get('status') == 'found':
+                for position, entry in enumerate(record['entries']):
+                    yield f"{record['word']}#{position}", serialize.from_dict(DictEntry, entry)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_publish = subparsers.add_parser('publish', help='publish export.py JSONL files as the new snapshot')
+    parser_publish.add_argument('snapshot')
+    parser_publish.add_argument('jsonl', nargs='+')
+    parser_publish.add_argument('--max-segments', type=int, default=8)
+
+    parser_get = subparsers.add_parser('get', help='print the entry of a key as JSON')
+    parser_get.add_argument('snapshot')
+    parser_get.add_argument('key')
+
+    parser_compact = subparsers.add_parser('compact', help='merge the segments into one')
+    parser_compact.add_argument('snapshot')
+
+    parser_info = subparsers.add_parser('info', help='segments and entries of the snapshot')
+    parser_info.add_argument('snapshot')
+
+    args = parser.parse_args()
+    if args.command == 'publish':
+        # merged in the foreground, the process ends right after
+        store = SnapshotStore(args.snapshot, max_segments=args.max_segments, background=False)
+        dict_entries = {}
+        for path in args.jsonl:
+            dict_entries.update(jsonl_entries(path))
+        print(json.dumps(store.publish(dict_entries)))
+
+    elif args.command == 'get':
+        with Snapshot(args.snapshot) as snapshot:
+            dict_entry = snapshot.get(args.key)
+        if dict_entry is None:
+            print(f'{args.key}: not in the snapshot', file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(serialize.to_dict(dict_entry), ensure_ascii=False, indent=2))
+
+    elif args.command == 'compact':
+        print(f'{SnapshotStore(args.snapshot).compact()} bytes')
+
+    elif args.command == 'info':
+        with Snapshot(args.snapshot) as snapshot:
+            print(f'generation {snapshot.generation}, {len(snapshot)} entries')
+            for segment in snapshot.segments:
+                print(
+                    f'{os.path.basename(segment.path)}\t{len(segment)} keys'
+                    f'\t{segment.num_removed} removed\t{os.path.getsize(segment.path)} bytes'
+                )
+
+
+if __name__ == '__main__':
+    main()
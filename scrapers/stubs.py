@@ -0,0 +1,270 @@
+"""Local stand-ins for the dictionary site, and helpers over a corpus
+of saved pages, shared by the benchmarks and the tests.
+
+A corpus is a directory with one sub-directory per page category,
+e.g. small/, huge/ (polysemous entries such as set or run) and error/.
+"""
+import hashlib
+import http.server
+import os
+import random
+import shutil
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from macmillian import MacMillianDictScraper
+from transport import make_response
+
+
+def page_scraper(path, engine='bs4', content=None):
+    """
+    Returns a non-recursive scraper fed with a saved page
+    (the file name, without extension, is used as the slug)
+    """
+    if content is None:
+        with open(path, 'rb') as file:
+            content = file.read()
+    slug = os.path.splitext(os.path.basename(path))[0]
+    scraper = MacMillianDictScraper(slug=slug, recursive=False, engine=engine)
+    scraper.feed(make_response(
+        scraper.full_url(), content,
+        headers={'Content-Type': 'text/html; charset=utf-8'}
+    ))
+    return scraper
+
+
+def load_corpus(directory) -> list[tuple[str, str]]:
+    """Returns (category, path) tuples for every page in the corpus"""
+    list_pages = []
+    for category in sorted(os.listdir(directory)):
+        category_dir = os.path.join(directory, category)
+        if not os.path.isdir(category_dir):
+            continue
+        for name in sorted(os.listdir(category_dir)):
+            if name.endswith('.html'):
+                list_pages.append((category, os.path.join(category_dir, name)))
+    return list_pages
+
+
+def corpus_words(directory) -> list[str]:
+    """The words looked up to get the pages of the corpus"""
+    list_words = []
+    for _, path in load_corpus(directory):
+        name = os.path.splitext(os.path.basename(path))[0]
+        word = name[len('search-'):] if name.startswith('search-') else name.split('_')[0]
+        if word not in list_words:
+            list_words.append(word)
+    return list_words
+
+
+def corrupt_pages(directory, destination):
+    """
+    Copies the corpus to destination, adding two damaged copies of its
+    first huge page: broken.html, whose first senses lost their
+    definitions, and orphan.html, which opens with a sub-sense
+    """
+    shutil.copytree(directory, destination, dirs_exist_ok=True)
+    list_huge = [path for category, path in load_corpus(directory) if category == 'huge']
+    with open(list_huge[0], encoding='utf-8') as file:
+        content = file.read()
+    with open(os.path.join(destination, 'huge', 'broken.html'), 'w', encoding='utf-8') as file:
+        file.write(content.replace('class="DEFINITION"', 'class="LOST-DEFINITION"', 3))
+    with open(os.path.join(destination, 'huge', 'orphan.html'), 'w', encoding='utf-8') as file:
+        file.write(content.replace('class="SENSE-CONTENT"', 'class="SUB-SENSE-CONTENT"', 1))
+
+
+class ReplayServer():
+    """A local HTTP server that serves the corpus pages in place of
+    the dictionary site.
+
+    Slug urls are answered with the page of the same name, searches
+    with the page named after the word (word, word_1 or search-word).
+    Pages are sent with an ETag, and If-None-Match is answered with a
+    304 when the page did not change. To stand for a flaky site, a
+    `failure_rate` share of the requests (all of them while `down` is
+    set, and those of the pages named in `failing`) are answered with
+    a 503.
+
+    Attributes:
+        connections     connections accepted
+        requests        requests received
+        not_modified    requests answered with a 304
+        failures        requests answered with a 503
+    """
+    def __init__(self, directory, delay=0.0, failure_rate=0.0, seed=0):
+        self.delay        = delay
+        self.failure_rate = failure_rate
+        self.down         = False
+        self.failing      = set()
+        self.pages        = {
+            os.path.splitext(os.path.basename(path))[0]: path
+            for _, path in load_corpus(directory)
+        }
+        self.connections  = 0
+        self.requests     = 0
+        self.not_modified = 0
+        self.failures     = 0
+        self._random      = random.Random(seed)
+        self._lock        = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def scraper_class(self, base=MacMillianDictScraper):
+        """Returns a subclass of base whose urls point to this server"""
+        return type('Replay' + base.__name__, (base,), {
+            'search_url': self.base_url + '/us/search/{dial}/direct/?q={word}',
+            'slug_url': self.base_url + '/dictionary/{dial}/{slug}',
+        })
+
+    def find_page(self, path, query):
+        if path.startswith('/us/search/'):
+            word = parse_qs(query).get('q', [''])[0]
+            list_names = (word, f'{word}_1', f'search-{word}')
+        else:
+            list_names = (path.rstrip('/').split('/')[-1],)
+        for name in list_names:
+            if name in self.pages:
+                return self.pages[name]
+        return None
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def fails(self, path) -> bool:
+        if path is not None and os.path.splitext(os.path.basename(path))[0] in self.failing:
+            return True
+        with self._lock:
+            return self.down or self._random.random() < self.failure_rate
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                # one handler per connection, kept alive across its requests
+                super().setup()
+                server.count('connections')
+
+            def do_GET(self):
+                server.count('requests')
+                if server.delay:
+                    time.sleep(server.delay)
+                url = urlsplit(self.path)
+                path = server.find_page(url.path, url.query)
+                if server.fails(path):
+                    server.count('failures')
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if path is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                with open(path, 'rb') as file:
+                    content = file.read()
+                etag = '"%s"' % hashlib.md5(content).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    server.count('not_modified')
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ThrottlingServer():
+    """A local HTTP server that only accepts `capacity` requests per
+    second, like a throttling site: the others get a 429 with a
+    Retry-After header. Each accepted request takes `delay` seconds.
+    """
+    def __init__(self, capacity=20.0, delay=0.02, retry_after=1):
+        self.capacity    = capacity
+        self.delay       = delay
+        self.retry_after = retry_after
+        self.accepted    = 0
+        self.throttled   = 0
+        self._tokens     = capacity
+        self._updated    = time.monotonic()
+        self._lock       = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def admit(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.capacity)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.accepted += 1
+                return True
+            self.throttled += 1
+            return False
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if not server.admit():
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(server.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                time.sleep(server.delay)
+                content = b'<html><body>ok</body></html>'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,12 @@
+"""Tests against local stand-ins of the dictionary site (see stubs.py).
+
+    python -m pytest tests
+    python -m unittest discover -s tests -t .
+
+Both are run from the scrapers/ directory. The pages of corpus/ are
+small synthetic copies of the site pages.
+"""
+import os
+
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
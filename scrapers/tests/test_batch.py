@@ -0,0 +1,83 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from contextlib import aclosing
+
+import requests
+
+import serialize
+from batch import BatchLookup
+from cache import EntryCache
+from stubs import ReplayServer
+from tests import CORPUS
+from transport import Transport
+
+
+class BatchLookupTest(unittest.TestCase):
+    def setUp(self):
+        self.replay = ReplayServer(CORPUS)
+        self.replay.__enter__()
+        self.addCleanup(self.replay.__exit__, None, None, None)
+        self.scraper_class = self.replay.scraper_class()
+
+    def batch(self, **options):
+        batch = BatchLookup(rate=0, transport=Transport(), **options)
+        batch.scraper_class = self.scraper_class
+        return batch
+
+    def collect(self, batch, words, **options):
+        async def collect():
+            return {word: result async for word, result in batch.lookup_many(words, **options)}
+        return asyncio.run(collect())
+
+    def test_same_results_as_the_scraper(self):
+        dict_results = self.collect(self.batch(concurrency=3), ['run', 'set', 'runx'])
+        for word, result in dict_results.items():
+            with self.subTest(word=word):
+                expected = self.scraper_class(word, transport=Transport()).extract()
+                self.assertEqual(serialize.canonical(result), serialize.canonical(expected))
+
+    def test_entry_cache(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            entry_cache = EntryCache(os.path.join(temp_dir, 'entries.sqlite'))
+            first = self.collect(self.batch(entry_cache=entry_cache), ['run', 'runx'])
+            requests_before = self.replay.requests
+            second = self.collect(self.batch(entry_cache=entry_cache), ['run', 'runx'])
+            entry_cache.close()
+        self.assertEqual(self.replay.requests, requests_before)
+        self.assertEqual(second, first)
+
+    def test_failure_cancels_the_other_lookups(self):
+        self.replay.delay = 0.05
+
+        async def run():
+            with self.assertRaises(requests.HTTPError):
+                async for _ in self.batch(concurrency=4).lookup_many(['nosuchword', 'run', 'set', 'run']):
+                    pass
+            return asyncio.all_tasks()
+
+        self.assertEqual(len(asyncio.run(run())), 1)
+
+    def test_stopping_early_cancels_the_lookups(self):
+        self.replay.delay = 0.05
+        list_taken = []
+
+        def words():
+            for word in ['run', 'set'] * 10:
+                list_taken.append(word)
+                yield word
+
+        async def run():
+            async with aclosing(self.batch(concurrency=4).lookup_indexed(words())) as results:
+                async for _ in results:
+                    break
+            return asyncio.all_tasks()
+
+        # only the task of run() is left
+        self.assertEqual(len(asyncio.run(run())), 1)
+        self.assertLessEqual(len(list_taken), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
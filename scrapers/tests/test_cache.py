@@ -0,0 +1,114 @@
+import marshal
+import os
+import tempfile
+import time
+import unittest
+import zlib
+
+import serialize
+from cache import EntryCache, ResponseCache
+from stubs import page_scraper, load_corpus, ReplayServer
+from tests import CORPUS
+from transport import Transport, make_response
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, 'responses.sqlite')
+
+    def lookup_twice(self, cache):
+        with ReplayServer(CORPUS) as replay:
+            scraper_class = replay.scraper_class()
+            transport = Transport()
+            first = scraper_class('run', transport=transport, cache=cache).extract()
+            requests_before = replay.requests
+            second = scraper_class('run', transport=transport, cache=cache).extract()
+        self.assertEqual(second, first)
+        return replay, replay.requests - requests_before
+
+    def test_fresh_pages_are_not_fetched(self):
+        cache = ResponseCache(self.path)
+        self.addCleanup(cache.close)
+        replay, num_requests = self.lookup_twice(cache)
+        self.assertEqual(num_requests, 0)
+        self.assertEqual(cache.stats()['hits'], 3)
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    def test_stale_pages_are_revalidated(self):
+        cache = ResponseCache(self.path, ttl=0)
+        self.addCleanup(cache.close)
+        replay, num_requests = self.lookup_twice(cache)
+        self.assertEqual(num_requests, 3)
+        self.assertEqual(replay.not_modified, 3)
+        self.assertEqual(cache.stats()['revalidated'], 3)
+
+    def test_least_recently_used_pages_are_evicted(self):
+        list_responses = []
+        for _, path in load_corpus(CORPUS):
+            with open(path, 'rb') as file:
+                list_responses.append(make_response('http://example.test/' + os.path.basename(path), file.read()))
+        # room for the last two pages only
+        max_size = sum(len(zlib.compress(response.content)) for response in list_responses[-2:])
+        cache = ResponseCache(self.path, max_size=max_size)
+        self.addCleanup(cache.close)
+
+        for response in list_responses:
+            cache.put(response.url, response)
+        dict_stats = cache.stats()
+        self.assertEqual(dict_stats['evictions'], len(list_responses) - 2)
+        self.assertLessEqual(dict_stats['size'], max_size)
+        self.assertTrue(cache.is_fresh(list_responses[-1].url))
+        self.assertFalse(cache.is_fresh(list_responses[0].url))
+
+
+class EntryCacheTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, 'entries.sqlite')
+
+    def test_results_read_back_the_same(self):
+        entry_cache = EntryCache(self.path)
+        for _, path in load_corpus(CORPUS):
+            entry_cache.put(path, page_scraper(path).extract())
+        entry_cache.close()
+
+        # a new connection, as another process would open it
+        entry_cache = EntryCache(self.path)
+        for _, path in load_corpus(CORPUS):
+            with self.subTest(path=path):
+                self.assertEqual(entry_cache.get(path), page_scraper(path).extract())
+        self.assertEqual(entry_cache.stats()['hits'], len(load_corpus(CORPUS)))
+        entry_cache.close()
+
+    def test_stored_form_is_the_canonical_json(self):
+        path = os.path.join(CORPUS, 'huge', 'set_1.html')
+        list_entries = page_scraper(path).extract()
+        encoded = serialize.encode(list_entries)
+        self.assertEqual(zlib.decompress(encoded), serialize.canonical(list_entries))
+        self.assertEqual(serialize.decode(encoded), list_entries)
+
+    def test_results_of_another_format_are_not_read(self):
+        entry_cache = EntryCache(self.path)
+        self.addCleanup(entry_cache.close)
+        entry_cache._db.execute(
+            'INSERT INTO entries VALUES (?, ?, ?)',
+            ('run v1', marshal.dumps(['not', 'an', 'entry']), time.time())
+        )
+        self.assertIsNone(entry_cache.get('run'))
+        self.assertNotIn('run', entry_cache)
+
+    def test_ttl(self):
+        entry_cache = EntryCache(self.path, ttl=0.05)
+        self.addCleanup(entry_cache.close)
+        entry_cache.put('run', [])
+        self.assertIn('run', entry_cache)
+        time.sleep(0.06)
+        self.assertNotIn('run', entry_cache)
+        self.assertIsNone(entry_cache.get('run'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from compact import EntryStore, Vocabulary, MAX_CODE
+from models import DictEntry, Keywords, WordDefinition
+from stubs import page_scraper, load_corpus
+from tests import CORPUS
+
+
+class EntryStoreTest(unittest.TestCase):
+    def corpus_entries(self):
+        list_entries = []
+        for category, path in load_corpus(CORPUS):
+            if category != 'error':
+                list_entries.extend(page_scraper(path).extract())
+        return list_entries
+
+    def test_entries_read_back_the_same(self):
+        list_entries = self.corpus_entries()
+        store = EntryStore(list_entries)
+        self.assertEqual(len(store), len(list_entries))
+        self.assertEqual(list(store), list_entries)
+        self.assertEqual(store[-1], list_entries[-1])
+        self.assertEqual(store.word(0), list_entries[0].word)
+        with self.assertRaises(IndexError):
+            store[len(list_entries)]
+
+    def test_shared_values_are_stored_once(self):
+        list_entries = self.corpus_entries()
+        store = EntryStore(list_entries * 2)
+        self.assertEqual(list(store), list_entries * 2)
+        vocabulary_size = len(store.vocab)
+        store.add_all(list_entries)
+        self.assertEqual(len(store.vocab), vocabulary_size)
+
+    def test_keywords_forms(self):
+        # the keywords of a definition are one Keywords, or a list of them
+        list_defns = [
+            WordDefinition(defn='one', keywords=Keywords(grammar=['transitive'])),
+            WordDefinition(defn='none'),
+            WordDefinition(defn='many', keywords=[Keywords(style=['formal']), Keywords(dialect=['US'])]),
+        ]
+        dict_entry = DictEntry(word='run', defns=list_defns)
+        self.assertEqual(EntryStore([dict_entry])[0], dict_entry)
+
+    def test_full_vocabulary(self):
+        vocabulary = Vocabulary()
+        for number in range(MAX_CODE):
+            vocabulary.code(str(number))
+        self.assertEqual(vocabulary.code('0'), 1)
+        with self.assertRaises(OverflowError):
+            vocabulary.code('one too many')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import unittest
+
+import serialize
+from stubs import page_scraper, load_corpus, ReplayServer
+from tests import CORPUS
+from transport import Transport
+
+
+class EnginesTest(unittest.TestCase):
+    def test_corpus_pages_parse_the_same(self):
+        for category, path in load_corpus(CORPUS):
+            with self.subTest(path=path):
+                scraped_bs4 = page_scraper(path, engine='bs4').extract()
+                scraped_lxml = page_scraper(path, engine='lxml').extract()
+                self.assertEqual(serialize.canonical(scraped_bs4), serialize.canonical(scraped_lxml))
+
+    def test_huge_page_senses(self):
+        path = os.path.join(CORPUS, 'huge', 'set_1.html')
+        list_entries = page_scraper(path, engine='lxml').extract()
+        self.assertEqual(len(list_entries[0].defns), 48)
+
+    def test_lookups_give_the_same_entries(self):
+        with ReplayServer(CORPUS) as replay:
+            scraper_class = replay.scraper_class()
+            transport = Transport()
+            for word in ('run', 'set', 'runx'):
+                with self.subTest(word=word):
+                    dict_results = {
+                        engine: serialize.canonical(scraper_class(word, engine=engine, transport=transport).extract())
+                        for engine in scraper_class.engines
+                    }
+                    self.assertEqual(dict_results['bs4'], dict_results['lxml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
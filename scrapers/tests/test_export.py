@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from batch import BatchLookup
+from export import Checkpoint, ParquetWriter, export, make_record
+from stubs import ReplayServer
+from tests import CORPUS
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.replay = ReplayServer(CORPUS)
+        self.replay.__enter__()
+        self.addCleanup(self.replay.__exit__, None, None, None)
+        patcher = mock.patch.object(BatchLookup, 'scraper_class', self.replay.scraper_class())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_records(self, path):
+        with open(path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_resume_tries_the_failed_words_again(self):
+        output = os.path.join(self.temp_dir, 'dictionary.jsonl')
+        checkpoint_path = os.path.join(self.temp_dir, 'checkpoint.json')
+        list_words = ['run', 'nosuchword', 'set', 'runx']
+
+        self.assertEqual(export(list_words, output, checkpoint=checkpoint_path, rate=0), 4)
+        checkpoint = Checkpoint(checkpoint_path)
+        self.assertEqual([checkpoint.is_done(index) for index in range(4)], [True, False, True, True])
+        self.assertEqual(
+            sorted((record['index'], record['status']) for record in self.read_records(output)),
+            [(0, 'found'), (1, 'failed'), (2, 'found'), (3, 'not_found')]
+        )
+
+        # the word fails again, only its search is made
+        requests_before = self.replay.requests
+        self.assertEqual(export(list_words, output, checkpoint=checkpoint_path, rate=0), 1)
+        self.assertEqual(self.replay.requests - requests_before, 1)
+        list_records = self.read_records(output)
+        self.assertEqual(len(list_records), 5)
+        self.assertEqual((list_records[-1]['index'], list_records[-1]['status']), (1, 'failed'))
+
+    def test_parquet_parts_are_readable_after_a_crash(self):
+        import pyarrow.parquet as pq
+
+        directory = os.path.join(self.temp_dir, 'dictionary')
+        record = make_record(0, 'runx', ValueError('no page'))
+        writer = ParquetWriter(directory, row_group_size=1)
+        writer.write(record)
+        writer.flush()
+        # a crash leaves the second part open
+        writer.write(dict(record, index=1))
+        self.assertEqual(sorted(os.listdir(directory)), ['_part-00001.parquet', 'part-00000.parquet'])
+        self.assertEqual(pq.read_table(directory).column('index').to_pylist(), [0])
+
+        writer = ParquetWriter(directory, append=True)
+        writer.write(dict(record, index=1))
+        writer.close()
+        self.assertEqual(sorted(os.listdir(directory)), ['part-00000.parquet', 'part-00001.parquet'])
+        self.assertEqual(sorted(pq.read_table(directory).column('index').to_pylist()), [0, 1])
+
+    def test_parquet_export(self):
+        import pyarrow.parquet as pq
+
+        directory = os.path.join(self.temp_dir, 'dictionary')
+        export(['run', 'runx'], directory, format='parquet', rate=0)
+        table = pq.read_table(directory)
+        self.assertEqual(set(table.column('word').to_pylist()), {'run', 'runx'})
+        self.assertEqual(os.listdir(directory), ['part-00000.parquet'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import json
+import os
+import struct
+import tempfile
+import unittest
+
+import serialize
+from index import IndexBuilder, EntryIndex, MAGIC, VERSION
+from models import DictEntry, Keywords, WordDefinition
+from stubs import page_scraper, load_corpus
+from tests import CORPUS
+
+
+def make_entry(word, defn, grammar=(), freq=''):
+    return DictEntry(
+        word=word,
+        freq=freq,
+        defns=[WordDefinition(defn=defn, number='1', keywords=Keywords(grammar=list(grammar)))],
+    )
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, 'dictionary.idx')
+
+        self.list_entries = []
+        for category, path in load_corpus(CORPUS):
+            if category != 'error':
+                self.list_entries.extend(page_scraper(path).extract())
+        self.list_entries.extend([
+            make_entry('Runner', 'a person who runs', freq='★★'),
+            make_entry('set', 'to put something somewhere', grammar=['transitive']),
+            make_entry('sun', 'the star that gives us light'),
+        ])
+        builder = IndexBuilder()
+        builder.add_all(self.list_entries)
+        builder.write(self.path)
+
+    def open_index(self):
+        index = EntryIndex(self.path)
+        self.addCleanup(index.close)
+        return index
+
+    def test_entries_read_back_the_same(self):
+        index = self.open_index()
+        self.assertEqual(len(index), len(self.list_entries))
+        for entry_id, dict_entry in enumerate(self.list_entries):
+            self.assertEqual(index.entry(entry_id), dict_entry)
+
+    def test_complete(self):
+        index = self.open_index()
+        runner_id = len(self.list_entries) - 3
+        list_matches = index.complete('RUNN')
+        self.assertEqual(list_matches, [('Runner', runner_id)])
+        self.assertEqual([headword for headword, _ in index.complete('ru', limit=100)], ['run'] * runner_id + ['Runner'])
+        self.assertEqual(index.complete('x'), [])
+
+    def test_search(self):
+        index = self.open_index()
+        set_id = len(self.list_entries) - 2
+        self.assertEqual(index.search('PUT something'), [set_id])
+        self.assertEqual(index.search(grammar=['transitive']), [set_id])
+        self.assertEqual(index.search('put', grammar=['intransitive']), [])
+        self.assertEqual(index.search('person', min_freq=2), [set_id - 1])
+        self.assertEqual(index.search('person', min_freq=3), [])
+
+    def test_other_record_format_is_refused(self):
+        with open(self.path, 'r+b') as file:
+            _, header_size = struct.unpack_from('<II', file.read(12), 4)
+            header = json.loads(file.read(header_size))
+            header['record_format'] = serialize.FORMAT_VERSION - 1
+            encoded = json.dumps(header).encode('utf-8')
+            file.seek(0)
+            file.write(MAGIC + struct.pack('<II', VERSION, len(encoded)) + encoded)
+        with self.assertRaises(ValueError):
+            EntryIndex(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import unittest
+
+from models import LazyDictEntry
+from stubs import page_scraper
+from tests import CORPUS
+
+
+class LazyDictEntryTest(unittest.TestCase):
+    def lazy_scraper(self):
+        scraper = page_scraper(os.path.join(CORPUS, 'huge', 'set_1.html'), engine='lxml')
+        scraper.lazy = True
+        return scraper
+
+    def test_same_as_the_parsed_entry(self):
+        dict_entry = page_scraper(os.path.join(CORPUS, 'huge', 'set_1.html'), engine='lxml').extract()[0]
+        lazy_entry = self.lazy_scraper().extract()[0]
+        self.assertIsInstance(lazy_entry, LazyDictEntry)
+        self.assertEqual(lazy_entry.first_defns(3), dict_entry.defns[:3])
+        self.assertEqual(lazy_entry.word, dict_entry.word)
+        self.assertEqual(lazy_entry, dict_entry)
+        self.assertEqual(lazy_entry.materialize(), dict_entry)
+
+    def test_unhashable_without_parsing(self):
+        lazy_entry = self.lazy_scraper().extract()[0]
+        with self.assertRaises(TypeError):
+            hash(lazy_entry)
+        self.assertEqual(repr(lazy_entry), 'LazyDictEntry(parsed=[])')
+
+
+if __name__ == '__main__':
+    unittest.main()
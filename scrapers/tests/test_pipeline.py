@@ -0,0 +1,64 @@
+import json
+import pickle
+import unittest
+
+import requests
+
+import serialize
+from pipeline import ParsePipeline, PageParseError, parse_page
+from stubs import ReplayServer
+from tests import CORPUS
+from transport import Transport
+
+
+class ParsePipelineTest(unittest.TestCase):
+    def run_pipeline(self, replay, words, **options):
+        pipeline = ParsePipeline(fetch_workers=2, parse_workers=1, transport=Transport(), **options)
+        pipeline.scraper_class = replay.scraper_class(pipeline.scraper_class)
+        return pipeline, list(pipeline.run(words))
+
+    def test_same_results_as_the_scraper(self):
+        with ReplayServer(CORPUS) as replay:
+            pipeline, list_results = self.run_pipeline(replay, ['run', 'set', 'runx', 'nosuchword'], engine='lxml')
+            scraper_class = replay.scraper_class()
+            dict_results = dict(list_results)
+            self.assertEqual(sorted(dict_results), ['nosuchword', 'run', 'runx', 'set'])
+            for word in ('run', 'set', 'runx'):
+                with self.subTest(word=word):
+                    expected = scraper_class(word, transport=Transport()).extract()
+                    self.assertEqual(serialize.canonical(dict_results[word]), serialize.canonical(expected))
+        # a failed word does not stop the run
+        self.assertIsInstance(dict_results['nosuchword'], requests.HTTPError)
+
+    def test_related_entries_in_flight_are_shared(self):
+        with ReplayServer(CORPUS) as replay:
+            pipeline, list_results = self.run_pipeline(replay, ['run', 'set'] * 3, memo=True)
+        self.assertEqual(len(list_results), 6)
+        self.assertEqual(pipeline.executed, 2)
+        self.assertEqual(pipeline.stats()['saved'], 10)
+        # six searches, and the two related entries once
+        self.assertEqual(replay.requests, 8)
+
+    def test_source_from_the_registry(self):
+        content = json.dumps([{
+            'word': 'run',
+            'phonetics': [],
+            'meanings': [{'partOfSpeech': 'verb', 'definitions': [{'definition': 'to move fast'}]}],
+        }]).encode('utf-8')
+        result, list_slugs = parse_page('http://example.test/run', content, source='freedictionary')
+        self.assertEqual(list_slugs, [])
+        self.assertEqual(result[0].word, 'run')
+        self.assertEqual(result[0].defns[0].defn, 'to move fast')
+
+        with self.assertRaises(KeyError):
+            ParsePipeline(source='nosuchsource')
+
+    def test_parse_errors_are_picklable(self):
+        # lxml errors are not: they would not come back from a parser process
+        with self.assertRaises(PageParseError) as context:
+            parse_page('http://example.test/empty', b'', engine='lxml')
+        self.assertEqual(str(pickle.loads(pickle.dumps(context.exception))), str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cache import EntryCache
+from refresh import Refresher, ValidatorStore
+from stubs import ReplayServer
+from tests import CORPUS
+from transport import Transport
+
+
+class RefreshTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.corpus = os.path.join(temp_dir.name, 'corpus')
+        shutil.copytree(CORPUS, self.corpus)
+        self.validators = ValidatorStore(os.path.join(temp_dir.name, 'validators.sqlite'))
+        self.entry_cache = EntryCache(os.path.join(temp_dir.name, 'entries.sqlite'))
+        self.addCleanup(self.validators.close)
+        self.addCleanup(self.entry_cache.close)
+
+    def refresher(self, replay):
+        refresher = Refresher(self.validators, self.entry_cache, transport=Transport())
+        refresher.scraper_class = replay.scraper_class()
+        return refresher
+
+    def test_unchanged_pages_are_revalidated(self):
+        with ReplayServer(self.corpus) as replay:
+            first = self.refresher(replay)
+            self.assertEqual(list(first.refresh(['run', 'runx'])), [('run', 'updated'), ('runx', 'updated')])
+            self.assertEqual(replay.not_modified, 0)
+
+            second = self.refresher(replay)
+            self.assertEqual(list(second.refresh(['run', 'runx'])), [('run', 'skipped'), ('runx', 'skipped')])
+
+        # the main and two related pages of run, and the search of runx
+        self.assertEqual(replay.not_modified, 4)
+        self.assertEqual(second.report.not_modified, 4)
+        self.assertEqual(second.report.words_skipped, 2)
+        self.assertEqual(second.report.bytes_downloaded, 0)
+        self.assertEqual(second.report.bytes_saved, first.report.bytes_downloaded)
+
+    def test_changed_related_page_is_parsed_again(self):
+        with ReplayServer(self.corpus) as replay:
+            list(self.refresher(replay).refresh(['run']))
+            path = os.path.join(self.corpus, 'small', 'run_2.html')
+            with open(path, encoding='utf-8') as file:
+                content = file.read()
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(content.replace('an act of running', 'a period of running'))
+
+            refresher = self.refresher(replay)
+            self.assertEqual(list(refresher.refresh(['run'])), [('run', 'updated')])
+
+        self.assertEqual(refresher.report.not_modified, 2)
+        self.assertEqual(refresher.report.pages_changed, 1)
+        scraper = refresher.scraper_class('run')
+        list_entries = self.entry_cache.get(scraper.entry_key())
+        self.assertTrue(any('a period of running' in defn.defn for defn in list_entries[2].defns))
+
+
+if __name__ == '__main__':
+    unittest.main()
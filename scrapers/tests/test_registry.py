@@ -0,0 +1,71 @@
+import time
+import unittest
+
+import registry
+from models import ErrorList
+from registry import FanOut, SourceTimeout, get_source, register, sources
+from scraper import DictScraper
+from stubs import ReplayServer
+from tests import CORPUS
+from transport import Transport
+
+
+class IncompleteScraper(DictScraper):
+    name = 'incomplete'
+
+    def is_error_page(self) -> bool:
+        return False
+
+
+class SlowScraper(DictScraper):
+    name       = 'slow'
+    search_url = 'http://example.test/{word}'
+
+    def load(self):
+        time.sleep(1)
+
+    def is_error_page(self) -> bool:
+        return True
+
+    def parse_word_page(self):
+        return []
+
+    def parse_error_page(self):
+        return ErrorList(texts=['too late'])
+
+
+class RegistryTest(unittest.TestCase):
+    def add_source(self, scraper_class):
+        register(scraper_class)
+        self.addCleanup(registry.REGISTRY.pop, scraper_class.name)
+
+    def test_builtin_sources(self):
+        self.assertEqual(sources()[:2], ['macmillan', 'freedictionary'])
+        with self.assertRaises(KeyError):
+            get_source('nosuchsource')
+
+    def test_incomplete_scraper_is_refused(self):
+        with self.assertRaises(TypeError):
+            IncompleteScraper('run')
+        with self.assertRaises(TypeError):
+            register(IncompleteScraper)
+        self.assertNotIn('incomplete', sources())
+
+    def test_fan_out(self):
+        with ReplayServer(CORPUS) as replay:
+            replay_class = replay.scraper_class(get_source('macmillan'))
+            replay_class.name = 'replay'
+            self.add_source(replay_class)
+            self.add_source(SlowScraper)
+
+            fan_out = FanOut(names=['replay', 'slow'], timeout=0.3, transport=Transport())
+            start = time.monotonic()
+            dict_results = fan_out.all('run')
+        # the slow source does not hold the other back
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual([entry.word for entry in dict_results['replay']], ['run'] * 3)
+        self.assertIsInstance(dict_results['slow'], SourceTimeout)
+
+
+if __name__ == '__main__':
+    unittest.main()
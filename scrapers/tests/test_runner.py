@@ -0,0 +1,206 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import requests
+
+import serialize
+from runner import BatchRunner, BreakerTransport, CircuitBreaker, DeadLetters, ServerError, read_dead_letters
+from runner import CLOSED, OPEN, HALF_OPEN
+from stubs import page_scraper, corrupt_pages, ReplayServer
+from tests import CORPUS
+from transport import Transport
+
+
+class FailOnceTransport():
+    """Wraps a transport, raising a ServerError on the first request
+    to the urls ending with `suffix`"""
+    def __init__(self, transport, suffix):
+        self.transport = transport
+        self.suffix    = suffix
+        self.failed    = False
+
+    def get(self, url, timeout=None, headers=None):
+        if url.endswith(self.suffix) and not self.failed:
+            self.failed = True
+            raise ServerError(f'503 for {url}')
+        return self.transport.get(url, timeout=timeout, headers=headers)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_trips_on_errors(self):
+        breaker = CircuitBreaker(window=10, threshold=0.5, min_requests=4, cooldown=0.05)
+        for ok in (True, False, True, False):
+            breaker.before()
+            breaker.record(ok)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.trips, 1)
+
+    def test_probe_closes_or_doubles_the_cooldown(self):
+        breaker = CircuitBreaker(min_requests=1, cooldown=0.05, max_cooldown=0.15)
+        breaker.record(False)
+        self.assertEqual(breaker.state, OPEN)
+
+        start = time.monotonic()
+        breaker.before()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.record(False)
+        self.assertEqual((breaker.state, breaker.trips), (OPEN, 2))
+        self.assertEqual(breaker._cooldown, 0.1)
+
+        breaker.before()
+        breaker.record(False)
+        # up to max_cooldown
+        self.assertEqual(breaker._cooldown, 0.15)
+
+        breaker.before()
+        breaker.record(True)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker._cooldown, 0.05)
+        self.assertGreater(breaker.stats()['paused_seconds'], 0.25)
+
+
+class SalvageTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.corpus = os.path.join(temp_dir.name, 'corpus')
+        corrupt_pages(CORPUS, self.corpus)
+
+    def test_broken_senses_are_left_out(self):
+        path = os.path.join(self.corpus, 'huge', 'broken.html')
+        dict_results = {}
+        for engine in ('bs4', 'lxml'):
+            with self.assertRaises(IndexError):
+                page_scraper(path, engine=engine).extract()
+            scraper = page_scraper(path, engine=engine)
+            scraper.salvage = True
+            list_entries = scraper.extract()
+            dict_results[engine] = serialize.canonical(list_entries)
+
+            # the two failed senses, each with its two sub-senses
+            self.assertEqual(len(list_entries[0].defns), 46)
+            self.assertEqual(len(scraper.salvage_errors), 6)
+            self.assertEqual(sum('sub-sense of a sense that failed' in error for error in scraper.salvage_errors), 4)
+            self.assertEqual(sum(len(defn.subdefns) for defn in list_entries[0].defns), 44)
+        self.assertEqual(dict_results['bs4'], dict_results['lxml'])
+
+    def test_orphan_page_parses(self):
+        path = os.path.join(self.corpus, 'huge', 'orphan.html')
+        for engine in ('bs4', 'lxml'):
+            scraper = page_scraper(path, engine=engine)
+            scraper.salvage = True
+            self.assertEqual(len(scraper.extract()[0].defns), 48)
+            self.assertEqual(scraper.salvage_errors, [])
+
+    def runner(self, replay, transport, dead_path, retries=8):
+        runner = BatchRunner(transport, DeadLetters(dead_path), workers=2, retries=retries, backoff=0.01)
+        runner.scraper_class = replay.scraper_class()
+        self.addCleanup(runner.dead_letters.close)
+        return runner
+
+    def test_flaky_site(self):
+        dead_path = os.path.join(self.temp_dir, 'dead.jsonl')
+        list_words = ['run', 'set', 'broken', 'orphan', 'runx', 'nosuchword']
+        with ReplayServer(self.corpus, failure_rate=0.3) as replay:
+            transport = BreakerTransport(Transport(retries=0), min_requests=1000)
+            runner = self.runner(replay, transport, dead_path)
+            dict_records = {record['word']: record for record in runner.run(list_words)}
+        runner.dead_letters.close()
+
+        self.assertGreater(replay.failures, 0)
+        self.assertEqual(runner.counts['retries'], replay.failures)
+        self.assertEqual(
+            {word: record['status'] for word, record in dict_records.items()},
+            {'run': 'found', 'set': 'found', 'broken': 'found', 'orphan': 'found', 'runx': 'not_found', 'nosuchword': 'failed'}
+        )
+        self.assertEqual(runner.counts['partial'], 1)
+        self.assertEqual([word for word, record in dict_records.items() if 'salvage_errors' in record], ['broken'])
+        # 503s are tried again, never salvaged
+        self.assertFalse(any('503' in error for error in dict_records['broken']['salvage_errors']))
+        self.assertEqual(len(dict_records['broken']['entries']), 3)
+        self.assertEqual(len(dict_records['broken']['entries'][0]['defns']), 46)
+
+        with open(dead_path, encoding='utf-8') as file:
+            list_dead = [json.loads(line) for line in file]
+        self.assertEqual([(dead['word'], dead['status']) for dead in list_dead if dead['word'] == 'broken'], [('broken', 'partial')])
+        self.assertEqual(sorted(dead['word'] for dead in list_dead), ['broken', 'nosuchword'])
+        # a missing page fails the lookup, it is not parsed
+        list_errors = [dead['errors'] for dead in list_dead if dead['word'] == 'nosuchword'][0]
+        self.assertEqual(len(list_errors), 1)
+        self.assertTrue(list_errors[0].startswith("HTTPError('404 Client Error"))
+
+    def test_related_server_error_is_retried(self):
+        dead_path = os.path.join(self.temp_dir, 'dead.jsonl')
+        with ReplayServer(self.corpus) as replay:
+            transport = FailOnceTransport(Transport(retries=0), '/run_2')
+            runner = self.runner(replay, transport, dead_path, retries=1)
+            list_records = list(runner.run(['run']))
+        self.assertTrue(transport.failed)
+        self.assertEqual(list_records[0]['status'], 'found')
+        self.assertNotIn('salvage_errors', list_records[0])
+        self.assertEqual(len(list_records[0]['entries']), 3)
+        self.assertEqual(runner.counts['retries'], 1)
+
+    def test_related_page_answered_with_a_503(self):
+        dead_path = os.path.join(self.temp_dir, 'dead.jsonl')
+        with ReplayServer(self.corpus) as replay:
+            replay.failing.add('run_2')
+            scraper = replay.scraper_class()('run', transport=Transport(retries=0), salvage=True)
+            with self.assertRaises(requests.HTTPError) as context:
+                scraper.extract()
+            self.assertEqual(context.exception.response.status_code, 503)
+            self.assertEqual(scraper.salvage_errors, [])
+
+            # a plain transport: the runner tries the 503 again, then fails the word
+            runner = self.runner(replay, Transport(retries=0), dead_path, retries=2)
+            list_records = list(runner.run(['run']))
+            runner.dead_letters.close()
+            self.assertEqual(list_records[0]['status'], 'failed')
+            self.assertIn('503', list_records[0]['reason'])
+            self.assertEqual(runner.counts['retries'], 2)
+            with open(dead_path, encoding='utf-8') as file:
+                list_dead = [json.loads(line) for line in file]
+            self.assertEqual([(dead['status'], dead['attempts']) for dead in list_dead], [('failed', 3)])
+
+            replay.failing.clear()
+            retry_runner = self.runner(replay, Transport(retries=0), os.path.join(self.temp_dir, 'dead-2.jsonl'))
+            list_retried = list(retry_runner.run(read_dead_letters(dead_path)))
+        self.assertEqual(list_retried[0]['status'], 'found')
+        self.assertNotIn('salvage_errors', list_retried[0])
+        self.assertEqual(len(list_retried[0]['entries']), 3)
+
+    def test_breaker_pauses_a_site_that_is_down(self):
+        dead_path = os.path.join(self.temp_dir, 'dead.jsonl')
+        with ReplayServer(self.corpus) as replay:
+            transport = BreakerTransport(
+                Transport(retries=0), min_requests=4, cooldown=0.05, max_cooldown=0.2
+            )
+            replay.down = True
+            runner = self.runner(replay, transport, dead_path, retries=3)
+            list_records = list(runner.run(['run', 'set', 'orphan']))
+            runner.dead_letters.close()
+
+            self.assertEqual([record['status'] for record in list_records], ['failed'] * 3)
+            dict_breaker = transport.stats()[replay.base_url[len('http://'):]]
+            self.assertGreaterEqual(dict_breaker['trips'], 2)
+            self.assertGreater(dict_breaker['paused_seconds'], 0)
+            with open(dead_path, encoding='utf-8') as file:
+                list_dead = [json.loads(line) for line in file]
+            self.assertEqual([dead['attempts'] for dead in list_dead], [4] * 3)
+
+            # the dead letters, run again once the site is back
+            replay.down = False
+            retry_runner = self.runner(replay, transport, os.path.join(self.temp_dir, 'dead-2.jsonl'))
+            list_retried = list(retry_runner.run(read_dead_letters(dead_path)))
+        self.assertEqual(sorted(record['word'] for record in list_retried), ['orphan', 'run', 'set'])
+        self.assertEqual([record['status'] for record in list_retried], ['found'] * 3)
+        self.assertEqual(transport.breaker(replay.base_url).state, CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
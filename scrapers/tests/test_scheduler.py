@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from scheduler import Scheduler, DeadlineExceeded, INTERACTIVE, BULK
+from stubs import ThrottlingServer
+from transport import Transport
+
+
+class CountingTransport():
+    """Wraps a transport and keeps the most requests it had in flight"""
+    def __init__(self, transport):
+        self.transport     = transport
+        self.in_flight     = 0
+        self.max_in_flight = 0
+        self._lock         = threading.Lock()
+
+    def get(self, url, timeout=None, headers=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return self.transport.get(url, timeout=timeout, headers=headers)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class RedirectLoopTransport():
+    def get(self, url, timeout=None, headers=None):
+        raise requests.TooManyRedirects(f'redirect loop for {url}')
+
+
+class SchedulerTest(unittest.TestCase):
+    def fetch_all(self, transport, base_url, num_requests=40, threads=8):
+        with ThreadPoolExecutor(threads) as pool:
+            return list(pool.map(
+                lambda index: transport.get(f'{base_url}/bulk/{index}', timeout=10).status_code,
+                range(num_requests)
+            ))
+
+    def test_requests_under_the_rate_are_not_throttled(self):
+        with ThrottlingServer(capacity=20, delay=0.01) as server:
+            scheduler = Scheduler(rate=15, burst=4, max_concurrency=4)
+            counting = CountingTransport(Transport(pool_maxsize=8, retries=0))
+            list_statuses = self.fetch_all(scheduler.transport(BULK, transport=counting), server.base_url)
+
+        self.assertEqual(list_statuses, [200] * 40)
+        self.assertEqual(server.throttled, 0)
+        self.assertLessEqual(counting.max_in_flight, 4)
+        host_stats = scheduler.stats()[server.base_url[len('http://'):]]
+        self.assertEqual(host_stats['in_flight'], 0)
+        self.assertEqual(host_stats['queued'], 0)
+
+    def test_throttled_responses_back_off(self):
+        with ThrottlingServer(capacity=5, delay=0.01, retry_after=0) as server:
+            scheduler = Scheduler(rate=0, initial_concurrency=8, max_concurrency=8)
+            transport = scheduler.transport(BULK, transport=Transport(pool_maxsize=8, retries=0), max_attempts=2)
+            list_statuses = self.fetch_all(transport, server.base_url)
+
+        self.assertEqual(len(list_statuses), 40)
+        self.assertGreater(server.throttled, 0)
+        # every 429 was seen and given back by the scheduler
+        self.assertEqual(scheduler.throttled, server.throttled)
+        host_stats = scheduler.stats()[server.base_url[len('http://'):]]
+        self.assertEqual(host_stats['in_flight'], 0)
+        self.assertLess(host_stats['limit'], 8)
+
+    def test_failed_request_gives_its_slot_back(self):
+        scheduler = Scheduler(rate=0, initial_concurrency=1)
+        transport = scheduler.transport(BULK, transport=RedirectLoopTransport())
+        for _ in range(3):
+            with self.assertRaises(requests.TooManyRedirects):
+                transport.get('http://example.test/loop')
+        host_stats = scheduler.stats()['example.test']
+        self.assertEqual(host_stats['in_flight'], 0)
+        self.assertEqual(host_stats['limit'], 1)
+        self.assertEqual(scheduler.throttled, 0)
+
+    def test_deadline_while_waiting(self):
+        scheduler = Scheduler(rate=0, initial_concurrency=1)
+        host = scheduler.acquire('http://example.test/busy')
+        with self.assertRaises(DeadlineExceeded):
+            scheduler.acquire('http://example.test/late', deadline=time.monotonic() + 0.05)
+        self.assertEqual(scheduler.stats()['example.test']['queued'], 0)
+        scheduler.release(host)
+        self.assertEqual(scheduler.stats()['example.test']['in_flight'], 0)
+
+    def test_interactive_requests_go_first(self):
+        scheduler = Scheduler(rate=0, initial_concurrency=1)
+        busy_host = scheduler.acquire('http://example.test/busy')
+        list_started = []
+
+        def request(name, priority):
+            host = scheduler.acquire(f'http://example.test/{name}', priority=priority)
+            list_started.append(name)
+            scheduler.release(host)
+
+        def wait_queued(num_queued):
+            while scheduler.stats()['example.test']['queued'] < num_queued:
+                time.sleep(0.001)
+
+        list_threads = [
+            threading.Thread(target=request, args=('bulk', BULK)),
+            threading.Thread(target=request, args=('interactive', INTERACTIVE)),
+        ]
+        for num_queued, thread in enumerate(list_threads, 1):
+            thread.start()
+            wait_queued(num_queued)
+        scheduler.release(busy_host)
+        for thread in list_threads:
+            thread.join()
+        self.assertEqual(list_started, ['interactive', 'bulk'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from batch import BatchLookup
+from singleflight import canonical_url, SingleFlight, BatchMemo, AsyncSingleFlight, AsyncBatchMemo
+from stubs import ReplayServer
+from tests import CORPUS
+from transport import Transport
+
+
+class SingleFlightTest(unittest.TestCase):
+    def run_threads(self, flight, func, threads=8):
+        with ThreadPoolExecutor(threads) as pool:
+            list_futures = [pool.submit(flight.do, 'key', func) for _ in range(threads)]
+        return list_futures
+
+    def wait_shared(self, flight, num_shared):
+        # the call runs until every other thread waits for it
+        deadline = time.monotonic() + 5
+        while flight.shared < num_shared and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def test_concurrent_calls_run_once(self):
+        flight = SingleFlight()
+        list_calls = []
+
+        def func():
+            list_calls.append(threading.get_ident())
+            self.wait_shared(flight, 7)
+            return ['result']
+
+        list_futures = self.run_threads(flight, func)
+        list_results = [future.result() for future in list_futures]
+        self.assertEqual(len(list_calls), 1)
+        self.assertEqual(flight.stats(), {'executed': 1, 'shared': 7})
+        self.assertTrue(all(result is list_results[0] for result in list_results))
+
+        # the key is not remembered once its call is done
+        flight.do('key', func)
+        self.assertEqual(flight.executed, 2)
+
+    def test_exception_is_shared(self):
+        flight = SingleFlight()
+
+        def func():
+            self.wait_shared(flight, 3)
+            raise ValueError('no page')
+
+        for future in self.run_threads(flight, func, threads=4):
+            with self.assertRaises(ValueError):
+                future.result()
+        self.assertEqual(flight.stats(), {'executed': 1, 'shared': 3})
+
+    def test_batch_memo(self):
+        memo = BatchMemo()
+
+        def func():
+            self.wait_shared(memo.flight, 7)
+            return 'result'
+
+        list_futures = self.run_threads(memo, func)
+        self.assertEqual({future.result() for future in list_futures}, {'result'})
+        self.assertEqual(memo.do('key', lambda: 'other'), 'result')
+        self.assertEqual(memo.stats(), {'executed': 1, 'shared': 7, 'hits': 1, 'saved': 8})
+
+    def test_canonical_url(self):
+        self.assertEqual(
+            canonical_url('HTTPS://Www.Example.test/dictionary/american/run_1/#top'),
+            canonical_url('https://www.example.test/dictionary/american/run_1'),
+        )
+
+
+class AsyncSingleFlightTest(unittest.TestCase):
+    def test_concurrent_calls_run_once(self):
+        flight = AsyncSingleFlight()
+        list_calls = []
+
+        async def func():
+            list_calls.append(None)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        async def run():
+            return await asyncio.gather(*(flight.do('key', func) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ['result'] * 5)
+        self.assertEqual(len(list_calls), 1)
+        self.assertEqual(flight.stats(), {'executed': 1, 'shared': 4})
+
+    def test_call_is_cancelled_with_its_last_waiter(self):
+        flight = AsyncSingleFlight()
+
+        async def func():
+            await asyncio.sleep(10)
+
+        async def run():
+            first  = asyncio.ensure_future(flight.do('key', func))
+            second = asyncio.ensure_future(flight.do('key', func))
+            await asyncio.sleep(0)
+            # the other waiter keeps the call running
+            first.cancel()
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(asyncio.all_tasks()), 3)
+            second.cancel()
+            await asyncio.gather(first, second, return_exceptions=True)
+            return asyncio.all_tasks()
+
+        self.assertEqual(len(asyncio.run(run())), 1)
+        self.assertEqual(flight._calls, {})
+
+    def test_batch_lookup_shares_the_related_entries(self):
+        with ReplayServer(CORPUS, delay=0.01) as replay:
+            memo = AsyncBatchMemo()
+            batch = BatchLookup(rate=0, transport=Transport(), memo=memo)
+            batch.scraper_class = replay.scraper_class()
+
+            async def run():
+                return [word async for word, _ in batch.lookup_many(['run', 'set', 'run', 'set'])]
+
+            self.assertEqual(sorted(asyncio.run(run())), ['run', 'run', 'set', 'set'])
+        # four searches, and the two related entries (run_1, run_2) once each
+        self.assertEqual(replay.requests, 6)
+        self.assertEqual(memo.stats()['executed'], 2)
+        self.assertEqual(memo.stats()['saved'], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from stubs import ReplayServer
+from tests import CORPUS
+from transport import Transport
+
+
+class TransportTest(unittest.TestCase):
+    def test_sequential_lookups_reuse_one_connection(self):
+        with ReplayServer(CORPUS) as replay:
+            scraper_class = replay.scraper_class()
+            transport = Transport()
+            for _ in range(5):
+                scraper_class('run', recursive=False, transport=transport).extract()
+        self.assertEqual(replay.requests, 5)
+        self.assertEqual(replay.connections, 1)
+
+    def test_connections_do_not_grow_with_lookups(self):
+        # the related pages are fetched in parallel, each on a pooled connection
+        with ReplayServer(CORPUS) as replay:
+            scraper_class = replay.scraper_class()
+            transport = Transport()
+            for _ in range(5):
+                list_entries = scraper_class('run', transport=transport).extract()
+                self.assertEqual([entry.word for entry in list_entries], ['run', 'run', 'run'])
+        self.assertEqual(replay.requests, 15)
+        self.assertLessEqual(replay.connections, 2)
+
+    def test_unavailable_site_is_retried(self):
+        with ReplayServer(CORPUS) as replay:
+            replay.down = True
+            transport = Transport(retries=2, backoff_factor=0)
+            response = transport.get(replay.base_url + '/dictionary/american/run_1')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(replay.requests, 3)
+
+    def test_error_page(self):
+        with ReplayServer(CORPUS) as replay:
+            error_list = replay.scraper_class()('runx', transport=Transport()).extract()
+        self.assertEqual(error_list.wordlist, ['run', 'runs', 'rune'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import threading
+
+
+DEFAULT_HEADERS = {
+    "User-Agent" : "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36"
+}
+
+
+class Transport():
+    """A keep-alive HTTP transport shared by scrapers.
+
+    Connections are pooled per host, so consecutive lookups against the
+    same dictionary reuse the same TCP/TLS connection. Responses with
+    a 429 or 5xx status are retried with exponential backoff.
+
+    Attributes:
+        pool_connections    number of per-host pools to keep
+        pool_maxsize        connections kept alive in each host pool
+        retries             retries for failed connections and 429/5xx
+        backoff_factor      base delay (in seconds) between retries
+        headers             headers sent with every request
+    """
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_connections=4, pool_maxsize=8, retries=3,
+            backoff_factor=0.5, headers=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize     = pool_maxsize
+        self.retries          = retries
+        self.backoff_factor   = backoff_factor
+        self.headers          = dict(DEFAULT_HEADERS if headers is None else headers)
+        self._session         = self._create_session()
+
+    def _create_session(self):
+        # requests is only loaded by the first transport, so that the
+        # cache readers importing make_response do not pay for it
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.retry_statuses,
+            allowed_methods=('GET', 'HEAD'),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self, url, timeout=None, headers=None):
+        return self._session.get(url, headers=headers, timeout=timeout)
+
+    def head(self, url, timeout=None, headers=None):
+        return self._session.head(url, headers=headers, timeout=timeout)
+
+    def close(self):
+        self._session.close()
+
+
+def make_response(url, content, status_code=200, headers=None):
+    """Build a requests.Response from a body that was not fetched
+    (e.g. a page read from a cache)
+    """
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    response = requests.Response()
+    response.url         = url
+    response.status_code = status_code
+    response.headers     = CaseInsensitiveDict(headers or {})
+    response._content    = content
+    response.encoding    = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def default_transport() -> Transport:
+    """Return the process-wide transport used when none is given."""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
+
+
+def set_default_transport(transport):
+    """Replace the process-wide transport (e.g. to change pool sizes)."""
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
@@ -1,8 +1,23 @@
-from bs4 import BeautifulSoup as Soup
-import lxml
-import cchardet
+from html import escape
 
-from models import *
+from models import (
+    ExampleGroup,
+    WordDefinition,
+    DictEntry,
+    Phonetics,
+    Keywords
+)
+import metrics
+
+
+def _text(string) -> str:
+    return escape(string, quote=False)
+
+
+def _soup(markup):
+    # bs4 is only needed by convert, streaming does not load it
+    from bs4 import BeautifulSoup as Soup
+    return Soup(markup, 'lxml')
 
 
 class ExampleGroupToHTML():
@@ -18,37 +33,33 @@ class ExampleGroupToHTML():
     def __init__(self, example_group: ExampleGroup):
         self.example_group = example_group
 
-    def convert(self) -> None:
-        soup = Soup('<div></div>', 'lxml')
-        soup.div['class'] = 'example-group-container'
-
-        div_pattern = soup.new_tag('div', **{'class': 'pattern'})
-        div_pattern.string = self.example_group.pattern
-        soup.div.append(div_pattern)
-
-        ul_examples = soup.new_tag('ul', **{'class': 'examples'})
+    def stream(self):
+        yield '<div class="example-group-container">'
+        yield f'<div class="pattern">{_text(self.example_group.pattern)}</div>'
+        yield '<ul class="examples">'
         for example in self.example_group.examples:
-            li_example = soup.new_tag('li')
-            li_example.string = example
-            ul_examples.append(li_example)
-        soup.div.append(ul_examples)
-        return soup.div
+            yield f'<li>{_text(example)}</li>'
+        yield '</ul></div>'
+
+    @metrics.timed('render.ExampleGroupToHTML.convert')
+    def convert(self) -> None:
+        return _soup(''.join(self.stream())).div
 
 class KeywordsToHTML():
     def __init__(self, keywords: Keywords):
         self.keywords = keywords
 
-    def convert(self):
-        soup = Soup('<div></div>', 'lxml')
-        soup.div['class'] = 'keywords-container'
-
+    def stream(self):
+        yield '<div class="keywords-container">'
         for keyword_type in (self.keywords.grammar, self.keywords.style,
                 self.keywords.dialect, self.keywords.warnings):
             for keyword in keyword_type:
-                span_keyword = soup.new_tag('span')
-                span_keyword.string = keyword + ','
-                soup.div.append(span_keyword)
-        return soup.div
+                yield f'<span>{_text(keyword)},</span>'
+        yield '</div>'
+
+    @metrics.timed('render.KeywordsToHTML.convert')
+    def convert(self):
+        return _soup(''.join(self.stream())).div
 
 class WordDefinitionToHTML():
     """Convert a WordDefinition object to HTML
@@ -65,40 +76,37 @@ class WordDefinitionToHTML():
     def __init__(self, word_definition: WordDefinition):
         self.word_definition = word_definition
 
-    def convert(self):
-        soup = Soup('<div></div>', 'lxml')
-        soup.div['class'] = 'word-definition-container'
-        
+    def stream(self):
+        yield '<div class="word-definition-container">'
+
         # div.number
-        div_number = soup.new_tag('div', **{'class': 'number'})
-        div_number.string = str(self.word_definition.number)
-        soup.div.append(div_number)
-        
+        yield f'<div class="number">{_text(str(self.word_definition.number))}</div>'
+
         # div.definition
-        div_defn = soup.new_tag('div', **{'class': 'definition'})
-        div_defn.string = self.word_definition.defn
-        soup.div.append(div_defn)
+        yield f'<div class="definition">{_text(self.word_definition.defn)}</div>'
 
         # div.keywords
-        div_keywords = soup.new_tag('div', **{'class': 'keywords'})
-        converter_keywords = KeywordsToHTML(self.word_definition.keywords)
-        div_keywords.append(converter_keywords.convert())
-        soup.div.append(div_keywords)
+        yield '<div class="keywords">'
+        yield from KeywordsToHTML(self.word_definition.keywords).stream()
+        yield '</div>'
 
         # div.examples
-        div_examples = soup.new_tag('div', **{'class': 'examples'})
+        yield '<div class="examples">'
         for examples in self.word_definition.examples:
-            converter_examples = ExampleGroupToHTML(examples)
-            div_examples.append(converter_examples.convert())
-        soup.div.append(div_examples)
+            yield from ExampleGroupToHTML(examples).stream()
+        yield '</div>'
 
         # div.sub-definitions
-        div_subdefns = soup.new_tag('div', **{'class': 'sub-definitions'})
+        yield '<div class="sub-definitions">'
         for subdefn in self.word_definition.subdefns:
-            converter_defn = WordDefinitionToHTML(subdefn)
-            div_subdefns.append(converter_defn.convert())
-        soup.div.append(div_subdefns)
-        return soup.div
+            yield from WordDefinitionToHTML(subdefn).stream()
+        yield '</div>'
+
+        yield '</div>'
+
+    @metrics.timed('render.WordDefinitionToHTML.convert')
+    def convert(self):
+        return _soup(''.join(self.stream())).div
 
 
 class PhoneticsToHTML():
@@ -113,26 +121,16 @@ class PhoneticsToHTML():
     def __init__(self, phonetics: Phonetics):
         self.phonetics = phonetics
 
-    def convert(self):
-        root = Soup('<div></div>', 'lxml')
-        root.div['class'] = 'phonetics-container'
-
-        # div.spelling
-        div_spelling = root.new_tag('div', **{'class': 'spelling'})
-        div_spelling.string = self.phonetics.spelling
-        root.div.append(div_spelling)
+    def stream(self):
+        yield '<div class="phonetics-container">'
+        yield f'<div class="spelling">{_text(self.phonetics.spelling)}</div>'
+        yield f'<div class="dialect">{_text(self.phonetics.dialect)}</div>'
+        yield f'<div class="qualifier">{_text(self.phonetics.qualifier)}</div>'
+        yield '</div>'
 
-        # div.dialect
-        div_dialect = root.new_tag('div', **{'class': 'dialect'})
-        div_dialect.string = self.phonetics.dialect
-        root.div.append(div_dialect)
-
-        # div.qualifier
-        div_qualifier = root.new_tag('div', **{'class': 'qualifier'})
-        div_qualifier.string = self.phonetics.qualifier
-        root.div.append(div_qualifier)
-
-        return root.div
+    @metrics.timed('render.PhoneticsToHTML.convert')
+    def convert(self):
+        return _soup(''.join(self.stream())).div
 
 
 class DictEntryToHTML():
@@ -151,42 +149,81 @@ class DictEntryToHTML():
     def __init__(self, dict_entry: DictEntry):
         self.dict_entry = dict_entry
 
-    def convert(self):
-        root = Soup('<div></div>', 'lxml')
-        root.div['class'] = 'dict-entry-container'
+    def stream(self):
+        yield '<div class="dict-entry-container">'
 
         # div.word
-        div_word = root.new_tag('div', **{'class': 'word'})
-        div_word.string = self.dict_entry.word
-        root.div.append(div_word)
+        yield f'<div class="word">{_text(self.dict_entry.word)}</div>'
 
         # ul.pos
-        ul_pos = root.new_tag('ul', **{'class': 'part-of-speech'})
+        yield '<ul class="part-of-speech">'
         for word_type in self.dict_entry.pos:
-            li = root.new_tag('li')
-            li.string = word_type
-            ul_pos.append(li)
-        root.div.append(ul_pos)
+            yield f'<li>{_text(word_type)}</li>'
+        yield '</ul>'
 
         # div.phonetics
-        div_phonetics = root.new_tag('div', **{'class': 'phonetics'})
+        yield '<div class="phonetics">'
         for phonetics in self.dict_entry.phonetics:
-            converter = PhoneticsToHTML(phonetics)
-            div_phonetics.append(converter.convert())
-        root.div.append(div_phonetics)
+            yield from PhoneticsToHTML(phonetics).stream()
+        yield '</div>'
 
         # div.keywords
-        div_keywords = root.new_tag('div', **{'class': 'keywords'})
-        converter = KeywordsToHTML(self.dict_entry.keywords)
-        div_keywords.append(converter.convert())
-        root.div.append(div_keywords)
-        
+        yield '<div class="keywords">'
+        yield from KeywordsToHTML(self.dict_entry.keywords).stream()
+        yield '</div>'
+
         # div.defn
-        div_defns = root.new_tag('div', **{'class': 'definitions'})
+        yield '<div class="definitions">'
         for defn in self.dict_entry.defns:
-            converter = WordDefinitionToHTML(defn)
-            div_defns.append(converter.convert())
-        root.div.append(div_defns)
+            yield from WordDefinitionToHTML(defn).stream()
+        yield '</div>'
+
+        yield '</div>'
+
+    @metrics.timed('render.DictEntryToHTML.convert')
+    def convert(self):
+        return _soup(''.join(self.stream()))
 
-        return root
 
+class DictEntriesToHTML():
+    """Render a list of DictEntry objects as a single HTML page
+
+    Structure for reference:
+        html
+            head
+                title
+            body
+                div.dict-entry-container  (one per entry)
+    """
+    def __init__(self, dict_entries, title=''):
+        self.dict_entries = dict_entries
+        self.title        = title
+
+    def stream(self):
+        yield '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        yield f'<title>{_text(self.title)}</title></head><body>'
+        for dict_entry in self.dict_entries:
+            yield from DictEntryToHTML(dict_entry).stream()
+        yield '</body></html>'
+
+    @metrics.timed('render.DictEntriesToHTML.write')
+    def write(self, file, buffer_size=64 * 1024):
+        """
+        Writes the page to a text file (or anything with a write method,
+        e.g. a socket wrapped by makefile), in chunks of about buffer_size
+        """
+        list_chunks = []
+        size = 0
+        for chunk in self.stream():
+            list_chunks.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                file.write(''.join(list_chunks))
+                list_chunks.clear()
+                size = 0
+        if list_chunks:
+            file.write(''.join(list_chunks))
+
+    @metrics.timed('render.DictEntriesToHTML.convert')
+    def convert(self):
+        return _soup(''.join(self.stream()))